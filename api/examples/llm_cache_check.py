@@ -0,0 +1,101 @@
+"""
+LLM のレスポンスキャッシュ (lecturia.chains.llm_cache) を、呼び出し回数を数えるスタブのチャットモデルで確認する。
+SQLite と StorageCacheStore (MemoryStorage) のそれぞれで、
+同じ入力はヒットしてモデルを呼ばないこと、プロンプトやモデルが変わればミスすることを確かめる。
+
+    python examples/llm_cache_check.py
+"""
+import asyncio
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from lecturia.chains.llm_cache import LangChainResponseCache, llm_cache_key
+from lecturia.storage import MemoryStorage
+from lecturia.utils.content_cache import ContentCache, SQLiteCacheStore, StorageCacheStore, digest_bytes
+
+
+class _StubChatModel(BaseChatModel):
+    """プロンプトとモデル名をそのまま返す。実際に呼ばれた回数を calls に数える"""
+    model: str
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model": self.model}
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, **kwargs: Any) -> ChatResult:
+        self.calls += 1
+        content = f"{self.model}: {messages[-1].content}"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def check_chat_model_cache(cache: ContentCache) -> None:
+    langchain_cache = LangChainResponseCache(cache)
+    model = _StubChatModel(model="stub-a", cache=langchain_cache)
+
+    # 1回目はミスしてモデルを呼び、2回目は同じ応答をキャッシュから返す
+    first = model.invoke("スライドの台本を作って")
+    second = model.invoke("スライドの台本を作って")
+    assert model.calls == 1, model.calls
+    assert first.content == second.content
+    assert cache.hits == 1 and cache.writes == 1, cache.stats()
+
+    # 非同期の呼び出しも同じキャッシュを引く
+    third = asyncio.run(model.ainvoke("スライドの台本を作って"))
+    assert model.calls == 1 and third.content == first.content
+
+    # プロンプトが変わればミス
+    model.invoke("クイズを作って")
+    assert model.calls == 2, model.calls
+
+    # モデルが変わればミス (llm_string にモデルIDが入る)
+    other = _StubChatModel(model="stub-b", cache=langchain_cache)
+    answer = other.invoke("スライドの台本を作って")
+    assert other.calls == 1, other.calls
+    assert answer.content != first.content
+
+    # キャッシュを消せば同じ入力でも呼び直す
+    langchain_cache.clear()
+    model.invoke("スライドの台本を作って")
+    assert model.calls == 3, model.calls
+
+
+def check_media_key(cache: ContentCache) -> None:
+    """イベント抽出のように添付メディアのハッシュを含めたキーで直接読み書きする場合"""
+    key = llm_cache_key("stub-a", "イベントを抽出して", digest_bytes(b"audio-1"), {"include_thoughts": True})
+    assert cache.get(key) is None
+    cache.put(key, b"events")
+    assert cache.get(key) == b"events"
+    for changed in [
+        llm_cache_key("stub-a", "イベントを抽出して", digest_bytes(b"audio-2"), {"include_thoughts": True}),
+        llm_cache_key("stub-a", "イベントを抽出して。", digest_bytes(b"audio-1"), {"include_thoughts": True}),
+        llm_cache_key("stub-b", "イベントを抽出して", digest_bytes(b"audio-1"), {"include_thoughts": True}),
+        llm_cache_key("stub-a", "イベントを抽出して", digest_bytes(b"audio-1"), {"include_thoughts": False}),
+    ]:
+        assert changed != key
+        assert cache.get(changed) is None
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stores = {
+            "sqlite": lambda: SQLiteCacheStore(Path(temp_dir) / "llm_cache.sqlite3"),
+            "storage": lambda: StorageCacheStore(MemoryStorage(), "cache/llm"),
+        }
+        for name, create_store in stores.items():
+            check_chat_model_cache(ContentCache(create_store(), f"llm-{name}"))
+            check_media_key(ContentCache(create_store(), f"llm-{name}-media"))
+            print(f"{name}: ok")
+
+
+if __name__ == "__main__":
+    main()
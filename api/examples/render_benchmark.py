@@ -0,0 +1,113 @@
+"""
+スライドの動画フレームの描画を、ブラウザ1つで通しで描画する場合と、スライドごとに分けて複数のブラウザで並列に描画する場合とで比較する。
+slide_token_benchmark.py と同じ合成スライドに、スライドごとの発話 (pose)・ステップ送り・スライド送りのイベントを付けて使う。
+キャラクターをブラウザで描く従来の描画と、NumPy で重ねる描画 (composite_sprites) のそれぞれで、
+全フレームを撮る通しの描画を基準にし、変化のないフレームを使い回す描画 (skip_unchanged) と並列数ごとの結果を並べる。
+同じ描画方法の基準のフレームと一致する数も表示する。
+最後に、最大の並列数で描画しながら ffmpeg に流して mp4 にエンコードするまでの時間と、
+ffmpeg がデコードしたフレーム数 (前のフレームと同じフレームは送らずに表示時間を延ばす) を表示する。
+
+    playwright install chromium
+    python examples/render_benchmark.py --pages 8 --workers 1 2 4
+"""
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+from slide_token_benchmark import synthetic_deck
+
+from lecturia.local_pipeline.slide_player import PlayConfig, play_slide
+from lecturia.local_pipeline.video_writer import VideoWriter
+from lecturia.models import Event, EventList
+
+
+def fixture_events(num_pages: int, page_sec: float) -> EventList:
+    events: list[Event] = []
+    for i in range(num_pages):
+        start = i * page_sec
+        events.append(Event(type="pose", time_sec=start, name="talk", target="right"))
+        for step in range(1, 4):
+            events.append(Event(type="slideStep", time_sec=start + page_sec * step / 5))
+        events.append(Event(type="pose", time_sec=start + page_sec * 0.8, name="idle", target="right"))
+        events.append(Event(type="slideNext", time_sec=start + page_sec))
+    return EventList(events=events)
+
+
+class _MemorySink:
+    def __init__(self):
+        self.frames: list[bytes] = []
+
+    async def write(self, frame: bytes) -> None:
+        self.frames.append(frame)
+
+
+_SPRITE_NAMES = ["sprite_woman.png"]
+
+
+async def _render(
+    html: str, events: EventList, fps: int, workers: int, composite_sprites: bool, skip_unchanged: bool
+) -> tuple[float, list[bytes]]:
+    config = PlayConfig(
+        fps=fps,
+        events=events,
+        workers=workers,
+        sprite_names=_SPRITE_NAMES,
+        composite_sprites=composite_sprites,
+        skip_unchanged=skip_unchanged,
+    )
+    sink = _MemorySink()
+    start = time.monotonic()
+    await play_slide(html, sink, config)
+    return time.monotonic() - start, sink.frames
+
+
+async def _render_movie(html: str, events: EventList, fps: int, workers: int, movie_path: Path) -> tuple[float, VideoWriter]:
+    config = PlayConfig(fps=fps, events=events, workers=workers, sprite_names=_SPRITE_NAMES)
+    start = time.monotonic()
+    async with VideoWriter(movie_path, fps, config.image_format) as writer:
+        await play_slide(html, writer, config)
+    return time.monotonic() - start, writer
+
+
+def benchmark(num_pages: int, page_sec: float, fps: int, workers_list: list[int]) -> None:
+    html = synthetic_deck(num_pages)
+    events = fixture_events(num_pages, page_sec)
+    print(f"pages: {num_pages}, video: {num_pages * page_sec:.0f}s @ {fps}fps")
+    print(
+        f"{'sprites':>9s} {'workers':>9s} {'frames':>7s} {'wall [s]':>9s} {'frames/s':>9s} "
+        f"{'x realtime':>11s} {'identical':>10s}"
+    )
+    for composite_sprites in (False, True):
+        sprites = "numpy" if composite_sprites else "browser"
+        elapsed, baseline = asyncio.run(_render(html, events, fps, 1, composite_sprites, skip_unchanged=False))
+        rows = [("1 (all)", elapsed, baseline)]
+        for workers in workers_list:
+            elapsed, frames = asyncio.run(_render(html, events, fps, workers, composite_sprites, skip_unchanged=True))
+            rows.append((str(workers), elapsed, frames))
+        for name, elapsed, frames in rows:
+            identical = sum(a == b for a, b in zip(baseline, frames))
+            print(
+                f"{sprites:>9s} {name:>9s} {len(frames):7d} {elapsed:9.2f} {len(frames) / elapsed:9.1f} "
+                f"{len(frames) / fps / elapsed:11.2f} {identical:5d}/{len(baseline)}"
+            )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        movie_path = Path(temp_dir) / "movie.mp4"
+        elapsed, writer = asyncio.run(_render_movie(html, events, fps, max(workers_list), movie_path))
+        print(
+            f"render + encode ({max(workers_list)} workers): {elapsed:.2f}s, {movie_path.stat().st_size / 1e6:.1f} MB, "
+            f"{writer.frames - writer.repeated}/{writer.frames} frames decoded by ffmpeg"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--page-sec", type=float, default=5.0)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    benchmark(args.pages, args.page_sec, args.fps, args.workers)
@@ -9,13 +9,9 @@ os.environ.setdefault("GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME", "lecturia-publi
 os.environ.setdefault("STORAGE_EMULATOR_HOST", "http://localhost:4443")
 
 from lecturia.database import init_db, session_scope
-from lecturia.lecture_repository import upsert_lecture
+from lecturia.lecture_repository import record_lecture_artifacts, upsert_lecture
 from lecturia.models import MovieConfig
-from lecturia.storage import (
-    download_data_from_public_bucket,
-    is_exists_in_public_bucket,
-    ls_public_bucket,
-)
+from lecturia.storage import get_lecture_artifact_index, ls_public_bucket
 
 
 init_db()
@@ -23,8 +19,9 @@ init_db()
 lecture_ids = ls_public_bucket("lectures")
 
 for lecture_id in lecture_ids:
-    has_events = is_exists_in_public_bucket(f"lectures/{lecture_id}/events.json")
-    movie_config_json = download_data_from_public_bucket(f"lectures/{lecture_id}/movie_config.json")
+    artifacts = get_lecture_artifact_index(lecture_id)
+    has_events = artifacts.exists("events.json")
+    movie_config_json = artifacts.download("movie_config.json")
     if movie_config_json is None:
         config = MovieConfig(topic="待機中..." if not has_events else "無題")
     else:
@@ -39,4 +36,5 @@ for lecture_id in lecture_ids:
             progress_percentage=100 if has_events else 0,
             current_phase="完了" if has_events else "待機中",
         )
+        record_lecture_artifacts(session, lecture_id, list(artifacts.names))
     print(f"lecture_id {lecture_id} is saved")
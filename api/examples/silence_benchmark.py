@@ -0,0 +1,105 @@
+"""
+無音検出を pydub.silence.detect_nonsilent と NumPy 版 (lecturia.utils.media.detect_nonsilent) で比較する。
+合成音声で結果が一致することを確認してから、処理時間を計測する。
+
+    python examples/silence_benchmark.py --duration-sec 180
+"""
+import time
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent as pydub_detect_nonsilent
+
+from lecturia.utils.media import detect_nonsilent
+
+
+_FRAME_RATE = 24000
+
+
+def _synthetic_speech(duration_sec: float, channels: int = 1, seed: int = 0) -> AudioSegment:
+    """
+    ランダムな長さの発話 (変調したサイン波 + ノイズ) と無音を交互に並べた音声
+    """
+    rng = np.random.default_rng(seed)
+    chunks: list[np.ndarray] = []
+    total = 0
+    num_samples = int(duration_sec * _FRAME_RATE)
+    while total < num_samples:
+        n = int(rng.uniform(0.1, 3.0) * _FRAME_RATE)
+        t = np.arange(n) / _FRAME_RATE
+        amplitude = rng.uniform(500, 12000) * (0.6 + 0.4 * np.sin(2 * np.pi * rng.uniform(2, 6) * t))
+        voice = amplitude * np.sin(2 * np.pi * rng.uniform(100, 400) * t) + rng.normal(0, 50, n)
+        silence_len = int(rng.choice([0.05, 0.3, 0.6, 1.5, 5.0]) * _FRAME_RATE)
+        chunks += [voice, rng.normal(0, rng.choice([5, 80, 200]), silence_len)]
+        total += n + silence_len
+    mono = np.clip(np.concatenate(chunks)[:num_samples], -32768, 32767).astype(np.int16)
+    samples = np.repeat(mono, channels) if channels > 1 else mono
+    return AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=_FRAME_RATE, channels=channels)
+
+
+def _within_one_step(expected: list[list[int]], actual: list[list[int]], seek_step: int) -> bool:
+    if len(expected) != len(actual):
+        return False
+    return all(
+        abs(e_start - a_start) <= seek_step and abs(e_end - a_end) <= seek_step
+        for (e_start, e_end), (a_start, a_end) in zip(expected, actual)
+    )
+
+
+def check_equivalence() -> None:
+    cases = [
+        dict(duration_sec=20, channels=1, min_silence_len=500, silence_thresh=-40, seek_step=1),
+        dict(duration_sec=20, channels=1, min_silence_len=4000, silence_thresh=-40, seek_step=1),
+        dict(duration_sec=20, channels=2, min_silence_len=300, silence_thresh=-30, seek_step=1),
+        dict(duration_sec=20, channels=1, min_silence_len=500, silence_thresh=-50, seek_step=7),
+        dict(duration_sec=0.3, channels=1, min_silence_len=500, silence_thresh=-40, seek_step=1),
+    ]
+    for seed, case in enumerate(cases):
+        audio = _synthetic_speech(case["duration_sec"], case["channels"], seed=seed)
+        params = dict(
+            min_silence_len=case["min_silence_len"],
+            silence_thresh=case["silence_thresh"],
+            seek_step=case["seek_step"],
+        )
+        expected = pydub_detect_nonsilent(audio, **params)
+        actual = detect_nonsilent(audio, **params)
+        assert _within_one_step(expected, actual, case["seek_step"]), (case, expected, actual)
+        print(f"OK {case}: {len(actual)} ranges, exact={expected == actual}")
+
+    # 全て無音・全て有音
+    silent = AudioSegment.silent(duration=3000, frame_rate=_FRAME_RATE)
+    assert detect_nonsilent(silent, 500, -40) == pydub_detect_nonsilent(silent, 500, -40) == []
+    tone = AudioSegment(
+        data=(np.sin(np.arange(_FRAME_RATE * 3) * 0.1) * 10000).astype(np.int16).tobytes(),
+        sample_width=2,
+        frame_rate=_FRAME_RATE,
+        channels=1,
+    )
+    assert detect_nonsilent(tone, 5000, -40) == pydub_detect_nonsilent(tone, 5000, -40)
+
+
+def benchmark(duration_sec: float) -> None:
+    audio = _synthetic_speech(duration_sec)
+    params = dict(min_silence_len=500, silence_thresh=-40, seek_step=1)
+
+    start = time.perf_counter()
+    expected = pydub_detect_nonsilent(audio, **params)
+    pydub_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = detect_nonsilent(audio, **params)
+    numpy_sec = time.perf_counter() - start
+
+    assert _within_one_step(expected, actual, 1)
+    print(f"{duration_sec:.0f} sec audio: pydub {pydub_sec * 1000:.1f} ms, numpy {numpy_sec * 1000:.1f} ms, "
+          f"x{pydub_sec / numpy_sec:.0f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration-sec", type=float, default=180)
+    args = parser.parse_args()
+    check_equivalence()
+    benchmark(args.duration_sec)
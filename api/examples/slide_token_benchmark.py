@@ -0,0 +1,187 @@
+"""
+LLM に渡すスライドのトークン数を、スライド全体を毎回渡す従来方式とページごとに分けて渡す方式とで比較する。
+15ページの合成スライド (生成されるスライドと同じく style・postMessage の script・inline SVG を含む) を使う。
+--html で実際の result_slide.html を指定することもできる。
+
+ANTHROPIC_API_KEY があれば Anthropic の count_tokens で数え、なければ文字数から概算する。
+
+    python examples/slide_token_benchmark.py --pages 15
+"""
+import base64
+import io
+import os
+from collections.abc import Callable
+from pathlib import Path
+
+from PIL import Image
+
+from lecturia.chains.slide_maker import HtmlSlide
+from lecturia.phases import content_context, page_context
+from lecturia.utils.ai_models import AI_MODELS
+
+
+_STYLE = """
+<style>
+  * { box-sizing: border-box; margin: 0; padding: 0; }
+  body { font-family: 'Noto Sans JP', sans-serif; background: #0f172a; color: #e2e8f0; overflow: hidden; }
+  .slide-container { width: 100vw; height: 100vh; position: relative; }
+  .slide { position: absolute; inset: 0; padding: 4vh 6vw; display: none; flex-direction: column; gap: 2vh; }
+  .slide.active { display: flex; animation: fadeIn 0.6s ease; }
+  .slide h2 { font-size: 4.2vh; color: #38bdf8; border-bottom: 0.3vh solid #38bdf8; padding-bottom: 1vh; }
+  .slide ul { font-size: 2.8vh; line-height: 1.7; padding-left: 3vw; }
+  .slide .columns { display: grid; grid-template-columns: 1fr 1fr; gap: 3vw; align-items: center; }
+  .slide .card { background: #1e293b; border-radius: 1.5vh; padding: 2vh 2vw; box-shadow: 0 0.5vh 2vh rgba(0,0,0,.4); }
+  .slide .step { opacity: 0; transform: translateY(2vh); transition: all .5s ease; }
+  .slide .step.visible { opacity: 1; transform: none; }
+  .slide .page-no { position: absolute; right: 3vw; bottom: 2vh; font-size: 2vh; color: #64748b; }
+  .slide .highlight { color: #fbbf24; font-weight: bold; }
+  .slide .clickable { cursor: pointer; transition: transform .3s; }
+  .slide .clickable.active { transform: scale(1.1); fill: #f97316; }
+  .slide .title-page { justify-content: center; align-items: center; text-align: center; }
+  @keyframes fadeIn { from { opacity: 0; } to { opacity: 1; } }
+  @media (max-aspect-ratio: 4/3) { .slide h2 { font-size: 3.4vh; } .slide ul { font-size: 2.3vh; } }
+</style>
+"""
+
+_SCRIPT = """
+<script>
+  const slides = Array.from(document.querySelectorAll('.slide'));
+  let current = 0;
+  const stepIndex = slides.map(() => 0);
+  function showSlide(i) {
+    slides.forEach((s, j) => s.classList.toggle('active', i === j));
+    current = i;
+  }
+  function nextSlide() { if (current < slides.length - 1) showSlide(current + 1); }
+  function prevSlide() { if (current > 0) showSlide(current - 1); }
+  function slideNextStep() {
+    const steps = slides[current].querySelectorAll('.step');
+    if (stepIndex[current] < steps.length) {
+      steps[stepIndex[current]].classList.add('visible');
+      stepIndex[current] += 1;
+    }
+  }
+  function handleElementClick(id) {
+    const el = document.getElementById(id);
+    if (!el) return;
+    el.classList.toggle('active');
+    el.dispatchEvent(new MouseEvent('click', { bubbles: true }));
+  }
+  window.addEventListener('message', (ev) => {
+    const data = ev.data;
+    const type = (typeof data === 'string') ? data : data?.type;
+    const elementId = (typeof data === 'object' && data) ? (data.id ?? data.detail?.id) : undefined;
+    switch (type) {
+      case 'slide-next': nextSlide(); break;
+      case 'slide-prev': prevSlide(); break;
+      case 'slide-step': slideNextStep(); break;
+      case 'element-click': handleElementClick(elementId); break;
+    }
+  });
+  showSlide(0);
+</script>
+"""
+
+
+def _png_base64() -> str:
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), "#38bdf8").save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+_PNG = _png_base64()
+# 生成されたスライドに残りがちな、img 以外の埋め込みデータ (背景パターンなど)
+_PATTERN = base64.b64encode(("<svg xmlns='http://www.w3.org/2000/svg'>" + "<circle r='2'/>" * 60 + "</svg>").encode()).decode()
+
+
+def _page(slide_no: int) -> str:
+    items = "\n".join(
+        f'<li class="step">ポイント{slide_no}-{i}: <span class="highlight">重要な概念</span>について、'
+        f"具体例を交えながら順を追って説明します。</li>"
+        for i in range(1, 5)
+    )
+    bars = "\n".join(
+        f'<rect id="bar-{slide_no}-{i}" class="clickable" x="{20 + i * 60}" y="{200 - i * 30}" '
+        f'width="40" height="{i * 30}" fill="#38bdf8"></rect>'
+        for i in range(1, 6)
+    )
+    return f"""
+<div class="slide">
+  <h2>第{slide_no}章: 講義のトピック {slide_no}</h2>
+  <div class="columns">
+    <div class="card"><ul>{items}</ul></div>
+    <svg viewBox="0 0 400 220" width="100%">
+      <line x1="20" y1="200" x2="380" y2="200" stroke="#94a3b8" stroke-width="2"></line>
+      {bars}
+      <text x="200" y="20" text-anchor="middle" fill="#e2e8f0">図{slide_no}: 値の比較</text>
+    </svg>
+  </div>
+  <img src="data:image/png;base64,{_PNG}" alt="イメージ図{slide_no}">
+  <div class="card" style="background-image: url(data:image/svg+xml;base64,{_PATTERN})">補足</div>
+  <div class="page-no">{slide_no}</div>
+</div>
+"""
+
+
+def synthetic_deck(num_pages: int) -> str:
+    pages = "\n".join(_page(i) for i in range(1, num_pages + 1))
+    return (
+        f'<html><head><meta charset="utf-8"><title>講義</title>{_STYLE}</head>'
+        f'<body><div class="slide-container">{pages}</div>{_SCRIPT}</body></html>'
+    )
+
+
+def _token_counter() -> tuple[str, Callable[[str], int]]:
+    if os.getenv("ANTHROPIC_API_KEY"):
+        import anthropic
+
+        client = anthropic.Anthropic()
+
+        def count(text: str) -> int:
+            return client.messages.count_tokens(
+                model=AI_MODELS["claude-default"],
+                messages=[{"role": "user", "content": text}],
+            ).input_tokens
+
+        return "count_tokens", count
+
+    def estimate(text: str) -> int:
+        # ASCII は約4文字で1トークン、それ以外は1文字で約1トークンとして概算する
+        num_ascii = sum(1 for c in text if c.isascii())
+        return num_ascii // 4 + (len(text) - num_ascii)
+
+    return "estimate", estimate
+
+
+def benchmark(html: str) -> None:
+    # 生成されたスライドを読み込むときと同じく、埋め込み画像を image_map に移しておく
+    slide = HtmlSlide.from_html(html)
+    num_pages = slide.split_pages().num_pages
+    method, count = _token_counter()
+    print(f"pages: {num_pages}, token counter: {method}")
+
+    full = count(slide.html)
+    before_events = full * num_pages
+    after_events = sum(count(page_context(slide, slide_no)) for slide_no in range(1, num_pages + 1))
+    content = count(content_context(slide))
+    rows = [
+        ("event extraction (all pages)", before_events, after_events),
+        ("script generation", full, content),
+        ("quiz generation", full, content),
+        ("script regeneration (1 page)", full, count(content_context(slide, [1]))),
+    ]
+    for name, before, after in rows:
+        print(f"{name:30s} {before:8d} -> {after:8d} tokens ({after / before:.1%})")
+    total_before = sum(before for _, before, _ in rows[:3])
+    total_after = sum(after for _, _, after in rows[:3])
+    print(f"{'total per lecture':30s} {total_before:8d} -> {total_after:8d} tokens ({total_after / total_before:.1%})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=15)
+    parser.add_argument("--html", type=Path, default=None, help="result_slide.html のパス")
+    args = parser.parse_args()
+    benchmark(args.html.read_text() if args.html else synthetic_deck(args.pages))
@@ -0,0 +1,87 @@
+"""
+GCS 呼び出し1回あたりのレイテンシを、毎回 storage.Client() を作る従来方式と
+プロセス共有の GCSStorage とで比較するベンチマーク。
+
+fake-gcs-server (docker compose の gcs サービス) を起動した状態で実行する。
+
+    python examples/storage_benchmark.py --iterations 50
+"""
+import os
+import statistics
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+os.environ.setdefault("GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME", "lecturia-public-storage")
+os.environ.setdefault("STORAGE_EMULATOR_HOST", "http://localhost:4443")
+
+from google.cloud import storage
+
+from lecturia.storage import get_public_storage
+
+
+_BUCKET_NAME = os.environ["GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME"]
+_PATH = "benchmark/storage_benchmark.bin"
+_DATA = os.urandom(64 * 1024)
+
+
+def _fresh_upload() -> None:
+    storage.Client().bucket(_BUCKET_NAME).blob(_PATH).upload_from_string(_DATA)
+
+
+def _fresh_exists() -> None:
+    storage.Client().bucket(_BUCKET_NAME).blob(_PATH).exists()
+
+
+def _fresh_download() -> None:
+    storage.Client().bucket(_BUCKET_NAME).blob(_PATH).download_as_bytes()
+
+
+def _pooled_upload() -> None:
+    get_public_storage().upload(_DATA, _PATH)
+
+
+def _pooled_exists() -> None:
+    get_public_storage().exists(_PATH)
+
+
+def _pooled_download() -> None:
+    get_public_storage().download(_PATH)
+
+
+def _measure(fn: Callable[[], None], iterations: int) -> list[float]:
+    fn()  # warm up
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _report(name: str, latencies: list[float]) -> None:
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    print(f"{name:<18} mean={statistics.mean(latencies):7.2f}ms  p50={statistics.median(latencies):7.2f}ms  p95={p95:7.2f}ms")
+
+
+def main(iterations: int) -> None:
+    cases = [
+        ("upload", _fresh_upload, _pooled_upload),
+        ("exists", _fresh_exists, _pooled_exists),
+        ("download", _fresh_download, _pooled_download),
+    ]
+    for name, fresh, pooled in cases:
+        _report(f"{name} (before)", _measure(fresh, iterations))
+        _report(f"{name} (after)", _measure(pooled, iterations))
+    get_public_storage().delete_prefix("benchmark/")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    main(args.iterations)
@@ -0,0 +1,106 @@
+"""
+ワーカー1インスタンスで複数の講義を同時に処理したときの、処理時間とイベントループの遅延を比較する。
+LLM の呼び出しは待ち時間だけを模したダミーで、以下の2通りで実行する。
+
+- blocking: async のノードの中から同期の invoke を呼ぶ (イベントループが止まる従来の書き方)
+- offloaded: LLM は ainvoke 相当の非同期呼び出し、同期の処理は run_blocking のスレッドで実行する
+
+イベントループの遅延は、10ms ごとに起きるハートビートの遅れの最大値で測る (/health の応答が遅れる時間に相当)。
+
+    python examples/worker_concurrency_benchmark.py --lectures 1 2 4 8
+"""
+import asyncio
+import time
+
+from lecturia.utils.async_tools import run_blocking
+from lecturia.utils.dag import DagExecutor, DagNode
+
+
+_HEARTBEAT_SEC = 0.01
+
+
+def _blocking_llm(latency_sec: float) -> str:
+    time.sleep(latency_sec)
+    return "ok"
+
+
+async def _async_llm(latency_sec: float) -> str:
+    await asyncio.sleep(latency_sec)
+    return "ok"
+
+
+def _lecture_nodes(mode: str, num_slides: int, llm_sec: float, parse_sec: float) -> list[DagNode]:
+    async def _call(latency_sec: float) -> str:
+        if mode == "blocking":
+            return _blocking_llm(latency_sec)
+        return await _async_llm(latency_sec)
+
+    async def _parse() -> None:
+        # html の解析や音声の処理など、CPU/IO で止まる同期処理
+        if mode == "blocking":
+            time.sleep(parse_sec)
+        else:
+            await run_blocking(time.sleep, parse_sec)
+
+    async def _slide() -> str:
+        result = await _call(llm_sec)
+        await _parse()
+        return result
+
+    async def _script(slide: str) -> str:
+        result = await _call(llm_sec / 2)
+        await _parse()
+        return result
+
+    def _expand(script: str) -> list[DagNode]:
+        async def _tts(script: str) -> str:
+            return await _async_llm(llm_sec / 4)
+
+        return [DagNode(name=f"tts_{i}", func=_tts, deps=["script"]) for i in range(num_slides)]
+
+    return [
+        DagNode(name="slide", func=_slide),
+        DagNode(name="script", func=_script, deps=["slide"], expand=_expand),
+    ]
+
+
+async def _run(mode: str, num_lectures: int, num_slides: int, llm_sec: float, parse_sec: float) -> tuple[float, float]:
+    max_lag = 0.0
+    stop = asyncio.Event()
+
+    async def _heartbeat() -> None:
+        nonlocal max_lag
+        while not stop.is_set():
+            start = time.monotonic()
+            await asyncio.sleep(_HEARTBEAT_SEC)
+            max_lag = max(max_lag, time.monotonic() - start - _HEARTBEAT_SEC)
+
+    heartbeat = asyncio.create_task(_heartbeat())
+    start = time.monotonic()
+    await asyncio.gather(
+        *(DagExecutor(_lecture_nodes(mode, num_slides, llm_sec, parse_sec)).run() for _ in range(num_lectures))
+    )
+    elapsed = time.monotonic() - start
+    stop.set()
+    await heartbeat
+    return elapsed, max_lag
+
+
+def benchmark(lectures: list[int], num_slides: int, llm_sec: float, parse_sec: float) -> None:
+    print(f"{'mode':10s} {'lectures':>8s} {'wall [s]':>9s} {'lectures/min':>13s} {'max loop lag [s]':>17s}")
+    for mode in ("blocking", "offloaded"):
+        for num_lectures in lectures:
+            elapsed, max_lag = asyncio.run(_run(mode, num_lectures, num_slides, llm_sec, parse_sec))
+            print(f"{mode:10s} {num_lectures:8d} {elapsed:9.2f} {num_lectures / elapsed * 60:13.1f} {max_lag:17.3f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lectures", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--slides", type=int, default=10)
+    parser.add_argument("--llm-sec", type=float, default=1.0, help="スライド生成の LLM 呼び出しの待ち時間")
+    parser.add_argument("--parse-sec", type=float, default=0.1, help="同期処理1回あたりの時間")
+    args = parser.parse_args()
+    benchmark(args.lectures, args.slides, args.llm_sec, args.parse_sec)
@@ -26,5 +26,6 @@ gcloud run deploy $CLOUD_RUN_WORKER_SERVICE_NAME --image $REPOSITORY_URL \
     --update-env-vars GOOGLE_CLOUD_PROJECT=$GOOGLE_CLOUD_PROJECT \
     --update-env-vars SUBSCRIPTION_ID=$CLOUD_RUN_SUBSCRIPTION_ID \
     --update-env-vars GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME=$GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME \
+    --update-env-vars GOOGLE_CLOUD_STORAGE_CACHE_BUCKET_NAME=$GOOGLE_CLOUD_STORAGE_CACHE_BUCKET_NAME \
     --set-secrets=ANTHROPIC_API_KEY=ANTHROPIC_API_KEY:latest,GOOGLE_API_KEY=GOOGLE_API_KEY:latest,BRAVE_API_KEY=BRAVE_API_KEY:latest \
     --allow-unauthenticated
@@ -10,6 +10,11 @@ from langchain_core.runnables import Runnable
 
 from ..models import EventList
 from ..utils.ai_models import AI_MODELS
+from ..utils.async_tools import run_blocking
+from ..utils.content_cache import digest_bytes
+from ..utils.rate_limit import estimate_tokens, get_rate_limiter, google_provider
+from ..utils.resilience import CallPolicy, resilient_acall
+from .llm_cache import get_llm_response_cache, llm_cache_key
 
 
 _prompt = """
@@ -78,9 +83,13 @@ def output_format_prompt(multiple_speakers: bool) -> str:
 }}"""
 
 
+_EVENT_CALL_POLICY = CallPolicy(timeout_sec=180, hedge=True)
+
+
 class EventExtractor(Runnable):
     def __init__(self):
-        if "GOOGLE_APPLICATION_CREDENTIALS" in os.environ or "K_SERVICE" in os.environ:
+        self.provider = google_provider()
+        if self.provider == "vertex":
             self.client = genai.Client(
                 vertexai=True,  # vertex aiを使用
                 project=os.environ["GOOGLE_CLOUD_PROJECT"],
@@ -106,29 +115,53 @@ class EventExtractor(Runnable):
         audio_file: Path | str,
         first_speaker: Literal["left", "right"] | None = None,
     ) -> EventList:
-        if "GOOGLE_APPLICATION_CREDENTIALS" in os.environ or "K_SERVICE" in os.environ:
-            file = Part.from_bytes(data=audio_file.read_bytes(), mime_type="audio/mpeg")
+        audio_file = Path(audio_file)
+        prompt = _prompt.format(
+            slide_no=slide_no,
+            slides=slides_html,
+            output_format=output_format_prompt(first_speaker is not None),
+            multiple_speakers_rules=_multiple_speakers_rules.format(first_speaker=first_speaker) if first_speaker else "",
+        )
+        # ストレージのキャッシュはネットワーク越しなので、イベントループを止めないようにスレッドで読み書きする
+        audio_bytes = await run_blocking(audio_file.read_bytes)
+        cache = get_llm_response_cache()
+        cache_key = llm_cache_key(self.model, prompt, digest_bytes(audio_bytes), {"include_thoughts": True})
+        cached = await run_blocking(cache.get, cache_key) if cache is not None else None
+        if cached is not None:
+            text = cached.decode("utf-8")
         else:
-            file = self.client.files.upload(file=str(audio_file))
-        response = await self.client.aio.models.generate_content(
-            model=self.model,
-            contents=[
-                file,
-                _prompt.format(
-                    slide_no=slide_no,
-                    slides=slides_html,
-                    output_format=output_format_prompt(first_speaker is not None),
-                    multiple_speakers_rules=_multiple_speakers_rules.format(first_speaker=first_speaker) if first_speaker else "",
-                ),
-            ],
-            config=types.GenerateContentConfig(
-                thinking_config=types.ThinkingConfig(
-                    include_thoughts=True
+            if self.provider == "vertex":
+                file = Part.from_bytes(data=audio_bytes, mime_type="audio/mpeg")
+            else:
+                file = await self.client.aio.files.upload(file=str(audio_file))
+
+            async def _generate() -> types.GenerateContentResponse:
+                return await self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=[
+                        file,
+                        prompt,
+                    ],
+                    config=types.GenerateContentConfig(
+                        thinking_config=types.ThinkingConfig(
+                            include_thoughts=True
+                        )
+                    )
                 )
+
+            response = await resilient_acall(
+                "event_extractor",
+                get_rate_limiter(self.provider),
+                _generate,
+                _EVENT_CALL_POLICY,
+                tokens=estimate_tokens(prompt),
             )
-        )
-        json_str = re.search(r"```json\n(.*)\n```", response.text, re.DOTALL).group(1)
-        return EventList.model_validate_json(json_str)
+            text = response.text
+        json_str = re.search(r"```json\n(.*)\n```", text, re.DOTALL).group(1)
+        events = EventList.model_validate_json(json_str)
+        if cache is not None and cached is None:
+            await run_blocking(cache.put, cache_key, text.encode("utf-8"))
+        return events
 
 
 def create_event_extractor_chain() -> Runnable:
@@ -0,0 +1,67 @@
+import threading
+from typing import Any
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from ..utils.content_cache import ContentCache, content_key, create_content_cache_from_env
+
+
+_DEFAULT_TTL_SEC = 30 * 24 * 60 * 60
+_DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+_RESPONSE_CACHE: ContentCache | None = None
+_RESPONSE_CACHE_LOADED = False
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def llm_cache_key(model: str, prompt: str, media_digest: str | None = None, params: Any = None) -> str:
+    """
+    LLM のレスポンスキャッシュのキー。
+    (モデルID, 展開済みプロンプト, 添付メディアのハッシュ, 生成パラメータ) のハッシュ。
+    """
+    return content_key(model=model, prompt=prompt, media_digest=media_digest, params=params)
+
+
+def get_llm_response_cache() -> ContentCache | None:
+    """
+    LECTURIA_LLM_CACHE の設定に従って、プロセスで共有するレスポンスキャッシュを返す。
+    未設定ならキャッシュしない (None)。
+    """
+    global _RESPONSE_CACHE, _RESPONSE_CACHE_LOADED
+    if not _RESPONSE_CACHE_LOADED:
+        with _RESPONSE_CACHE_LOCK:
+            if not _RESPONSE_CACHE_LOADED:
+                _RESPONSE_CACHE = create_content_cache_from_env(
+                    "llm", "LECTURIA_LLM_CACHE", _DEFAULT_TTL_SEC, _DEFAULT_MAX_BYTES
+                )
+                _RESPONSE_CACHE_LOADED = True
+    return _RESPONSE_CACHE
+
+
+class LangChainResponseCache(BaseCache):
+    """
+    ContentCache を LangChain のチャットモデルの cache として使うためのアダプタ。
+    llm_string にはモデルIDと生成パラメータが含まれる。
+    """
+
+    def __init__(self, cache: ContentCache):
+        self.cache = cache
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        value = self.cache.get(llm_cache_key(llm_string, prompt))
+        if value is None:
+            return None
+        return loads(value.decode("utf-8"))
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self.cache.put(llm_cache_key(llm_string, prompt), dumps(return_val).encode("utf-8"))
+
+    def clear(self, **kwargs: Any) -> None:
+        self.cache.store.clear()
+
+
+def get_langchain_cache() -> LangChainResponseCache | None:
+    """チャットモデルの cache 引数に渡す。キャッシュが無効なら None"""
+    cache = get_llm_response_cache()
+    return LangChainResponseCache(cache) if cache is not None else None
@@ -9,6 +9,7 @@ from langchain_core.runnables import Runnable
 
 from ..models import QuizSectionList
 from ..utils.ai_models import AI_MODELS
+from .llm_cache import get_langchain_cache
 
 
 _prompt_template = """
@@ -79,11 +80,13 @@ def create_quiz_generator_chain() -> Runnable:
         llm = ChatVertexAI(
             model=AI_MODELS["gemini-default"],
             max_tokens=65536,
+            cache=get_langchain_cache(),
         )
     else:
         llm = ChatGoogleGenerativeAI(
             model=AI_MODELS["gemini-default"],
             max_tokens=65536,
+            cache=get_langchain_cache(),
         )
 
     def parse(ai_message: AIMessage) -> QuizSectionList:
@@ -8,10 +8,57 @@ from langchain_anthropic import ChatAnthropic
 from langchain_core.messages import AIMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 from langchain_core.runnables import Runnable
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, PrivateAttr
 from PIL import Image
 
 from ..utils.ai_models import AI_MODELS
+from .llm_cache import get_langchain_cache
+
+
+_DATA_URI_RE = re.compile(r"data:[\w/+.-]+;base64,[A-Za-z0-9+/=]+")
+
+
+class SlideDeck(BaseModel):
+    """
+    スライドをページ間で共有する部分 (head, ページ外の script) とページごとの断片に分けたもの。
+    LLM に渡すときは必要なページだけを render で組み立て直す。
+
+    Args:
+        head: head 要素の中身 (style など。script は含まない)
+        scripts: ページの外にある script 要素
+        pages: ページ (class="slide" の要素) ごとの html
+    """
+    head: str
+    scripts: list[str]
+    pages: list[str]
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.pages)
+
+    def render(
+        self,
+        slide_nos: list[int] | None = None,
+        include_head: bool = True,
+        include_scripts: bool = True,
+    ) -> str:
+        """
+        slide_nos のページ (1始まり。None なら全ページ) だけを含む html を返す。
+        各ページの前にページ番号のコメントを入れ、LLM が読んでも意味のない埋め込みデータ (data URI) は省略する。
+        """
+        slide_nos = slide_nos if slide_nos is not None else list(range(1, self.num_pages + 1))
+        parts: list[str] = ["<html>"]
+        if include_head and self.head:
+            parts.append(f"<head>\n{self.head}\n</head>")
+        parts.append("<body>")
+        for slide_no in slide_nos:
+            if not 1 <= slide_no <= self.num_pages:
+                raise ValueError(f"Invalid slide number: {slide_no} (pages: {self.num_pages})")
+            parts.append(f"<!-- page {slide_no} -->\n{self.pages[slide_no - 1]}")
+        if include_scripts:
+            parts.extend(self.scripts)
+        parts.append("</body>\n</html>")
+        return _DATA_URI_RE.sub("data:...", "\n".join(parts))
 
 
 class HtmlSlide(BaseModel):
@@ -20,6 +67,8 @@ class HtmlSlide(BaseModel):
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
+    _deck: SlideDeck | None = PrivateAttr(default=None)
+
     @classmethod
     def from_html(cls, html: str) -> "HtmlSlide":
         soup = BeautifulSoup(html, "html.parser")
@@ -46,6 +95,51 @@ class HtmlSlide(BaseModel):
             img_tag["src"] = f"data:image/png;base64,{base64.b64encode(buf.getvalue()).decode('utf-8')}"
         return soup.prettify()
 
+    @staticmethod
+    def _find_pages(soup: BeautifulSoup) -> list:
+        # 入れ子の .slide は同じページの一部として扱う
+        return [
+            tag for tag in soup.find_all(class_="slide")
+            if tag.find_parent(class_="slide") is None
+        ]
+
+    def split_pages(self) -> SlideDeck:
+        """
+        共有部分とページごとの断片に分ける。結果はインスタンスごとに1回だけ計算する。
+        """
+        if self._deck is not None:
+            return self._deck
+        soup = BeautifulSoup(self.html, "html.parser")
+        pages = self._find_pages(soup)
+        # ページ内の script はそのページの一部として扱う
+        scripts = [tag for tag in soup.find_all("script") if tag.find_parent(class_="slide") is None]
+        script_htmls = [str(tag) for tag in scripts]
+        for tag in scripts:
+            tag.decompose()
+        self._deck = SlideDeck(
+            head=soup.head.decode_contents().strip() if soup.head is not None else "",
+            scripts=script_htmls,
+            pages=[str(page) for page in pages],
+        )
+        return self._deck
+
+    def replace_page(self, slide_no: int, page_html: str) -> "HtmlSlide":
+        """
+        slide_no ページ目 (1始まり) を page_html (<div class="slide">...</div>) に差し替えたスライドを返す。
+        page_html 内の埋め込み画像は image_map に移す。
+        """
+        soup = BeautifulSoup(self.html, "html.parser")
+        pages = self._find_pages(soup)
+        if not 1 <= slide_no <= len(pages):
+            raise ValueError(f"Invalid slide number: {slide_no} (pages: {len(pages)})")
+        new_page = HtmlSlide.from_html(page_html)
+        new_soup = BeautifulSoup(new_page.html, "html.parser")
+        new_pages = self._find_pages(new_soup)
+        if len(new_pages) != 1:
+            raise ValueError('page_html must contain exactly one element with class="slide"')
+        pages[slide_no - 1].replace_with(new_pages[0])
+        return HtmlSlide(html=soup.prettify(), image_map={**(self.image_map or {}), **(new_page.image_map or {})})
+
 
 _prompt_template = """
 ## スライドの作成ルール
@@ -125,6 +219,7 @@ def create_slide_maker_chain(use_web_search: bool = True, num_max_web_search: in
         model=AI_MODELS["claude-default"],
         max_tokens=64000,
         thinking={"type": "enabled", "budget_tokens": 4096},
+        cache=get_langchain_cache(),
     )
 
     def parse(ai_message: AIMessage) -> HtmlSlide:
@@ -7,6 +7,7 @@ from langchain_core.runnables import Runnable
 
 from .slide_maker import HtmlSlide
 from ..utils.ai_models import AI_MODELS
+from .llm_cache import get_langchain_cache
 
 
 _prompt_template = """
@@ -38,6 +39,7 @@ def create_slide_refiner_chain() -> Runnable:
     llm = ChatAnthropic(
         model=AI_MODELS["claude-default"],
         max_tokens=64000,
+        cache=get_langchain_cache(),
     )
 
     def parse(ai_message: AIMessage) -> HtmlSlide:
@@ -7,6 +7,7 @@ from langchain_core.runnables import Runnable
 from pydantic import BaseModel, Field
 
 from ..utils.ai_models import AI_MODELS
+from .llm_cache import get_langchain_cache
 
 
 class Speaker(BaseModel):
@@ -19,6 +20,10 @@ class Script(BaseModel):
     script: list[Speaker] = Field(description="スライドの台本")
 
 
+# 台本の1発話。下で定義する話者の設定 (Speaker) と名前が衝突するので、外からはこの名前で参照する
+ScriptLine = Speaker
+
+
 class ScriptList(BaseModel):
     scripts: list[Script] = Field(description="スライドの台本のリスト")
 
@@ -156,6 +161,7 @@ def create_slide_to_script_chain(speakers: list[Speaker], use_web_search: bool =
         model=AI_MODELS["claude-default"],
         max_tokens=64000,
         thinking={"type": "enabled", "budget_tokens": 4096},
+        cache=get_langchain_cache(),
     )
 
     def parse(ai_message: AIMessage) -> ScriptList:
@@ -1,8 +1,14 @@
 import asyncio
-from typing import Literal
+import io
+import re
+import threading
+import wave
+from collections.abc import Callable
+from typing import Literal, TypeVar
 
 from langchain_core.runnables import Runnable
 from pydantic import BaseModel
+from pydub import AudioSegment
 from tts_clients.google.client import GoogleTTSClient
 from tts_clients.google.models import (
     MultiSpeakerTextToAudioRequest,
@@ -11,6 +17,13 @@ from tts_clients.google.models import (
     TextToAudioResponse,
 )
 
+from ..utils.async_tools import run_blocking
+from ..utils.content_cache import ContentCache, content_key, create_content_cache_from_env
+from ..utils.media import audio_segment_from_tts, ensure_wav
+from ..utils.rate_limit import get_rate_limiter
+from ..utils.resilience import CallPolicy, resilient_acall_in_thread, resilient_call
+
+
 class VoiceType(BaseModel):
     name: str
     instructions: str
@@ -54,25 +67,158 @@ class Talk(BaseModel):
     voice_type: VoiceTypes
 
 
+class ChunkTiming(BaseModel):
+    """
+    チャンク (文) ごとの音声上の位置
+
+    Args:
+        text: チャンクのテキスト
+        speaker_name: 話者名。単一話者の場合は None
+        start_sec: 音声の開始時刻 (秒)
+        end_sec: 音声の終了時刻 (秒)
+    """
+    text: str
+    speaker_name: str | None = None
+    start_sec: float
+    end_sec: float
+
+
+class ChunkTimingList(BaseModel):
+    timings: list[ChunkTiming]
+
+
+class ChunkedTTSResult(BaseModel):
+    response: TextToAudioResponse
+    timings: list[ChunkTiming]
+
+
+_SENTENCE_END = re.compile(r"(?<=[。！？!?])|(?<=[.])(?=\s)|\n+")
+
+
+def split_sentences(text: str, min_chars: int = 8) -> list[str]:
+    """
+    文末の句読点と改行で文に分割する。
+    min_chars より短い文は前の文にまとめる (短すぎるリクエストを避けるため)。
+    """
+    sentences: list[str] = []
+    for part in _SENTENCE_END.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        if sentences and len(part) < min_chars:
+            sentences[-1] += (" " if sentences[-1][-1].isascii() else "") + part
+        else:
+            sentences.append(part)
+    return sentences
+
+
+def concat_wav(chunks: list[bytes], gaps_sec: list[float]) -> tuple[bytes, list[tuple[float, float]]]:
+    """
+    チャンクの音声を PCM で連結して WAV にする。gaps_sec[i] は i 番目のチャンクの前に入れる無音の長さ。
+    WAV のチャンクは PCM をそのまま使い、それ以外は audio_segment_from_tts でデコードする。
+    形式 (チャンネル数・サンプル幅・サンプリングレート) は最初のチャンクにそろえる。
+    連結後の音声と、各チャンクの (開始秒, 終了秒) を返す。
+    """
+    frames: list[bytes] = []
+    ranges: list[tuple[float, float]] = []
+    first: AudioSegment | None = None
+    num_frames = 0
+    for chunk, gap_sec in zip(chunks, gaps_sec):
+        audio = audio_segment_from_tts(chunk)
+        if first is None:
+            first = audio
+        elif (audio.channels, audio.sample_width, audio.frame_rate) != (first.channels, first.sample_width, first.frame_rate):
+            audio = audio.set_channels(first.channels).set_sample_width(first.sample_width).set_frame_rate(first.frame_rate)
+        frame_size = first.frame_width
+        gap_frames = int(round(gap_sec * first.frame_rate))
+        frames.append(b"\0" * (gap_frames * frame_size))
+        num_frames += gap_frames
+        start = num_frames / first.frame_rate
+        frames.append(audio.raw_data)
+        num_frames += len(audio.raw_data) // frame_size
+        ranges.append((start, num_frames / first.frame_rate))
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(first.channels if first else 1)
+        wf.setsampwidth(first.sample_width if first else 2)
+        wf.setframerate(first.frame_rate if first else 24000)
+        wf.writeframes(b"".join(frames))
+    return buf.getvalue(), ranges
+
+
+_DEFAULT_TTS_CACHE_TTL_SEC = 90 * 24 * 60 * 60
+_DEFAULT_TTS_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+
+_TTS_CACHE: ContentCache | None = None
+_TTS_CACHE_LOADED = False
+_TTS_CACHE_LOCK = threading.Lock()
+
+
+def get_tts_cache() -> ContentCache | None:
+    """
+    LECTURIA_TTS_CACHE の設定に従って、講義をまたいで共有する音声キャッシュを返す。
+    未設定ならキャッシュしない (None)。
+    """
+    global _TTS_CACHE, _TTS_CACHE_LOADED
+    if not _TTS_CACHE_LOADED:
+        with _TTS_CACHE_LOCK:
+            if not _TTS_CACHE_LOADED:
+                _TTS_CACHE = create_content_cache_from_env(
+                    "tts", "LECTURIA_TTS_CACHE", _DEFAULT_TTS_CACHE_TTL_SEC, _DEFAULT_TTS_CACHE_MAX_BYTES
+                )
+                _TTS_CACHE_LOADED = True
+    return _TTS_CACHE
+
+
+_Request = TypeVar("_Request", TextToAudioRequest, MultiSpeakerTextToAudioRequest)
+
+
+def tts_cache_key(model: str, request: TextToAudioRequest | MultiSpeakerTextToAudioRequest) -> str:
+    """
+    (TTSモデル, テキスト, ボイス名, instructions, 話者の並び) のハッシュ。
+    リクエストをそのままキーにするので、話者の順番や名前が変われば別のキーになる。
+    """
+    return content_key(model=model, request=request.model_dump(mode="json"))
+
+
+def _as_wav_response(response: TextToAudioResponse) -> TextToAudioResponse:
+    """
+    応答の音声を WAV にそろえる。ヘッダなしの PCM はキャッシュすると形式がわからなくなるので、保存する前に行う。
+    mime_type を持たない版の tts-clients では、WAV 以外はそのまま (デコード時に ffmpeg に任せる)。
+    """
+    return TextToAudioResponse(audio=ensure_wav(response.audio, getattr(response, "mime_type", None)))
+
+
+# 合成は同期 SDK をスレッドで呼ぶので止められない。投げ直しても遅い方が最後まで走るので、ヘッジはしない
+_TTS_CALL_POLICY = CallPolicy(timeout_sec=120)
+
+
 class TTS(Runnable):
-    def __init__(self):
-        self.client = GoogleTTSClient(model="gemini-2.5-pro-preview-tts")
+    """
+    Args:
+        model: TTS のモデル
 
-    def invoke(self, text: str, voice_type: VoiceTypes | None = None) -> TextToAudioResponse:
+    非同期呼び出しの同時実行数とレートは、プロセスで共有する "tts" の RateLimiter で制御する。
+    タイムアウトしたリクエストは再試行する。
+    キャッシュにヒットしたリクエストは RateLimiter を通さない。
+    """
+
+    def __init__(self, model: str = "gemini-2.5-pro-preview-tts"):
+        self.model = model
+        self.client = GoogleTTSClient(model=model)
+        self._limiter = get_rate_limiter("tts")
+
+    def _request(self, text: str, voice_type: VoiceTypes | None = None) -> TextToAudioRequest:
         voice_type = voice_type or "woman"
-        req = TextToAudioRequest(
+        return TextToAudioRequest(
             text=text,
             voice_name=_voice_types_map[voice_type].name,
             instructions=_voice_types_map[voice_type].instructions,
         )
-        response = self.client.text_to_audio(req)
-        return response
-
-    async def ainvoke(self, text: str, voice_type: VoiceTypes | None = None) -> TextToAudioResponse:
-        return await asyncio.to_thread(self.invoke, text, voice_type)
 
-    def multi_speaker_invoke(self, talks: list[Talk]) -> TextToAudioResponse:
-        req = MultiSpeakerTextToAudioRequest(
+    def _multi_speaker_request(self, talks: list[Talk]) -> MultiSpeakerTextToAudioRequest:
+        return MultiSpeakerTextToAudioRequest(
             speakers=[
                 SpeakerTextToAudioRequest(
                     speaker_name=talk.speaker_name,
@@ -83,11 +229,90 @@ class TTS(Runnable):
             ],
             instructions="TTS the following conversation between two speakers, " + "and ".join([f"{talk.speaker_name}" for talk in talks]) + ".",
         )
-        response = self.client.multi_speaker_text_to_audio(req)
+
+    def _cached(self, request: _Request, synthesize: Callable[[_Request], TextToAudioResponse]) -> TextToAudioResponse:
+        cache = get_tts_cache()
+        key = tts_cache_key(self.model, request)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            return TextToAudioResponse(audio=cached)
+        response = resilient_call("tts", self._limiter, lambda: _as_wav_response(synthesize(request)), _TTS_CALL_POLICY)
+        if cache is not None:
+            cache.put(key, response.audio)
+        return response
+
+    async def _acached(self, request: _Request, synthesize: Callable[[_Request], TextToAudioResponse]) -> TextToAudioResponse:
+        cache = get_tts_cache()
+        key = tts_cache_key(self.model, request)
+        cached = await run_blocking(cache.get, key) if cache is not None else None
+        if cached is not None:
+            return TextToAudioResponse(audio=cached)
+        # 待っている間スレッドを占有しないように、枠を取ってから合成専用のスレッドで合成する
+        response = await resilient_acall_in_thread(
+            "tts", self._limiter, lambda: _as_wav_response(synthesize(request)), _TTS_CALL_POLICY
+        )
+        if cache is not None:
+            await run_blocking(cache.put, key, response.audio)
         return response
 
+    def invoke(self, text: str, voice_type: VoiceTypes | None = None) -> TextToAudioResponse:
+        return self._cached(self._request(text, voice_type), self.client.text_to_audio)
+
+    async def ainvoke(self, text: str, voice_type: VoiceTypes | None = None) -> TextToAudioResponse:
+        return await self._acached(self._request(text, voice_type), self.client.text_to_audio)
+
+    def multi_speaker_invoke(self, talks: list[Talk]) -> TextToAudioResponse:
+        return self._cached(self._multi_speaker_request(talks), self.client.multi_speaker_text_to_audio)
+
     async def multi_speaker_ainvoke(self, talks: list[Talk]) -> TextToAudioResponse:
-        return await asyncio.to_thread(self.multi_speaker_invoke, talks)
+        return await self._acached(self._multi_speaker_request(talks), self.client.multi_speaker_text_to_audio)
+
+    async def chunked_ainvoke(
+        self,
+        text: str,
+        voice_type: VoiceTypes | None = None,
+        sentence_gap_sec: float = 0.3,
+    ) -> ChunkedTTSResult:
+        """
+        文ごとに分割して並列に合成し、sentence_gap_sec の間隔を空けて連結する。
+        """
+        talks = [Talk(speaker_name="", text=text, voice_type=voice_type or "woman")]
+        result = await self.multi_speaker_chunked_ainvoke(talks, sentence_gap_sec, sentence_gap_sec)
+        for timing in result.timings:
+            timing.speaker_name = None
+        return result
+
+    async def multi_speaker_chunked_ainvoke(
+        self,
+        talks: list[Talk],
+        sentence_gap_sec: float = 0.3,
+        speaker_change_gap_sec: float = 0.5,
+    ) -> ChunkedTTSResult:
+        """
+        発話を文ごとに分割し、それぞれを話者のボイスで単一話者として並列に合成して順番に連結する。
+        同じ話者の文の間は sentence_gap_sec、話者が替わるところは speaker_change_gap_sec の間隔を空ける。
+        """
+        chunks: list[tuple[Talk, str]] = [
+            (talk, sentence)
+            for talk in talks
+            for sentence in split_sentences(talk.text)
+        ]
+        responses = await asyncio.gather(*[
+            self.ainvoke(sentence, voice_type=talk.voice_type)
+            for talk, sentence in chunks
+        ])
+        gaps_sec = [
+            0.0 if i == 0 else speaker_change_gap_sec if talk.speaker_name != chunks[i - 1][0].speaker_name else sentence_gap_sec
+            for i, (talk, _) in enumerate(chunks)
+        ]
+        audio, ranges = concat_wav([response.audio for response in responses], gaps_sec)
+        return ChunkedTTSResult(
+            response=TextToAudioResponse(audio=audio),
+            timings=[
+                ChunkTiming(text=sentence, speaker_name=talk.speaker_name, start_sec=start, end_sec=end)
+                for (talk, sentence), (start, end) in zip(chunks, ranges)
+            ],
+        )
 
 
 def create_tts_chain() -> Runnable:
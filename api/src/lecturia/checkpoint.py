@@ -0,0 +1,89 @@
+import datetime
+import threading
+from typing import Any
+
+from loguru import logger
+from pydantic import BaseModel
+
+from .storage import ArtifactIndex
+from .utils.async_tools import run_blocking
+from .utils.content_cache import content_key
+
+
+CHECKPOINT_NAME = "checkpoint.json"
+
+
+class CheckpointEntry(BaseModel):
+    """
+    Args:
+        input_hash: 作業単位の入力のハッシュ
+        outputs: 作業単位が出力した成果物の名前
+    """
+    input_hash: str
+    outputs: list[str]
+    completed_at: datetime.datetime
+
+
+class CheckpointManifest(BaseModel):
+    units: dict[str, CheckpointEntry] = {}
+
+
+def input_hash(**parts: Any) -> str:
+    """作業単位の入力のハッシュ。値は JSON にできるものを渡す"""
+    return content_key(**parts)
+
+
+class Checkpoint:
+    """
+    講義ディレクトリの checkpoint.json に、作業単位 (スライド・スライドごとの台本/音声/イベント・クイズ) ごとの
+    入力のハッシュと出力を記録する。
+    再開時は入力が変わっていない、かつ出力が揃っている作業単位だけを再利用する。
+    """
+
+    def __init__(self, artifacts: ArtifactIndex):
+        self.artifacts = artifacts
+        self._lock = threading.Lock()
+        if artifacts.exists(CHECKPOINT_NAME):
+            data = artifacts.download(CHECKPOINT_NAME)
+            self.manifest = CheckpointManifest.model_validate_json(data.decode("utf-8"))
+        else:
+            self.manifest = CheckpointManifest()
+
+    def is_fresh(self, unit: str, input_hash: str, outputs: list[str]) -> bool:
+        """
+        作業単位の出力を再利用できるか。
+        記録がない場合は、チェックポイント導入前の講義として出力が揃っていれば再利用し、
+        今の入力のハッシュで記録しておく (次の record で保存される)。
+        """
+        if not all(self.artifacts.exists(name) for name in outputs):
+            return False
+        entry = self.manifest.units.get(unit)
+        if entry is None:
+            with self._lock:
+                self.manifest.units[unit] = CheckpointEntry(
+                    input_hash=input_hash,
+                    outputs=outputs,
+                    completed_at=datetime.datetime.now(datetime.timezone.utc),
+                )
+            return True
+        if entry.input_hash != input_hash:
+            logger.info(f"Checkpoint invalidated: {unit}")
+            return False
+        return True
+
+    def record(self, unit: str, input_hash: str, outputs: list[str]) -> None:
+        with self._lock:
+            self.manifest.units[unit] = CheckpointEntry(
+                input_hash=input_hash,
+                outputs=outputs,
+                completed_at=datetime.datetime.now(datetime.timezone.utc),
+            )
+            self.artifacts.upload(self.manifest.model_dump_json(), CHECKPOINT_NAME, "application/json")
+
+    async def arecord(self, unit: str, input_hash: str, outputs: list[str]) -> None:
+        await run_blocking(self.record, unit, input_hash, outputs)
+
+    def invalidate(self, unit: str) -> None:
+        with self._lock:
+            if self.manifest.units.pop(unit, None) is not None:
+                self.artifacts.upload(self.manifest.model_dump_json(), CHECKPOINT_NAME, "application/json")
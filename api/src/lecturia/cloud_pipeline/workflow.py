@@ -2,25 +2,22 @@ import tempfile
 import shutil
 from pathlib import Path
 
-import numpy as np
 from fastapi import FastAPI, HTTPException, Body
-from langchain_core.tracers.stdout import ConsoleCallbackHandler
 from loguru import logger
-from pydub import AudioSegment
 
-from ..chains.quiz_generator import create_quiz_generator_chain
-from ..chains.slide_maker import HtmlSlide, create_slide_maker_chain
-from ..chains.slide_to_script import Script, ScriptList, create_slide_to_script_chain
-from ..chains.tts import Talk, create_tts_chain
+from ..chains.llm_cache import get_llm_response_cache
+from ..chains.tts import get_tts_cache
+from ..checkpoint import Checkpoint
 from ..database import init_db, session_scope
-from ..chains.event_extractor import create_event_extractor_chain
-from ..lecture_repository import upsert_lecture
-from ..slide_editor import edit_slide
-from ..utils.intervals import rewrite_talk_with_intervaltree
-from ..utils.media import remove_long_silence, detect_nonsilent_ranges
-from ..models import MovieConfig, EventList, Event, QuizSectionList
-from ..storage import is_exists_in_public_bucket, download_data_from_public_bucket, upload_data_to_public_bucket
-from ..utils.async_tools import gather_limited
+from ..lecture_repository import record_lecture_artifacts, upsert_lecture
+from ..manifest import artifact_versions, build_manifest, upload_shared_sprite
+from ..models import LectureEdit, MovieConfig
+from ..phases import InvalidLectureEdit, apply_lecture_edit, collect_slide_audios, create_lecture_nodes
+from ..storage import ArtifactIndex, get_lecture_artifact_index
+from ..utils.async_tools import run_blocking
+from ..utils.dag import DagExecutor
+from ..utils.rate_limit import rate_limiter_stats
+from ..utils.resilience import latency_stats
 
 app = FastAPI()
 
@@ -51,265 +48,140 @@ def _set_lecture_status(
         logger.error("Lecture not found when updating status: {}", lecture_id)
 
 
-def _modify_events_by_check_silence(ev: EventList, audio_file: Path) -> EventList:
-    audio = AudioSegment.from_mp3(audio_file)
-    ranges = detect_nonsilent_ranges(audio)
-    return rewrite_talk_with_intervaltree(ev, ranges, ["right"])
+async def _aset_lecture_status(lecture_id: str, status: str, **kwargs) -> None:
+    """DB の更新でイベントループを止めないように、スレッドで _set_lecture_status を呼ぶ"""
+    await run_blocking(_set_lecture_status, lecture_id, status, **kwargs)
 
 
-def _create_slide_phase(lecture_id: str, config: MovieConfig) -> HtmlSlide:
-    slide_maker = create_slide_maker_chain(config.web_search)
-    if is_exists_in_public_bucket(f"lectures/{lecture_id}/result_slide.html"):
-        logger.info(f"Loading result_slide.html from {f'lectures/{lecture_id}/result_slide.html'}")
-        data = download_data_from_public_bucket(f"lectures/{lecture_id}/result_slide.html")
-        result_slide: HtmlSlide = HtmlSlide.from_html(data.decode("utf-8"))
-    else:
-        result_slide: HtmlSlide = slide_maker.invoke(
-            {
-                "topic": config.topic,
-                "detail": config.detail or "",
-                "extra_rules": "\n".join([f"- {rule}" for rule in config.extra_slide_rules]),
-            },
-            config={
-                "callbacks": [ConsoleCallbackHandler()],
-            },
-        )
-        result_slide = edit_slide(result_slide, use_refiner=False)
-        upload_data_to_public_bucket(result_slide.export_embed_images(), f"lectures/{lecture_id}/result_slide.html", "text/html")
-    return result_slide
+@app.get("/")
+async def root():
+    return {"message": "Hello, World!"}
 
 
-def _create_script_phase(lecture_id: str, config: MovieConfig, result_slide: HtmlSlide) -> ScriptList:
-    slide_to_script = create_slide_to_script_chain(config.speakers)
-    if is_exists_in_public_bucket(f"lectures/{lecture_id}/result_script.json"):
-        logger.info(f"Loading result_script.json from {f'lectures/{lecture_id}/result_script.json'}")
-        data = download_data_from_public_bucket(f"lectures/{lecture_id}/result_script.json")
-        result_script: ScriptList = ScriptList.model_validate_json(data.decode("utf-8"))
-    else:
-        result_script: ScriptList = slide_to_script.invoke(
-            {"slides": result_slide.html},
-            config={
-                "callbacks": [ConsoleCallbackHandler()],
-            },
-        )
-        upload_data_to_public_bucket(result_script.model_dump_json(), f"lectures/{lecture_id}/result_script.json", "application/json")
-    return result_script
+@app.get("/health")
+async def health():
+    return {"message": "OK"}
 
 
-async def _create_quiz_phase(lecture_id: str, result_slide: HtmlSlide) -> QuizSectionList:
-    quiz_generator = create_quiz_generator_chain()
-    if is_exists_in_public_bucket(f"lectures/{lecture_id}/result_quiz.json"):
-        logger.info(f"Loading result_quiz.json from {f'lectures/{lecture_id}/result_quiz.json'}")
-        data = download_data_from_public_bucket(f"lectures/{lecture_id}/result_quiz.json")
-        result_quiz: QuizSectionList = QuizSectionList.model_validate_json(data.decode("utf-8"))
-    else:
-        result_quiz: QuizSectionList = await quiz_generator.ainvoke(
-            {"slides": result_slide.html},
-            config={
-                "callbacks": [ConsoleCallbackHandler()],
-            },
+@app.get("/metrics")
+async def metrics():
+    caches = {
+        name: cache.stats() if cache is not None else None
+        for name, cache in (("llm_cache", get_llm_response_cache()), ("tts_cache", get_tts_cache()))
+    }
+    return {**caches, "rate_limiters": rate_limiter_stats(), "latency": latency_stats()}
+
+
+async def _upload_shared_media(artifacts: ArtifactIndex, config: MovieConfig) -> dict[str, str]:
+    """スプライト (講義間で共有する) と効果音をアップロードし、スプライトのパスを返す"""
+    html_dir = Path(__file__).parent.parent.resolve() / "html"
+    sprite_paths: dict[str, str] = {}
+    for i, character in enumerate(config.characters):
+        sprite_path = html_dir / character.sprite_name
+        # ファイルの読み込みもアップロードと一緒にイベントループの外で行う
+        sprite_paths["right" if i == 0 else "left"] = await run_blocking(
+            lambda: upload_shared_sprite(artifacts.backend, sprite_path.read_bytes())
         )
-        upload_data_to_public_bucket(result_quiz.model_dump_json(), f"lectures/{lecture_id}/result_quiz.json", "application/json")
-    return result_quiz
+
+    quiz_sound = await run_blocking((html_dir / f"quiz_{character.voice_type}.mp3").read_bytes)
+    await artifacts.aupload(quiz_sound, "quiz.mp3", "audio/mpeg")
+    return sprite_paths
 
 
-async def _generate_audio_phase(
+async def _run_lecture(
     lecture_id: str,
+    artifacts: ArtifactIndex,
     config: MovieConfig,
-    result_script: ScriptList,
-    temp_dir: str,
-    max_parallel: int = 3,
-) -> tuple[list[Path], np.ndarray]:
-    tts = create_tts_chain()
-
-    async def _render_one(script: Script) -> Path:
-        audio_file = Path(temp_dir) / f"audio_{script.slide_no}.mp3"
-
-        if not is_exists_in_public_bucket(f"lectures/{lecture_id}/{audio_file.name}"):
-            if len(config.characters) == 1:
-                text = script.script[0].content
-                audio = await tts.ainvoke(text, voice_type=config.characters[0].voice_type)
-            else:
-                talks = [
-                    Talk(
-                        speaker_name=speaker.name,
-                        text=speaker.content,
-                        voice_type=config.get_voice_type(speaker.name),
-                    )
-                    for speaker in script.script
-                ]
-                audio = await tts.multi_speaker_ainvoke(talks)
-
-            audio.save_mp3(str(audio_file))
-            removed = remove_long_silence(AudioSegment.from_mp3(audio_file))
-            removed.export(audio_file, format="mp3")
-            upload_data_to_public_bucket(
-                audio_file.read_bytes(), f"lectures/{lecture_id}/{audio_file.name}", "audio/mpeg"
-            )
-        else:
-            data = download_data_from_public_bucket(f"lectures/{lecture_id}/{audio_file.name}")
-            audio_file.write_bytes(data)
-        return audio_file
-
-    audio_files = await gather_limited(
-        [_render_one(script) for script in result_script.scripts],
-        max_parallel=max_parallel,
-    )
+    checkpoint: Checkpoint,
+    sprite_paths: dict[str, str],
+) -> None:
+    speaker_left_right_map = {
+        speaker.name: "right" if i == 0 else "left" for i, speaker in enumerate(config.speakers)
+    }
 
-    # Calculate audio segments with page transition duration
-    audio_segments: list[AudioSegment] = []
-    for audio_file in audio_files:
-        upload_data_to_public_bucket(audio_file.read_bytes(), f"lectures/{lecture_id}/{audio_file.name}", "audio/mpeg")
-        audio_segments.append(
-            AudioSegment.from_mp3(audio_file) + AudioSegment.silent(duration=config.page_transition_duration_sec * 1000)
+    # スライド -> スクリプト -> 音声 -> イベント (クイズはスライド完成後に並行) を DAG として実行する
+    async def _on_progress(progress: float, labels: list[str]) -> None:
+        await _aset_lecture_status(
+            lecture_id,
+            "running",
+            progress_percentage=5 + int(progress * 90),
+            current_phase="・".join(labels) if labels else "最終処理中",
         )
-    slide_page_event_sec = np.cumsum([len(audio_segment) / 1000 for audio_segment in audio_segments])
-    return audio_files, slide_page_event_sec
-
-
-async def _create_event_phase(
-    lecture_id: str,
-    result_slide: HtmlSlide,
-    result_script: ScriptList,
-    result_quiz: QuizSectionList,
-    audio_files: list[Path],
-    slide_page_event_sec: np.ndarray,
-    speaker_left_right_map: dict[str, str],
-    max_parallel: int = 3,
-) -> EventList:
-    slide_no_to_quiz_section_map = {quiz_section.slide_no: quiz_section for quiz_section in result_quiz.quiz_sections}
-
-    event_extractor = create_event_extractor_chain()
-    if is_exists_in_public_bucket(f"lectures/{lecture_id}/events.json"):
-        logger.info(f"Loading events.json from {f'lectures/{lecture_id}/events.json'}")
-        data = download_data_from_public_bucket(f"lectures/{lecture_id}/events.json")
-        events: EventList = EventList.model_validate_json(data.decode("utf-8"))
-    else:
-        events: EventList = EventList(events=[])
-
-        async def _extract_one(slide_no: int, audio_file: Path) -> list[Event]:
-            first_speaker = (
-                speaker_left_right_map[result_script.scripts[slide_no].script[0].name]
-                if len(speaker_left_right_map) > 1
-                else None
-            )
-            ev = await event_extractor.ainvoke(
-                result_slide.html,
-                slide_no + 1,
-                audio_file,
-                first_speaker,
-            )
-            # スピーカーが一人のときは、発話区間を調整
-            if len(speaker_left_right_map) == 1:
-                ev = _modify_events_by_check_silence(ev, audio_file)
-            prev_sec = slide_page_event_sec[slide_no - 1] if slide_no > 0 else 0
-            # 開始時刻をずらしたうえで返す
-            adjusted = [
-                Event(
-                    type=e.type,
-                    time_sec=prev_sec + e.time_sec,
-                    name=e.name,
-                    target=e.target,
-                    id=e.id,
-                )
-                for e in ev.events
-            ] + [
-                Event(type="slideNext", time_sec=slide_page_event_sec[slide_no])
-            ]
-            # クイズがあれば追加
-            if slide_no in slide_no_to_quiz_section_map:
-                adjusted.append(
-                    Event(
-                        type="quiz",
-                        time_sec=slide_page_event_sec[slide_no],
-                        name=slide_no_to_quiz_section_map[slide_no].name,
-                    )
-                )
-            return adjusted
 
-        results = await gather_limited(
-            [_extract_one(idx, f) for idx, f in enumerate(audio_files)],
-            max_parallel=max_parallel,
+    temp_dir = tempfile.mkdtemp()
+    try:
+        executor = DagExecutor(
+            create_lecture_nodes(artifacts, checkpoint, config, temp_dir, speaker_left_right_map),
+            on_progress=_on_progress,
         )
-        for ev_list in results:
-            events.events.extend(ev_list)
-        logger.info(f"Events: {events}")
-        upload_data_to_public_bucket(events.model_dump_json(), f"lectures/{lecture_id}/events.json", "application/json")
-    return events
-
-
-@app.get("/")
-async def root():
-    return {"message": "Hello, World!"}
+        results = await executor.run()
+        audio_count = len(collect_slide_audios(results))
+    finally:
+        # Cleanup (失敗したときも消す)
+        await run_blocking(shutil.rmtree, temp_dir, ignore_errors=True)
+
+    # Completion (100% progress)
+    versions = await artifact_versions(
+        artifacts.backend,
+        [artifacts.path(name) for name in ["result_slide.html", "result_quiz.json", "events.json"]]
+        + [artifacts.path(f"audio_{i + 1}.mp3") for i in range(audio_count)],
+    )
+    manifest = build_manifest(artifacts.backend, lecture_id, audio_count, sprite_paths, versions)
+    await artifacts.aupload(manifest.model_dump_json(by_alias=True), "manifest.json", "application/json")
+    await run_blocking(_record_artifacts, lecture_id, list(artifacts.names))
+    await _aset_lecture_status(lecture_id, "completed", progress_percentage=100, current_phase="完了")
 
 
-@app.get("/health")
-async def health():
-    return {"message": "OK"}
+def _record_artifacts(lecture_id: str, names: list[str]) -> None:
+    with session_scope() as session:
+        record_lecture_artifacts(session, lecture_id, names)
 
 
 @app.post("/tasks/create-lecture")
 async def create_lecture(lecture_id: str, config: MovieConfig = Body(...)):
-    _set_lecture_status(lecture_id, "running", progress_percentage=0, current_phase="初期化中")
+    await _aset_lecture_status(lecture_id, "running", progress_percentage=0, current_phase="初期化中")
     try:
-        speaker_left_right_map = {
-            speaker.name: "right" if i == 0 else "left" for i, speaker in enumerate(config.speakers)
-        }
+        # 講義ディレクトリの成果物一覧を1回で取得しておく
+        artifacts = await run_blocking(get_lecture_artifact_index, lecture_id)
 
         # upload movie_config.json
-        upload_data_to_public_bucket(config.model_dump_json(), f"lectures/{lecture_id}/movie_config.json", "application/json")
-
-        # upload sprites
-        for i, character in enumerate(config.characters):
-            if i == 0:
-                sprite_path = Path(__file__).parent.parent.resolve() / "html" / character.sprite_name
-                upload_data_to_public_bucket(sprite_path.read_bytes(), f"lectures/{lecture_id}/sprites/right.png", "image/png")
-            else:
-                sprite_path = Path(__file__).parent.parent.resolve() / "html" / character.sprite_name
-                upload_data_to_public_bucket(sprite_path.read_bytes(), f"lectures/{lecture_id}/sprites/left.png", "image/png")
-
-        upload_data_to_public_bucket(
-            (Path(__file__).parent.parent.resolve() / "html" / f"quiz_{character.voice_type}.mp3").read_bytes(),
-            f"lectures/{lecture_id}/quiz.mp3",
-            "audio/mpeg",
-        )
-
-        # Phase 1: Create slides (25% progress)
-        _set_lecture_status(lecture_id, "running", progress_percentage=10, current_phase="スライド生成中")
-        result_slide = _create_slide_phase(lecture_id, config)
-
-        # Phase 2: Create script (50% progress)
-        _set_lecture_status(lecture_id, "running", progress_percentage=25, current_phase="スクリプト作成中")
-        result_script = _create_script_phase(lecture_id, config, result_slide)
-
-        # Phase 3: Create quiz (60% progress)
-        _set_lecture_status(lecture_id, "running", progress_percentage=60, current_phase="クイズ作成中")
-        result_quiz_task = _create_quiz_phase(lecture_id, result_slide)
-
-        # Phase 4: Generate audio (75% progress)
-        _set_lecture_status(lecture_id, "running", progress_percentage=50, current_phase="音声生成中")
-        temp_dir = tempfile.mkdtemp()
-        audio_files, slide_page_event_sec = await _generate_audio_phase(lecture_id, config, result_script, temp_dir)
+        await artifacts.aupload(config.model_dump_json(), "movie_config.json", "application/json")
+        sprite_paths = await _upload_shared_media(artifacts, config)
+        # checkpoint.json のダウンロードでイベントループを止めないように、スレッドで読み込む
+        checkpoint = await run_blocking(Checkpoint, artifacts)
+        await _run_lecture(lecture_id, artifacts, config, checkpoint, sprite_paths)
+    except Exception as e:
+        logger.error(f"Error creating lecture {lecture_id}: {str(e)}")
+        await _aset_lecture_status(lecture_id, "failed", error=str(e), current_phase="エラー")
+        raise
+    return {"lecture_id": lecture_id}
 
-        # Phase 5: Create events (90% progress)
-        result_quiz = await result_quiz_task
-        _set_lecture_status(lecture_id, "running", progress_percentage=75, current_phase="イベント作成中")
-        await _create_event_phase(
-            lecture_id,
-            result_slide,
-            result_script,
-            result_quiz,
-            audio_files,
-            slide_page_event_sec,
-            speaker_left_right_map,
-        )
 
-        # Cleanup and completion (100% progress)
-        _set_lecture_status(lecture_id, "running", progress_percentage=95, current_phase="最終処理中")
-        shutil.rmtree(temp_dir)
-        _set_lecture_status(lecture_id, "completed", progress_percentage=100, current_phase="完了")
+@app.post("/tasks/update-lecture")
+async def update_lecture(lecture_id: str, edit: LectureEdit = Body(...)):
+    """
+    1ページ分の編集を反映し、そのページの台本・音声・イベントだけを作り直す。
+    """
+    await _aset_lecture_status(lecture_id, "running", progress_percentage=0, current_phase="編集の反映中")
+    try:
+        artifacts = await run_blocking(get_lecture_artifact_index, lecture_id)
+        config = MovieConfig.model_validate_json((await artifacts.adownload("movie_config.json")).decode("utf-8"))
+        checkpoint = await run_blocking(Checkpoint, artifacts)
+        try:
+            await apply_lecture_edit(artifacts, checkpoint, config, edit)
+        except InvalidLectureEdit as e:
+            # 編集を適用する前に弾いているので、成果物は元のまま。完成済みの講義は完成のまま戻す
+            # 例外は投げずに返して、Cloud Tasks にリトライさせない
+            logger.warning(f"Rejected edit of lecture {lecture_id}: {str(e)}")
+            if "manifest.json" in artifacts.names:
+                await _aset_lecture_status(lecture_id, "completed", progress_percentage=100, current_phase="完了")
+            else:
+                await _aset_lecture_status(lecture_id, "failed", error=str(e), current_phase="エラー")
+            return {"lecture_id": lecture_id}
+        sprite_paths = await _upload_shared_media(artifacts, config)
+        await _run_lecture(lecture_id, artifacts, config, checkpoint, sprite_paths)
     except Exception as e:
-        logger.error(f"Error creating lecture {lecture_id}: {str(e)}")
-        _set_lecture_status(lecture_id, "failed", error=str(e), current_phase="エラー")
+        logger.error(f"Error updating lecture {lecture_id}: {str(e)}")
+        await _aset_lecture_status(lecture_id, "failed", error=str(e), current_phase="エラー")
         raise
     return {"lecture_id": lecture_id}
@@ -4,6 +4,7 @@ from collections.abc import Iterator
 from contextlib import contextmanager
 
 from loguru import logger
+from sqlalchemy import text
 from sqlalchemy.engine import URL, Engine
 from sqlalchemy.exc import OperationalError
 from sqlmodel import Session, SQLModel, create_engine
@@ -63,11 +64,18 @@ def get_engine() -> Engine:
     return _ENGINE
 
 
+def _migrate(engine: Engine) -> None:
+    # create_all は既存テーブルに列を追加しないので、後から追加した列はここで追加する
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE lectures ADD COLUMN IF NOT EXISTS artifacts JSONB"))
+
+
 def init_db(max_wait_seconds: int = 30) -> None:
     deadline = time.monotonic() + max_wait_seconds
     while True:
         try:
             SQLModel.metadata.create_all(get_engine())
+            _migrate(get_engine())
             return
         except OperationalError as exc:
             if time.monotonic() >= deadline:
@@ -31,6 +31,7 @@ class LectureRecord(SQLModel, table=True):
     progress_percentage: int = Field(default=0, ge=0, le=100)
     current_phase: str | None = None
     error: str | None = None
+    artifacts: list[str] | None = Field(default=None, sa_column=Column(JSONB, nullable=True))  # 講義ディレクトリ内の成果物名 (None は未記録)
     created_at: datetime = Field(default_factory=utc_now, index=True)
     updated_at: datetime = Field(default_factory=utc_now)
     started_at: datetime | None = None
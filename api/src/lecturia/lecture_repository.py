@@ -102,6 +102,18 @@ def upsert_lecture(
     return lecture
 
 
+def record_lecture_artifacts(session: Session, lecture_id: str, artifacts: list[str]) -> LectureRecord | None:
+    lecture = get_lecture(session, lecture_id)
+    if lecture is None:
+        return None
+    lecture.artifacts = sorted(artifacts)
+    lecture.updated_at = utc_now()
+    session.add(lecture)
+    session.commit()
+    session.refresh(lecture)
+    return lecture
+
+
 def mark_lecture_deleted(session: Session, lecture_id: str) -> LectureRecord | None:
     return upsert_lecture(session, lecture_id, "deleted", error=None)
 
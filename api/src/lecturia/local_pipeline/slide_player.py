@@ -1,12 +1,83 @@
 import asyncio
+import io
+from collections.abc import Awaitable, Callable
 from pathlib import Path
 from typing import Literal
 
-from playwright.async_api import async_playwright
+import numpy as np
+from loguru import logger
+from playwright.async_api import Browser, Page, async_playwright
+from PIL import Image
 from pydantic import BaseModel
 from tqdm import tqdm
 
 from ..models import Event, EventList
+from .sprite_compositor import SpriteCompositor
+from .video_writer import FrameSink
+
+
+_HTML_DIR = Path(__file__).parent.parent.resolve() / "html"
+
+# 仮想時間の起点 (2024-01-01T00:00:00Z)。読み込み中は起点の少し前から実時間で進め、再生開始時に起点で止める
+_VIRTUAL_CLOCK_ORIGIN_SEC = 1704067200
+_VIRTUAL_CLOCK_WARMUP_SEC = 3600
+# イベントを送ってから iframe がメッセージを処理するまで待つ実時間。仮想時間は止まっているので動画の時刻には影響しない
+_SIGNAL_SETTLE_SEC = 0.1
+
+# 各フレーム (iframe を含む) で、DOM の変更と canvas への描画があったら画面が変わった印を付ける。
+# WebGL・WebGPU の描画は捕まえられないので、コンテキストを作ったページは毎フレーム撮るように印を付ける
+_CHANGE_TRACKER_JS = """
+(() => {
+  window.__lecturiaChanged = true;
+  const markChanged = () => { window.__lecturiaChanged = true; };
+  const getContext = HTMLCanvasElement.prototype.getContext;
+  HTMLCanvasElement.prototype.getContext = function (type, ...args) {
+    if (/webgl|webgpu/i.test(String(type))) window.__lecturiaAlwaysChanged = true;
+    return getContext.call(this, type, ...args);
+  };
+  new MutationObserver(markChanged).observe(document, {
+    subtree: true, childList: true, attributes: true, characterData: true,
+  });
+  for (const name of [
+    'clearRect', 'fillRect', 'strokeRect', 'fill', 'stroke', 'drawImage', 'putImageData', 'fillText', 'strokeText',
+  ]) {
+    const original = CanvasRenderingContext2D.prototype[name];
+    CanvasRenderingContext2D.prototype[name] = function (...args) {
+      markChanged();
+      return original.apply(this, args);
+    };
+  }
+})();
+"""
+
+# CSS アニメーション・トランジションは rAF ではなくドキュメントのタイムラインで動くので、
+# 最初に見つけた時刻を起点に一時停止して currentTime を仮想時間に合わせる。
+# 前回から画面が変わりうるか (DOM・canvas の変更、新しいアニメーション、前回の時点で終わっていないアニメーション) を返す。
+# 動画・アニメーション GIF/WebP・SVG の SMIL アニメーション・WebGL は変化を検出できないので、ページにある間は常に変わったとみなす
+_SYNC_ANIMATIONS_JS = """
+(now) => {
+  const started = window.__lecturiaAnimationStart ??= new WeakMap();
+  let changed = window.__lecturiaChanged ?? true;
+  window.__lecturiaChanged = false;
+  if (window.__lecturiaAlwaysChanged || document.querySelector(
+    'video, svg :is(animate, animateMotion, animateTransform, set), ' +
+    'img[src*=".gif" i], img[src*=".webp" i], img[src^="data:image/gif" i], img[src^="data:image/webp" i]'
+  )) {
+    changed = true;
+  }
+  for (const anim of document.getAnimations()) {
+    if (!started.has(anim)) {
+      started.set(anim, now);
+      anim.pause();
+      changed = true;
+    } else if (anim.currentTime < anim.effect.getComputedTiming().endTime) {
+      changed = true;
+    }
+    anim.currentTime = now - started.get(anim);
+  }
+  return changed;
+}
+"""
 
 
 class PlayConfig(BaseModel):
@@ -16,70 +87,276 @@ class PlayConfig(BaseModel):
     height: int = 720
     sprite_names: list[str] = []
     layout: Literal["center", "topleft"] = "topleft"
+    # virtual: ページの時計を止め、1フレームごとに 1/fps だけ進める (フレーム単位で正確・実時間より速く描画できる)
+    # realtime: Chromium の実時間のままスクリーンショットを撮る
+    clock: Literal["virtual", "realtime"] = "virtual"
+    # 並列に描画するブラウザの数。2以上ならスライドごとに分けて描画する
+    workers: int = 1
+    # 並列に描画するとき、sink に渡す順番が来るまで手元に残すフレーム数の上限。超えたら先の区間の描画を待たせる
+    max_buffered_frames: int = 300
+    # スクリーンショットの形式。jpeg の方が Chromium でのエンコードとパイプに流す量が小さい
+    image_format: Literal["jpeg", "png"] = "jpeg"
+    jpeg_quality: int = 90
+    # 仮想時間のとき、前のフレームから画面が変わっていなければスクリーンショットを撮らずに前の画像を使い回す
+    skip_unchanged: bool = True
+    # キャラクターはブラウザで描かず、スライドの画像に NumPy で重ねる。ブラウザで描画するのはスライドが変わるときだけになる
+    composite_sprites: bool = True
 
 
-async def play_slide(html_content: str, output_dir: Path, config: PlayConfig) -> list[Path]:
-    fps = config.fps
-    event_durations_sec: list[tuple[str, float, str | None, str | None, str | None]] = []
+class VirtualClock:
+    """
+    Playwright の clock で Date・タイマー・requestAnimationFrame・performance を差し替え、
+    CSS アニメーションは Web Animations API で同じ仮想時間に合わせる。
+    時計を進めるたびに、前回から画面が変わりうるかを返す。
+    """
+
+    def __init__(self, page: Page):
+        self.page = page
+        self.now_ms = 0
+
+    async def install(self) -> None:
+        """ページを開く前に呼ぶ。読み込み中は時計を進めておく"""
+        await self.page.clock.install(time=_VIRTUAL_CLOCK_ORIGIN_SEC - _VIRTUAL_CLOCK_WARMUP_SEC)
+        await self.page.add_init_script(_CHANGE_TRACKER_JS)
+
+    async def start(self) -> None:
+        """読み込みが終わったら呼ぶ。ここを仮想時間の 0 として時計を止める"""
+        await self.page.clock.pause_at(_VIRTUAL_CLOCK_ORIGIN_SEC)
+        self.now_ms = 0
+        await self._sync_animations()
+
+    async def advance_to(self, time_ms: int) -> bool:
+        if time_ms > self.now_ms:
+            await self.page.clock.run_for(time_ms - self.now_ms)
+            self.now_ms = time_ms
+        return await self._sync_animations()
+
+    async def _sync_animations(self) -> bool:
+        changed = False
+        for frame in self.page.frames:
+            changed = await frame.evaluate(_SYNC_ANIMATIONS_JS, self.now_ms) or changed
+        return changed
+
+
+async def _open_player(page: Page, html_content: str, config: PlayConfig) -> None:
+    await page.goto((_HTML_DIR / "player.html").as_uri())
+    await page.evaluate("""
+      async (html) => {
+        const blobUrl = URL.createObjectURL(new Blob([html], {type:'text/html'}));
+        const iframe  = document.getElementById('slide');
+        await new Promise(res => { iframe.onload = () => res(); iframe.src = blobUrl; });
+      }
+    """, html_content)
+    await page.evaluate("layout => window.setSlideLayout(layout)", config.layout)
+    if config.composite_sprites:
+        return
+    if config.sprite_names:
+        # 1st character -> Right
+        await page.evaluate("src => window.setSprite(src, 'right')", config.sprite_names[0])
+    if len(config.sprite_names) > 1:
+        # 2nd character -> Left
+        await page.evaluate("src => window.setSprite(src, 'left')", config.sprite_names[1])
+
+
+def _event_frames(config: PlayConfig) -> list[tuple[Event, int]]:
+    """
+    (区間の終わりに送るイベント, 区間のフレーム数) のリスト。
+    フレーム数は累積の時刻から決め、切り捨ての誤差で音声とずれないようにする。
+    """
+    event_frames: list[tuple[Event, int]] = []
     for prev_event, next_event in zip(
         [Event(type="start", time_sec=0)] + config.events.events[:-1],
         config.events.events,
     ):
-        event_durations_sec.append(
-            (
-                next_event.type,
-                next_event.time_sec - prev_event.time_sec,
-                next_event.name,
-                next_event.target,
-                next_event.id,
-            )
+        event_frames.append(
+            (next_event, round(next_event.time_sec * config.fps) - round(prev_event.time_sec * config.fps))
         )
+    return event_frames
+
+
+def split_shards(event_frames: list[tuple[Event, int]]) -> list[tuple[int, int]]:
+    """slideNext の直後で区間を分け、スライドごとの区間の範囲 [start, end) を返す"""
+    shards: list[tuple[int, int]] = []
+    start = 0
+    for i, (event, _) in enumerate(event_frames):
+        if event.type == "slideNext" and i + 1 < len(event_frames):
+            shards.append((start, i + 1))
+            start = i + 1
+    if start < len(event_frames):
+        shards.append((start, len(event_frames)))
+    return shards
+
+
+class _OrderedFrames:
+    """
+    並列に描画したフレームを番号順に sink に渡す。先の番号が揃うまでは手元に残しておく。
+    手元に残る量を抑えるため、next_no から window 以上先のフレームは番号が追いつくまで put を待たせる。
+    next_no のフレームを描画している区間は待たないので、先頭から順に区間を割り当てていれば詰まらない。
+    """
+
+    def __init__(self, sink: FrameSink, window: int):
+        self.sink = sink
+        self.window = max(1, window)
+        self.next_no = 0
+        self._pending: dict[int, bytes] = {}
+        self._cond = asyncio.Condition()
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(viewport={'width': config.width, 'height': config.height})
+    async def put(self, frame_no: int, frame: bytes) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: frame_no - self.next_no < self.window)
+            self._pending[frame_no] = frame
+            while self.next_no in self._pending:
+                await self.sink.write(self._pending.pop(self.next_no))
+                self.next_no += 1
+            self._cond.notify_all()
+
+
+async def _screenshot(page: Page, config: PlayConfig) -> bytes:
+    if config.image_format == "jpeg":
+        return await page.screenshot(type="jpeg", quality=config.jpeg_quality)
+    return await page.screenshot(type="png")
+
+
+def _encode_image(image: np.ndarray, config: PlayConfig) -> bytes:
+    buf = io.BytesIO()
+    if config.image_format == "jpeg":
+        Image.fromarray(image).save(buf, format="JPEG", quality=config.jpeg_quality)
+    else:
+        Image.fromarray(image).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+async def _capture_background(page: Page) -> np.ndarray:
+    # 合成してから圧縮するので、スライドの画像は劣化のない png で撮る
+    with Image.open(io.BytesIO(await page.screenshot(type="png"))) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+async def _render_shard(
+    browser: Browser,
+    html_content: str,
+    config: PlayConfig,
+    event_frames: list[tuple[Event, int]],
+    shard: tuple[int, int],
+    on_frame: Callable[[int, bytes], Awaitable[None]],
+) -> int:
+    """
+    区間 [start, end) のフレームを新しいコンテキストで描画し、(通しのフレーム番号, 画像) を on_frame に渡す。
+    start より前のイベントはフレームを撮らずに同じ時刻で送り直し、区間の開始時の状態を再現する。
+    config.composite_sprites なら pose はブラウザに送らず、キャラクターは SpriteCompositor で重ねる。
+    実際に撮ったスクリーンショットの数を返す。
+    """
+    start, end = shard
+    fps = config.fps
+    context = await browser.new_context(viewport={'width': config.width, 'height': config.height})
+    try:
         page = await context.new_page()
-        player_html_path = Path(__file__).parent.resolve() / "html" / "player.html"
-        await page.goto(player_html_path.as_uri())
-        await page.evaluate("""
-          async (html) => {
-            const blobUrl = URL.createObjectURL(new Blob([html], {type:'text/html'}));
-            const iframe  = document.getElementById('slide');
-            await new Promise(res => { iframe.onload = () => res(); iframe.src = blobUrl; });
-          }
-        """, html_content)
-        await page.evaluate("layout => window.setSlideLayout(layout)", config.layout)
-        if config.sprite_names:
-            # 1st character -> Right
-            await page.evaluate("src => window.setSprite(src, 'right')", config.sprite_names[0])
-        if len(config.sprite_names) > 1:
-            # 2nd character -> Left
-            await page.evaluate("src => window.setSprite(src, 'left')", config.sprite_names[1])
-
-
-        frames: list[Path] = []
-        total_frames = int(sum(event_duration for _, event_duration, _, _, _ in event_durations_sec) * fps)
-        with tqdm(total=total_frames, desc="Generating frames") as pbar:
-            for event_index, (event_type, event_duration, event_name, event_target, event_id) in enumerate(event_durations_sec):
-                num_frames = int(event_duration * fps)
-                for frame_index in range(num_frames):
-                    frame_path = output_dir / f"{event_index:03d}_{frame_index:05d}.png"
-                    await page.screenshot(path=frame_path)
-                    frames.append(frame_path)
-                    pbar.update(1)
-
-                if event_index < len(event_durations_sec) - 1:
+        clock = VirtualClock(page) if config.clock == "virtual" else None
+        if clock is not None:
+            await clock.install()
+        await _open_player(page, html_content, config)
+        if clock is not None:
+            await clock.start()
+
+        compositor = (
+            SpriteCompositor(
+                config.width, config.height, [_HTML_DIR / name for name in config.sprite_names], config.layout
+            )
+            if config.composite_sprites
+            else None
+        )
+
+        frame_no = 0
+        captured = 0
+        # 直前に sink に渡した画像。イベントを送ったら None に戻して必ず撮り直す
+        frame: bytes | None = None
+        # 合成するときのスライドの画像。スライドの画面が変わったときだけ撮り直す
+        background: np.ndarray | None = None
+        for event_index, (event, num_frames) in enumerate(event_frames[:end]):
+            for frame_index in range(num_frames if event_index >= start else 0):
+                time_ms = round((frame_no + frame_index) * 1000 / fps)
+                if compositor is None:
+                    changed = True
+                    if clock is not None:
+                        changed = await clock.advance_to(time_ms)
+                    if frame is None or changed or not config.skip_unchanged:
+                        frame = await _screenshot(page, config)
+                        captured += 1
+                else:
+                    # 画面が変わらなくても時計は毎フレーム進める。止めるとイベントの後に遅れて始まる
+                    # setTimeout・requestAnimationFrame の処理が次のイベントまで遅れてしまう
+                    slide_changed = True
+                    if clock is not None:
+                        slide_changed = await clock.advance_to(time_ms)
+                    if background is None or slide_changed or not config.skip_unchanged:
+                        background = await _capture_background(page)
+                        captured += 1
+                    sprite_changed = compositor.advance_to(time_ms)
+                    if frame is None or slide_changed or sprite_changed or not config.skip_unchanged:
+                        frame = _encode_image(compositor.compose(background), config)
+                await on_frame(frame_no + frame_index, frame)
+            frame_no += num_frames
+
+            # 区間の最後のイベント (次のスライドへの遷移) は次の区間の担当
+            if event_index < end - 1:
+                # 通しで描画したときにイベントを送る時刻 (区間の最後のフレーム)
+                event_ms = round(max(frame_no - 1, 0) * 1000 / fps)
+                if compositor is not None and event.type == "pose":
+                    compositor.advance_to(event_ms)
+                    compositor.set_pose(event.target, event.name)
+                else:
+                    if clock is not None and clock.now_ms < event_ms:
+                        await clock.advance_to(event_ms)
                     await page.evaluate(
                         "ev => window.playSignal(ev)",
                         {
-                            "type": event_type,
-                            "name": event_name,
-                            "target": event_target,
-                            "id": event_id,
+                            "type": event.type,
+                            "name": event.name,
+                            "target": event.target,
+                            "id": event.id,
                         },
                     )
-                    await asyncio.sleep(0.1)
-
+                    await asyncio.sleep(_SIGNAL_SETTLE_SEC)
+                    frame = None
+        return captured
+    finally:
         await context.close()
-        await browser.close()
-        return frames
+
+
+async def play_slide(html_content: str, sink: FrameSink, config: PlayConfig) -> int:
+    """
+    イベントに合わせてスライドを再生し、フレームの画像を順に sink に渡す。描画したフレーム数を返す。
+    config.workers > 1 ならスライドごとの区間に分け、workers 個のブラウザで並列に描画して順に渡す。
+    """
+    event_frames = _event_frames(config)
+    shards = split_shards(event_frames) if config.workers > 1 else [(0, len(event_frames))]
+    # 先頭から順に割り当て、描画中の最も前の区間のフレームはすぐ sink に流す
+    # (手元に残るのは後ろの区間を描画しているブラウザの分だけで、max_buffered_frames で抑える)
+    queue: asyncio.Queue[tuple[int, int]] = asyncio.Queue()
+    for shard in shards:
+        queue.put_nowait(shard)
+    ordered = _OrderedFrames(sink, config.max_buffered_frames)
+    captured: list[int] = []
+
+    total_frames = sum(num_frames for _, num_frames in event_frames)
+    with tqdm(total=total_frames, desc="Generating frames") as pbar:
+        async def _on_frame(frame_no: int, frame: bytes) -> None:
+            await ordered.put(frame_no, frame)
+            pbar.update(1)
+
+        async with async_playwright() as p:
+            async def _worker() -> None:
+                browser = await p.chromium.launch(headless=True)
+                try:
+                    while not queue.empty():
+                        shard = queue.get_nowait()
+                        captured.append(
+                            await _render_shard(browser, html_content, config, event_frames, shard, _on_frame)
+                        )
+                finally:
+                    await browser.close()
+
+            await asyncio.gather(*(_worker() for _ in range(max(1, min(config.workers, len(shards))))))
+
+    logger.info(f"Rendered {ordered.next_no} frames ({sum(captured)} screenshots, the rest reused unchanged frames)")
+    return ordered.next_no
@@ -0,0 +1,126 @@
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+from PIL import Image
+
+
+# player.html の Character と同じ値
+_POSES = {"idle": (0, 2), "talk": (3, 5), "point": (6, 8)}
+_GRID = (3, 3)
+_SPRITE_FPS = 3
+_CELL_MARGIN = 6
+# .charCanvas の幅 (30vw) と、画面の外にはみ出す量 (-4vw)
+_CANVAS_WIDTH_RATIO = 0.30
+_CANVAS_OFFSET_RATIO = 0.04
+# player.html の setSlideLayout のうち再現できるもの。どちらもスライドの iframe の位置だけを変え、キャラクターの位置は変わらない
+_LAYOUTS = ("center", "topleft")
+
+
+class SpriteSheet:
+    """
+    3x3 のスプライトシートを、コマごとにキャンバスの大きさへ縮小した (アルファを掛けた RGB, アルファ) にしておく。
+    ブラウザで描く場合と同じ画像になるよう、シートは player.html が読むファイルをそのまま使う。
+    """
+
+    def __init__(self, image: Image.Image, size: int):
+        sheet = image.convert("RGBA")
+        cols, rows = _GRID
+        cw, ch = sheet.width / cols, sheet.height / rows
+        m = _CELL_MARGIN
+        self.size = size
+        self.cells: list[tuple[np.ndarray, np.ndarray]] = []
+        for i in range(cols * rows):
+            sx, sy = (i % cols) * cw, (i // cols) * ch
+            cell = sheet.resize((size, size), Image.LANCZOS, box=(sx + m, sy + m, sx + cw - m, sy + ch - m))
+            rgba = np.asarray(cell, dtype=np.float32)
+            alpha = rgba[..., 3:] / 255
+            self.cells.append((rgba[..., :3] * alpha, alpha))
+
+    @classmethod
+    def load(cls, path: Path, size: int) -> "SpriteSheet":
+        with Image.open(path) as image:
+            return cls(image, size)
+
+
+class _Character:
+    def __init__(self, sheet: SpriteSheet, position: tuple[int, int]):
+        self.sheet = sheet
+        self.position = position
+        self.pose = "idle"
+        self.frame = 0
+        self.ticks = 0
+
+    def advance_to(self, time_ms: float) -> bool:
+        """time_ms までのコマ送りを進め、表示するコマが変わったかを返す"""
+        # 0ms で最初のコマを描き、以降 1/_SPRITE_FPS 秒ごとに送る
+        ticks = int(time_ms * _SPRITE_FPS // 1000) + 1
+        changed = False
+        while self.ticks < ticks:
+            s, e = _POSES.get(self.pose, _POSES["idle"])
+            frame = s if self.frame < s or self.frame > e or self.frame + 1 > e else self.frame + 1
+            changed = changed or frame != self.frame
+            self.frame = frame
+            self.ticks += 1
+        return changed
+
+
+class SpriteCompositor:
+    """
+    キャラクターのスプライトを、ブラウザで撮ったスライドの画像に NumPy で重ねる。
+    player.html の .charCanvas と同じ位置・大きさに置き、Character と同じく 3fps でポーズのコマを送る。
+
+    Args:
+        width: 画面の幅
+        height: 画面の高さ
+        sprite_paths: スプライトシートのパス。1人目は右、2人目は左に置く
+        layout: スライドのレイアウト。スライドはブラウザで描くので、キャラクターの位置が同じになるレイアウトだけを受け付ける
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        sprite_paths: list[Path],
+        layout: Literal["center", "topleft"] = "topleft",
+    ):
+        if layout not in _LAYOUTS:
+            raise ValueError(f"SpriteCompositor cannot reproduce layout {layout!r}")
+        size = round(width * _CANVAS_WIDTH_RATIO)
+        offset = round(width * _CANVAS_OFFSET_RATIO)
+        positions = {"right": (width - size + offset, height - size), "left": (-offset, height - size)}
+        self.width = width
+        self.height = height
+        self.layout = layout
+        self._characters = {
+            target: _Character(SpriteSheet.load(path, size), positions[target])
+            for target, path in zip(["right", "left"], sprite_paths)
+        }
+
+    def set_pose(self, target: str | None, pose: str | None) -> None:
+        character = self._characters.get(target if target in ("right", "left") else "right")
+        if character is not None:
+            character.pose = pose or "idle"
+
+    def advance_to(self, time_ms: float) -> bool:
+        """全員のコマ送りを time_ms まで進め、いずれかのコマが変わったかを返す"""
+        changed = False
+        for character in self._characters.values():
+            changed = character.advance_to(time_ms) or changed
+        return changed
+
+    def compose(self, background: np.ndarray) -> np.ndarray:
+        """background (高さ x 幅 x 3 の uint8) にキャラクターを重ねた画像を返す"""
+        image = background.copy()
+        for character in self._characters.values():
+            rgb, alpha = character.sheet.cells[character.frame]
+            x, y = character.position
+            x0, y0 = max(x, 0), max(y, 0)
+            x1, y1 = min(x + character.sheet.size, self.width), min(y + character.sheet.size, self.height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+            region = image[y0:y1, x0:x1].astype(np.float32)
+            region = region * (1 - alpha[src]) + rgb[src]
+            image[y0:y1, x0:x1] = np.clip(np.rint(region), 0, 255).astype(np.uint8)
+        return image
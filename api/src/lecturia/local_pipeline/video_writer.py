@@ -0,0 +1,192 @@
+import asyncio
+import struct
+from pathlib import Path
+from typing import Literal, Protocol
+
+import imageio_ffmpeg
+from loguru import logger
+
+
+# Matroska (EBML) の要素 ID
+_EBML_HEADER = b"\x1a\x45\xdf\xa3"
+_SEGMENT = b"\x18\x53\x80\x67"
+_INFO = b"\x15\x49\xa9\x66"
+_TIMESTAMP_SCALE = b"\x2a\xd7\xb1"
+_TRACKS = b"\x16\x54\xae\x6b"
+_TRACK_ENTRY = b"\xae"
+_CLUSTER = b"\x1f\x43\xb6\x75"
+_CLUSTER_TIMESTAMP = b"\xe7"
+_BLOCK_GROUP = b"\xa0"
+_BLOCK = b"\xa1"
+_BLOCK_DURATION = b"\x9b"
+# サイズ未定の要素 (Segment) に使うサイズ。ストリームの終わりまでを中身とみなす
+_UNKNOWN_SIZE = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+# 時刻の単位 (ns)。Block の時刻はミリ秒で書く
+_TIMESTAMP_SCALE_NS = 1_000_000
+# PNG は Matroska のネイティブのコーデック ID がないので、VFW 互換の BITMAPINFOHEADER で MPNG として渡す
+_PNG_BITMAPINFOHEADER = struct.pack("<IiiHH4sIiiII", 40, 0, 0, 1, 24, b"MPNG", 0, 0, 0, 0, 0)
+
+
+def _ebml_element(element_id: bytes, data: bytes) -> bytes:
+    # サイズは常に 8 バイトの可変長整数で書く
+    return element_id + b"\x01" + len(data).to_bytes(7, "big") + data
+
+
+def _ebml_uint(element_id: bytes, value: int) -> bytes:
+    return _ebml_element(element_id, value.to_bytes(8, "big"))
+
+
+def _ebml_string(element_id: bytes, value: str) -> bytes:
+    return _ebml_element(element_id, value.encode())
+
+
+class FrameSink(Protocol):
+    """フレームの画像 (JPEG/PNG のバイト列) を順番に受け取る"""
+
+    async def write(self, frame: bytes) -> None: ...
+
+
+class VideoWriter:
+    """
+    フレームの画像を ffmpeg の標準入力に流し、音声と合わせて mp4 にエンコードする。
+    ffmpeg の読み込みが追いつかないときは write が待つので、描画とエンコードが並行に進み、フレームはディスクに残らない。
+    フレームは表示時間付きの Matroska で渡し、前のフレームと同じ画像は ffmpeg に送らずに前のフレームの表示時間を延ばす。
+    ffmpeg がデコード・色変換するのは変わったフレームだけになり、出力は -r で固定フレームレートに戻す。
+
+    Args:
+        output_path: 出力する mp4 のパス
+        fps: フレームレート
+        image_format: write に渡す画像の形式
+        audio_path: 合わせる音声。映像より短い場合は無音で埋め、映像の長さに揃える
+    """
+
+    def __init__(
+        self,
+        output_path: Path,
+        fps: int,
+        image_format: Literal["jpeg", "png"] = "jpeg",
+        audio_path: Path | None = None,
+    ):
+        self.output_path = output_path
+        self.fps = fps
+        self.image_format = image_format
+        self.audio_path = audio_path
+        self.frames = 0
+        # 前のフレームと同じで ffmpeg に送らなかったフレーム数
+        self.repeated = 0
+        # 表示時間が決まっていない (次に違うフレームが来るまで延びる) フレームと、その開始フレーム番号
+        self._pending: bytes | None = None
+        self._pending_no = 0
+        self._proc: asyncio.subprocess.Process | None = None
+        self._stderr: asyncio.Task[bytes] | None = None
+
+    def command(self) -> list[str]:
+        cmd = [
+            imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-f", "matroska", "-i", "pipe:0",
+        ]
+        if self.audio_path is not None:
+            cmd += ["-i", str(self.audio_path), "-map", "0:v", "-map", "1:a", "-af", "apad", "-shortest", "-c:a", "aac"]
+        cmd += ["-fps_mode", "cfr", "-r", str(self.fps), "-c:v", "libx264", "-pix_fmt", "yuv420p", str(self.output_path)]
+        return cmd
+
+    def _header(self) -> bytes:
+        ebml = _ebml_element(_EBML_HEADER, b"".join([
+            _ebml_uint(b"\x42\x86", 1),  # EBMLVersion
+            _ebml_uint(b"\x42\xf7", 1),  # EBMLReadVersion
+            _ebml_uint(b"\x42\xf2", 4),  # EBMLMaxIDLength
+            _ebml_uint(b"\x42\xf3", 8),  # EBMLMaxSizeLength
+            _ebml_string(b"\x42\x82", "matroska"),  # DocType
+            _ebml_uint(b"\x42\x87", 4),  # DocTypeVersion
+            _ebml_uint(b"\x42\x85", 2),  # DocTypeReadVersion
+        ]))
+        info = _ebml_element(_INFO, _ebml_uint(_TIMESTAMP_SCALE, _TIMESTAMP_SCALE_NS))
+        if self.image_format == "jpeg":
+            codec = _ebml_string(b"\x86", "V_MJPEG")  # CodecID
+        else:
+            codec = _ebml_string(b"\x86", "V_MS/VFW/FOURCC") + _ebml_element(b"\x63\xa2", _PNG_BITMAPINFOHEADER)  # CodecPrivate
+        track = _ebml_element(_TRACK_ENTRY, b"".join([
+            _ebml_uint(b"\xd7", 1),  # TrackNumber
+            _ebml_uint(b"\x73\xc5", 1),  # TrackUID
+            _ebml_uint(b"\x83", 1),  # TrackType (video)
+            codec,
+        ]))
+        return ebml + _SEGMENT + _UNKNOWN_SIZE + info + _ebml_element(_TRACKS, track)
+
+    def _timestamp_ms(self, frame_no: int) -> int:
+        return round(frame_no * 1000 / self.fps)
+
+    def _cluster(self, frame: bytes, start_no: int, end_no: int) -> bytes:
+        """start_no から end_no の手前まで表示するフレーム。1つの Cluster に Block を1つだけ入れる"""
+        start_ms = self._timestamp_ms(start_no)
+        # トラック番号 1、Cluster からの相対時刻 0、フラグなし
+        block = _ebml_element(_BLOCK, b"\x81" + struct.pack(">hB", 0, 0) + frame)
+        duration = _ebml_uint(_BLOCK_DURATION, self._timestamp_ms(end_no) - start_ms)
+        return _ebml_element(_CLUSTER, _ebml_uint(_CLUSTER_TIMESTAMP, start_ms) + _ebml_element(_BLOCK_GROUP, block + duration))
+
+    async def start(self) -> None:
+        self._proc = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        # stderr を読み続けないと、出力が多いときに ffmpeg が止まる
+        self._stderr = asyncio.create_task(self._proc.stderr.read())
+        await self._send(self._header())
+
+    async def _send(self, data: bytes) -> None:
+        try:
+            self._proc.stdin.write(data)
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            await self._proc.wait()
+            raise RuntimeError(f"ffmpeg exited while writing frames: {(await self._stderr).decode(errors='replace')}")
+
+    async def _flush_pending(self) -> None:
+        if self._pending is not None:
+            await self._send(self._cluster(self._pending, self._pending_no, self.frames))
+            self._pending = None
+
+    async def write(self, frame: bytes) -> None:
+        if self._proc is None:
+            raise RuntimeError("VideoWriter is not started")
+        # 使い回したフレームは同じオブジェクトなので、比較はすぐ終わる
+        if frame == self._pending:
+            self.repeated += 1
+        else:
+            await self._flush_pending()
+            self._pending = frame
+            self._pending_no = self.frames
+        self.frames += 1
+
+    async def close(self) -> Path:
+        """入力を閉じてエンコードの完了を待つ"""
+        if self._proc is None:
+            raise RuntimeError("VideoWriter is not started")
+        await self._flush_pending()
+        self._proc.stdin.close()
+        returncode = await self._proc.wait()
+        stderr = (await self._stderr).decode(errors="replace")
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed ({returncode}): {stderr}")
+        logger.info(
+            f"Encoded {self.frames} frames to {self.output_path} "
+            f"({self.frames - self.repeated} decoded by ffmpeg, {self.repeated} repeated the previous frame)"
+        )
+        return self.output_path
+
+    async def abort(self) -> None:
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+
+    async def __aenter__(self) -> "VideoWriter":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import re
+import urllib.parse
+
+from pydantic import BaseModel
+
+from .models import Manifest
+from .static_proxy import is_static_proxy_enabled
+from .storage import StorageBackend, get_public_storage, get_public_storage_url
+from .utils.lru_cache import LRUCache
+
+
+class CachedManifest(BaseModel):
+    body: bytes
+    etag: str
+
+
+# 講義はワーカーが部分的に作り直すことがあるので、API のプロセスが持つキャッシュは一定時間で切る
+MANIFEST_CACHE_TTL_SEC = 60
+_MANIFEST_CACHE: LRUCache[str, CachedManifest] = LRUCache(maxsize=256, ttl_sec=MANIFEST_CACHE_TTL_SEC)
+
+
+def versioned_url(url: str, version: str | None) -> str:
+    # 講義の成果物は immutable で配信しているので、内容が変わったら URL を変える
+    # エミュレータの URL は ?alt=media を含むので、既存のクエリに v を足す
+    if not version:
+        return url
+    parts = urllib.parse.urlsplit(url)
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if k != "v"]
+    query.append(("v", version))
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def media_url(backend: StorageBackend, path: str, version: str | None = None) -> str:
+    if is_static_proxy_enabled(backend):
+        # API から配信する場合は Origin の問題がないので /static 経由にする
+        return versioned_url(f"/static/{path}", version)
+    return versioned_url(get_public_storage_url(path), version)  # リダイレクトでOriginがnullになるので、storage.googleapis.com を直接指定
+
+
+async def artifact_versions(backend: StorageBackend, paths: list[str]) -> dict[str, str]:
+    """
+    成果物ごとの ETag を URL のバージョンとして返す。
+    """
+    infos = await asyncio.gather(*[backend.astat(path) for path in paths])
+    return {
+        path: hashlib.sha256(info.etag.encode("utf-8")).hexdigest()[:16]
+        for path, info in zip(paths, infos)
+        if info is not None
+    }
+
+
+def upload_shared_sprite(backend: StorageBackend, data: bytes) -> str:
+    """
+    スプライトは講義間で共通なので、内容のハッシュをファイル名にして1つだけ保存する。
+    保存先のパスを返す。
+    """
+    path = f"sprites/{hashlib.sha256(data).hexdigest()}.png"
+    if not backend.exists(path):
+        backend.upload(data, path, "image/png")
+    return path
+
+
+def build_manifest(
+    backend: StorageBackend,
+    lecture_id: str,
+    audio_count: int,
+    sprite_paths: dict[str, str],
+    versions: dict[str, str] | None = None,
+) -> Manifest:
+    """
+    Args:
+        audio_count: スライドごとの音声ファイルの数
+        sprite_paths: "left"/"right" ごとのスプライト画像のストレージ上のパス
+        versions: ストレージ上のパスごとの URL のバージョン (artifact_versions)
+    """
+    versions = versions or {}
+    prefix = f"lectures/{lecture_id}/"
+    return Manifest(
+        id=lecture_id,
+        title=str(lecture_id),  # 現状使用してないので、仮で入れておく
+        slide_url=versioned_url(f"/static/{prefix}result_slide.html", versions.get(f"{prefix}result_slide.html")),
+        quiz_url=versioned_url(f"/static/{prefix}result_quiz.json", versions.get(f"{prefix}result_quiz.json")),
+        audio_urls=[
+            media_url(backend, f"{prefix}audio_{i + 1}.mp3", versions.get(f"{prefix}audio_{i + 1}.mp3"))
+            for i in range(audio_count)
+        ],
+        quiz_sfx_url=media_url(backend, f"{prefix}quiz.mp3"),
+        events_url=versioned_url(f"/static/{prefix}events.json", versions.get(f"{prefix}events.json")),
+        sprites={side: media_url(backend, path) for side, path in sprite_paths.items()},
+        slide_width=1280,
+        slide_height=720,
+    )
+
+
+def _to_cached(body: bytes) -> CachedManifest:
+    return CachedManifest(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+async def load_manifest(lecture_id: str) -> CachedManifest | None:
+    """
+    ワーカーが保存した manifest.json をプロセス内の LRU キャッシュ経由で返す。
+    manifest.json がない古い講義は、講義ディレクトリの一覧から組み立てる。
+    """
+    cached = _MANIFEST_CACHE.get(lecture_id)
+    if cached is not None:
+        return cached
+
+    backend = get_public_storage()
+    prefix = f"lectures/{lecture_id}/"
+    names = {path[len(prefix):] for path in await backend.alist(prefix)}
+    if not names:
+        return None
+
+    if "manifest.json" in names:
+        body = await backend.adownload(prefix + "manifest.json")
+        if body is None:
+            return None
+    else:
+        manifest = build_manifest(
+            backend,
+            lecture_id,
+            sum(1 for name in names if re.fullmatch(r"audio_\d+\.mp3", name)),
+            {side: f"{prefix}sprites/{side}.png" for side in ("left", "right") if f"sprites/{side}.png" in names},
+        )
+        body = manifest.model_dump_json(by_alias=True).encode("utf-8")
+        if "events.json" not in names:
+            # 生成途中の講義は内容が変わるのでキャッシュしない
+            return _to_cached(body)
+
+    cached = _to_cached(body)
+    _MANIFEST_CACHE.put(lecture_id, cached)
+    return cached
+
+
+def invalidate_manifest(lecture_id: str) -> None:
+    _MANIFEST_CACHE.pop(lecture_id)
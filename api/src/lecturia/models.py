@@ -5,7 +5,7 @@ from typing import Literal
 from pydantic import BaseModel, ConfigDict
 from pydantic.alias_generators import to_camel
 
-from .chains.slide_to_script import Speaker
+from .chains.slide_to_script import Script, Speaker
 from .chains.tts import VoiceTypes
 
 
@@ -77,6 +77,8 @@ class MovieConfig(BaseModel):
         Character(name="speaker1", role="講師", sprite_name="sprite_woman.png", voice_type="woman")
     ]
     web_search: bool = False
+    tts_chunked: bool = False  # 文ごとに分割して並列に音声合成する
+    sentence_gap_sec: float = 0.3
     created_at: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
 
     @property
@@ -94,6 +96,20 @@ class MovieConfig(BaseModel):
         raise ValueError(f"Voice type not found: {name}")
 
 
+class LectureEdit(BaseModel):
+    """
+    講義の1ページ分の編集
+
+    Args:
+        slide_no: 編集するページ番号 (1始まり)
+        slide_html: 差し替えるページの html (<div class="slide">...</div>)。None ならスライドは変更しない
+        script: 差し替える台本。None でスライドを変更した場合は、そのページの台本を再生成する
+    """
+    slide_no: int
+    slide_html: str | None = None
+    script: Script | None = None
+
+
 class Manifest(BaseModel):
     """
     講義のマニフェスト
@@ -109,7 +125,7 @@ class Manifest(BaseModel):
     audio_urls: list[str]
     quiz_sfx_url: str
     events_url: str
-    sprites: dict[str, str]  # base64 encoded image
+    sprites: dict[str, str]  # "left"/"right" ごとのスプライト画像のURL
     slide_width: int
     slide_height: int
     created_at: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
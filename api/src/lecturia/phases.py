@@ -0,0 +1,591 @@
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from langchain_core.tracers.stdout import ConsoleCallbackHandler
+from loguru import logger
+from pydantic import BaseModel
+from pydub import AudioSegment
+from tts_clients.google.models import TextToAudioResponse
+
+from .chains.event_extractor import EventExtractor, create_event_extractor_chain
+from .chains.quiz_generator import create_quiz_generator_chain
+from .chains.slide_maker import HtmlSlide, create_slide_maker_chain
+from .chains.slide_to_script import Script, ScriptList, create_slide_to_script_chain
+from .chains.tts import TTS, ChunkTimingList, Talk, create_tts_chain
+from .checkpoint import Checkpoint, input_hash
+from .models import Event, EventList, LectureEdit, MovieConfig, QuizSectionList
+from .slide_editor import edit_slide
+from .storage import ArtifactIndex, LocalStorage
+from .utils.async_tools import run_blocking
+from .utils.content_cache import digest_bytes
+from .utils.dag import DagNode
+from .utils.intervals import rewrite_talk_with_intervaltree
+from .utils.media import AudioAnalysis, analyze_audio, process_tts_audio
+from .utils.rate_limit import estimate_tokens, get_rate_limiter, google_provider
+from .utils.resilience import CallPolicy, resilient_acall
+
+
+def _modify_events_by_check_silence(ev: EventList, nonsilent_ranges: list[tuple[float, float]]) -> EventList:
+    return rewrite_talk_with_intervaltree(ev, nonsilent_ranges, ["right"])
+
+
+# 生成する量が多い呼び出しはヘッジすると費用が倍になるので、タイムアウトと再試行だけにする。
+# タイムアウト x 試行回数と再試行の待ち (1回目 1 秒・2回目 2 秒まで) が Cloud Tasks の期限 (900 秒) に収まるようにする
+# (スライド: 420 x 2 + 1 = 841 秒、台本・クイズ: 280 x 3 + 3 = 843 秒)。Retry-After による待ちは含まない
+_SLIDE_CALL_POLICY = CallPolicy(timeout_sec=420, max_retries=1)
+_SCRIPT_CALL_POLICY = CallPolicy(timeout_sec=280, max_retries=2)
+_QUIZ_CALL_POLICY = CallPolicy(timeout_sec=280, max_retries=2)
+
+
+def slide_digest(result_slide: HtmlSlide) -> str:
+    return digest_bytes(result_slide.html.encode("utf-8"))
+
+
+def page_context(result_slide: HtmlSlide, slide_no: int) -> str:
+    """
+    イベント抽出に渡す1ページ分の html (共有の head と script + そのページ)。
+    ページを class="slide" で分けられないスライドはスライド全体を渡す。
+    """
+    deck = result_slide.split_pages()
+    if not 1 <= slide_no <= deck.num_pages:
+        return result_slide.html
+    return deck.render([slide_no])
+
+
+def content_context(result_slide: HtmlSlide, slide_nos: list[int] | None = None) -> str:
+    """
+    台本・クイズの生成に渡すページの内容。見た目と動作 (head と script) は除く。
+    """
+    deck = result_slide.split_pages()
+    if deck.num_pages == 0:
+        return result_slide.html
+    return deck.render(slide_nos, include_head=False, include_scripts=False)
+
+
+def page_digest(result_slide: HtmlSlide, slide_no: int) -> str:
+    """
+    1ページ分のハッシュ。他のページを編集しても変わらない。
+    """
+    return digest_bytes(page_context(result_slide, slide_no).encode("utf-8"))
+
+
+def _slide_hash(config: MovieConfig) -> str:
+    return input_hash(
+        topic=config.topic,
+        detail=config.detail,
+        extra_slide_rules=config.extra_slide_rules,
+        web_search=config.web_search,
+    )
+
+
+def _script_hash(config: MovieConfig, result_slide: HtmlSlide) -> str:
+    return input_hash(
+        slide=slide_digest(result_slide),
+        speakers=[speaker.model_dump() for speaker in config.speakers],
+    )
+
+
+def _quiz_hash(result_slide: HtmlSlide) -> str:
+    return input_hash(slide=slide_digest(result_slide))
+
+
+async def create_slide_phase(artifacts: ArtifactIndex, checkpoint: Checkpoint, config: MovieConfig) -> HtmlSlide:
+    slide_maker = create_slide_maker_chain(config.web_search)
+    slide_hash = _slide_hash(config)
+    if checkpoint.is_fresh("slide", slide_hash, ["result_slide.html"]):
+        logger.info(f"Loading result_slide.html from {artifacts.path('result_slide.html')}")
+        data = await artifacts.adownload("result_slide.html")
+        result_slide: HtmlSlide = await run_blocking(HtmlSlide.from_html, data.decode("utf-8"))
+    else:
+        result_slide: HtmlSlide = await resilient_acall(
+            "slide_maker",
+            get_rate_limiter("anthropic"),
+            lambda: slide_maker.ainvoke(
+                {
+                    "topic": config.topic,
+                    "detail": config.detail or "",
+                    "extra_rules": "\n".join([f"- {rule}" for rule in config.extra_slide_rules]),
+                },
+                config={
+                    "callbacks": [ConsoleCallbackHandler()],
+                },
+            ),
+            _SLIDE_CALL_POLICY,
+        )
+        # 画像の生成・検索は同期の SDK を使うのでスレッドで実行する
+        result_slide = await run_blocking(edit_slide, result_slide, use_refiner=False)
+        await artifacts.aupload(await run_blocking(result_slide.export_embed_images), "result_slide.html", "text/html")
+        await checkpoint.arecord("slide", slide_hash, ["result_slide.html"])
+    return result_slide
+
+
+async def create_script_phase(
+    artifacts: ArtifactIndex,
+    checkpoint: Checkpoint,
+    config: MovieConfig,
+    result_slide: HtmlSlide,
+) -> ScriptList:
+    slide_to_script = create_slide_to_script_chain(config.speakers)
+    script_hash = _script_hash(config, result_slide)
+    if checkpoint.is_fresh("script", script_hash, ["result_script.json"]):
+        logger.info(f"Loading result_script.json from {artifacts.path('result_script.json')}")
+        data = await artifacts.adownload("result_script.json")
+        result_script: ScriptList = ScriptList.model_validate_json(data.decode("utf-8"))
+    else:
+        slides = await run_blocking(content_context, result_slide)
+        result_script: ScriptList = await resilient_acall(
+            "slide_to_script",
+            get_rate_limiter("anthropic"),
+            lambda: slide_to_script.ainvoke(
+                {"slides": slides},
+                config={
+                    "callbacks": [ConsoleCallbackHandler()],
+                },
+            ),
+            _SCRIPT_CALL_POLICY,
+            tokens=estimate_tokens(slides),
+        )
+        await artifacts.aupload(result_script.model_dump_json(), "result_script.json", "application/json")
+        await checkpoint.arecord("script", script_hash, ["result_script.json"])
+    return result_script
+
+
+async def create_quiz_phase(artifacts: ArtifactIndex, checkpoint: Checkpoint, result_slide: HtmlSlide) -> QuizSectionList:
+    quiz_generator = create_quiz_generator_chain()
+    quiz_hash = _quiz_hash(result_slide)
+    if checkpoint.is_fresh("quiz", quiz_hash, ["result_quiz.json"]):
+        logger.info(f"Loading result_quiz.json from {artifacts.path('result_quiz.json')}")
+        data = await artifacts.adownload("result_quiz.json")
+        result_quiz: QuizSectionList = QuizSectionList.model_validate_json(data.decode("utf-8"))
+    else:
+        slides = await run_blocking(content_context, result_slide)
+        result_quiz: QuizSectionList = await resilient_acall(
+            "quiz_generator",
+            get_rate_limiter(google_provider()),
+            lambda: quiz_generator.ainvoke(
+                {"slides": slides},
+                config={
+                    "callbacks": [ConsoleCallbackHandler()],
+                },
+            ),
+            _QUIZ_CALL_POLICY,
+            tokens=estimate_tokens(slides),
+        )
+        await artifacts.aupload(result_quiz.model_dump_json(), "result_quiz.json", "application/json")
+        await checkpoint.arecord("quiz", quiz_hash, ["result_quiz.json"])
+    return result_quiz
+
+
+class InvalidLectureEdit(ValueError):
+    """講義の成果物に適用できない編集。リトライしても成功しない"""
+
+
+async def apply_lecture_edit(
+    artifacts: ArtifactIndex,
+    checkpoint: Checkpoint,
+    config: MovieConfig,
+    edit: LectureEdit,
+) -> None:
+    """
+    1ページ分の編集を result_slide.html / result_script.json に反映する。
+    スライドだけを変更した場合は、そのページだけを渡してそのページの台本を再生成する。
+    スライドの変更で他のページの台本やクイズを作り直さないように、それらのチェックポイントは新しいスライドで記録し直す。
+    その後 DAG を実行すると、入力が変わったページの音声とイベントだけが再計算され、イベントの時刻も付け直される。
+    """
+    result_slide = await create_slide_phase(artifacts, checkpoint, config)
+    result_script = await create_script_phase(artifacts, checkpoint, config, result_slide)
+    script_idx = next(
+        (i for i, script in enumerate(result_script.scripts) if script.slide_no == edit.slide_no),
+        None,
+    )
+    if script_idx is None:
+        raise InvalidLectureEdit(f"Invalid slide number: {edit.slide_no}")
+
+    if edit.slide_html is not None:
+        try:
+            result_slide = await run_blocking(result_slide.replace_page, edit.slide_no, edit.slide_html)
+        except (ValueError, OSError) as e:
+            # ページ数の範囲外・.slide が1つでない・埋め込み画像が読めない html はリトライしても直らない
+            raise InvalidLectureEdit(f"Invalid slide html for slide {edit.slide_no}: {e}") from e
+
+    if edit.script is not None:
+        new_script = edit.script.model_copy(update={"slide_no": edit.slide_no})
+    elif edit.slide_html is not None:
+        logger.info(f"Regenerating script of slide {edit.slide_no}")
+        slide_to_script = create_slide_to_script_chain(config.speakers)
+        slides = await run_blocking(content_context, result_slide, [edit.slide_no])
+        page_scripts: ScriptList = await resilient_acall(
+            "slide_to_script",
+            get_rate_limiter("anthropic"),
+            lambda: slide_to_script.ainvoke(
+                {"slides": slides},
+                config={
+                    "callbacks": [ConsoleCallbackHandler()],
+                },
+            ),
+            _SCRIPT_CALL_POLICY,
+            tokens=estimate_tokens(slides),
+        )
+        # 1ページだけを渡しているので、そのページの台本が1つだけ返るはず。
+        # ページ番号は渡したページの中の表記 (edit.slide_no) か、1ページ目として 1 を付けることがある
+        if len(page_scripts.scripts) != 1 or not page_scripts.scripts[0].script:
+            raise InvalidLectureEdit(
+                f"Script generation for slide {edit.slide_no} returned {len(page_scripts.scripts)} scripts"
+                " (expected one non-empty script)"
+            )
+        if page_scripts.scripts[0].slide_no not in (1, edit.slide_no):
+            raise InvalidLectureEdit(
+                f"Script generation for slide {edit.slide_no} returned a script for slide {page_scripts.scripts[0].slide_no}"
+            )
+        new_script = page_scripts.scripts[0].model_copy(update={"slide_no": edit.slide_no})
+    else:
+        new_script = None
+
+    # 編集を弾くのはここまで。弾いたときに成果物が元のままになるように、保存はまとめて最後に行う
+    if edit.slide_html is not None:
+        await artifacts.aupload(await run_blocking(result_slide.export_embed_images), "result_slide.html", "text/html")
+        await checkpoint.arecord("slide", _slide_hash(config), ["result_slide.html"])
+        await checkpoint.arecord("quiz", _quiz_hash(result_slide), ["result_quiz.json"])
+    if new_script is not None:
+        result_script.scripts[script_idx] = new_script
+        await artifacts.aupload(result_script.model_dump_json(), "result_script.json", "application/json")
+    await checkpoint.arecord("script", _script_hash(config, result_slide), ["result_script.json"])
+
+
+class SlideAudio(BaseModel):
+    """
+    スライド1枚分の音声。MP3 の実体はストレージにあり、ローカルには必要になったときだけ置く。
+
+    Args:
+        name: ストレージ上の MP3 の名前
+        analysis: 長さと非無音区間。合成時に PCM から求めて audio_{n}.json に保存したもの
+        input_hash: 音声の入力 (台本・ボイス) のハッシュ。後段のチェックポイントに使う
+        file: MP3 を置くローカルのパス。ensure_file を呼ぶまでは存在するとは限らない
+    """
+    name: str
+    analysis: AudioAnalysis
+    input_hash: str
+    file: Path
+
+    async def ensure_file(self, artifacts: ArtifactIndex) -> Path:
+        """
+        ローカルの MP3 を返す。手元になければストレージから1回だけダウンロードする。
+        ローカルストレージの場合はそのファイルをそのまま使う。
+        """
+        if await run_blocking(self.file.exists):
+            return self.file
+        if isinstance(artifacts.backend, LocalStorage):
+            return artifacts.backend.local_file(artifacts.path(self.name))
+        await run_blocking(self.file.write_bytes, await artifacts.adownload(self.name))
+        return self.file
+
+
+def audio_analysis_name(slide_no: int) -> str:
+    return f"audio_{slide_no}.json"
+
+
+async def _synthesize_script(
+    artifacts: ArtifactIndex,
+    config: MovieConfig,
+    tts: TTS,
+    script: Script,
+) -> TextToAudioResponse:
+    if len(config.characters) == 1:
+        text = script.script[0].content
+        voice_type = config.characters[0].voice_type
+        if config.tts_chunked:
+            result = await tts.chunked_ainvoke(text, voice_type=voice_type, sentence_gap_sec=config.sentence_gap_sec)
+        else:
+            return await tts.ainvoke(text, voice_type=voice_type)
+    else:
+        talks = [
+            Talk(
+                speaker_name=speaker.name,
+                text=speaker.content,
+                voice_type=config.get_voice_type(speaker.name),
+            )
+            for speaker in script.script
+        ]
+        if config.tts_chunked:
+            result = await tts.multi_speaker_chunked_ainvoke(talks, sentence_gap_sec=config.sentence_gap_sec)
+        else:
+            return await tts.multi_speaker_ainvoke(talks)
+    # 文ごとの区間は副産物として保存しておく
+    await artifacts.aupload(
+        ChunkTimingList(timings=result.timings).model_dump_json(),
+        f"tts_timings_{script.slide_no}.json",
+        "application/json",
+    )
+    return result.response
+
+
+async def generate_slide_audio(
+    artifacts: ArtifactIndex,
+    checkpoint: Checkpoint,
+    config: MovieConfig,
+    tts: TTS,
+    script: Script,
+    temp_dir: str,
+) -> SlideAudio:
+    audio_file = Path(temp_dir) / f"audio_{script.slide_no}.mp3"
+    analysis_name = audio_analysis_name(script.slide_no)
+    unit = f"audio_{script.slide_no}"
+    audio_hash = input_hash(
+        script=script.model_dump(),
+        voice_types={character.name: character.voice_type for character in config.characters},
+        tts_chunked=config.tts_chunked,
+        sentence_gap_sec=config.sentence_gap_sec,
+    )
+
+    if not checkpoint.is_fresh(unit, audio_hash, [audio_file.name]):
+        response = await _synthesize_script(artifacts, config, tts, script)
+        # 分割合成では文間の間隔を制御しているので、長い無音の除去は不要
+        processed = await run_blocking(process_tts_audio, response.audio, not config.tts_chunked)
+        # イベント抽出ですぐに使うので手元にも置いておく
+        await run_blocking(audio_file.write_bytes, processed.mp3)
+        await artifacts.aupload(processed.mp3, audio_file.name, "audio/mpeg")
+        await artifacts.aupload(processed.analysis.model_dump_json(), analysis_name, "application/json")
+        await checkpoint.arecord(unit, audio_hash, [audio_file.name, analysis_name])
+        analysis = processed.analysis
+    elif artifacts.exists(analysis_name):
+        # 長さなどは合成時の値を使うので、MP3 のダウンロードとデコードは不要
+        data = await artifacts.adownload(analysis_name)
+        analysis = AudioAnalysis.model_validate_json(data.decode("utf-8"))
+    else:
+        # 解析結果を保存していなかった講義は、1回だけ MP3 をデコードして保存する
+        data = await artifacts.adownload(audio_file.name)
+        await run_blocking(audio_file.write_bytes, data)
+        analysis = await run_blocking(lambda: analyze_audio(AudioSegment.from_mp3(audio_file)))
+        await artifacts.aupload(analysis.model_dump_json(), analysis_name, "application/json")
+        await checkpoint.arecord(unit, audio_hash, [audio_file.name, analysis_name])
+    return SlideAudio(name=audio_file.name, analysis=analysis, input_hash=audio_hash, file=audio_file)
+
+
+def slide_page_event_sec(config: MovieConfig, audios: list[SlideAudio]) -> np.ndarray:
+    """各スライドの終了時刻 (ページ遷移の時間を含む)"""
+    return np.cumsum([audio.analysis.duration_sec + config.page_transition_duration_sec for audio in audios])
+
+
+def slide_events_name(slide_idx: int) -> str:
+    return f"slide_events_{slide_idx + 1}.json"
+
+
+async def extract_slide_events(
+    artifacts: ArtifactIndex,
+    checkpoint: Checkpoint,
+    config: MovieConfig,
+    event_extractor: EventExtractor,
+    result_slide: HtmlSlide,
+    result_script: ScriptList,
+    slide_idx: int,
+    audio: SlideAudio,
+    speaker_left_right_map: dict[str, str],
+) -> EventList:
+    """
+    スライド1枚分のイベントを、そのスライドの音声の先頭を 0 秒とした時刻で返す。
+    他のスライドの音声に依存しないので、音声ができたスライドから順に抽出できる。
+    結果は slide_events_{n}.json に保存し、スライドと音声が変わっていなければそれを使う。
+    """
+    name = slide_events_name(slide_idx)
+    unit = f"events_{slide_idx + 1}"
+    # ページ分割の結果は HtmlSlide ごとに保持されるので、最初の解析だけスレッドで済ませておく
+    await run_blocking(result_slide.split_pages)
+    events_hash = input_hash(
+        page=page_digest(result_slide, slide_idx + 1),
+        slide_idx=slide_idx,
+        audio=audio.input_hash,
+        page_transition_duration_sec=config.page_transition_duration_sec,
+        speaker_left_right_map=speaker_left_right_map,
+    )
+    if checkpoint.is_fresh(unit, events_hash, [name]):
+        data = await artifacts.adownload(name)
+        return EventList.model_validate_json(data.decode("utf-8"))
+
+    first_speaker = (
+        speaker_left_right_map[result_script.scripts[slide_idx].script[0].name]
+        if len(speaker_left_right_map) > 1
+        else None
+    )
+    ev = await event_extractor.ainvoke(
+        page_context(result_slide, slide_idx + 1),
+        slide_idx + 1,
+        await audio.ensure_file(artifacts),
+        first_speaker,
+    )
+    # スピーカーが一人のときは、発話区間を調整
+    if len(speaker_left_right_map) == 1:
+        ev = _modify_events_by_check_silence(ev, audio.analysis.nonsilent_ranges)
+    ev.events.append(
+        Event(type="slideNext", time_sec=audio.analysis.duration_sec + config.page_transition_duration_sec)
+    )
+    await artifacts.aupload(ev.model_dump_json(), name, "application/json")
+    await checkpoint.arecord(unit, events_hash, [name])
+    return ev
+
+
+def merge_slide_events(
+    config: MovieConfig,
+    audios: list[SlideAudio],
+    slide_events: list[EventList],
+    result_quiz: QuizSectionList,
+) -> EventList:
+    """
+    スライドごとの相対時刻のイベントを、音声の長さの累積で講義全体の時刻にずらして連結する。
+    """
+    ends = slide_page_event_sec(config, audios)
+    quiz_sections = {quiz_section.slide_no: quiz_section for quiz_section in result_quiz.quiz_sections}
+    events: list[Event] = []
+    for slide_idx, ev in enumerate(slide_events):
+        start_sec = float(ends[slide_idx - 1]) if slide_idx > 0 else 0.0
+        events.extend(e.model_copy(update={"time_sec": start_sec + e.time_sec}) for e in ev.events)
+        # クイズがあれば追加
+        if slide_idx in quiz_sections:
+            events.append(Event(type="quiz", time_sec=float(ends[slide_idx]), name=quiz_sections[slide_idx].name))
+    return EventList(events=events)
+
+
+async def save_events(artifacts: ArtifactIndex, events: EventList) -> EventList:
+    logger.info(f"Events: {events}")
+    await artifacts.aupload(events.model_dump_json(), "events.json", "application/json")
+    return events
+
+
+# 進捗の重み (合計 100)
+_SLIDE_WEIGHT = 25.0
+_SCRIPT_WEIGHT = 15.0
+_QUIZ_WEIGHT = 10.0
+_AUDIO_WEIGHT = 35.0
+_EVENT_WEIGHT = 15.0
+
+
+def create_lecture_nodes(
+    artifacts: ArtifactIndex,
+    checkpoint: Checkpoint,
+    config: MovieConfig,
+    temp_dir: str,
+    speaker_left_right_map: dict[str, str],
+    with_quiz: bool = True,
+) -> list[DagNode]:
+    """
+    講義生成の DAG。
+    slide -> script -> audio_{i} -> events_{i} -> events
+          -> quiz ---------------------------------^
+    スライドごとの処理の間に待ち合わせはなく、スライド i のイベント抽出は音声 i ができた時点で開始する。
+    講義全体の時刻への変換は最後の events でまとめて行う。
+    結果は "slide", "script", "quiz", "audio_{i}", "events" に入る。
+    入力が変わっていない作業単位は checkpoint (checkpoint.json) を見て再利用する。
+    """
+    # TTS とイベント抽出の同時実行数は、プロバイダごとの RateLimiter が講義をまたいで制御する
+    tts = create_tts_chain()
+    event_extractor = create_event_extractor_chain()
+
+    def _expand_slides(result_script: ScriptList) -> list[DagNode]:
+        num_slides = len(result_script.scripts)
+        nodes: list[DagNode] = []
+        for idx, script in enumerate(result_script.scripts):
+
+            # 依存ノードの結果 (script) はキーワード引数で渡されるので、対象のスクリプトは別名で束縛する
+            async def _audio(target: Script = script, **_) -> SlideAudio:
+                return await generate_slide_audio(artifacts, checkpoint, config, tts, target, temp_dir)
+
+            nodes.append(
+                DagNode(
+                    name=f"audio_{idx}",
+                    func=_audio,
+                    deps=["script"],
+                    weight=_AUDIO_WEIGHT / num_slides,
+                    label="音声生成中",
+                )
+            )
+
+        for idx in range(num_slides):
+
+            async def _events(idx: int = idx, **deps) -> EventList:
+                return await extract_slide_events(
+                    artifacts,
+                    checkpoint,
+                    config,
+                    event_extractor,
+                    deps["slide"],
+                    deps["script"],
+                    idx,
+                    deps[f"audio_{idx}"],
+                    speaker_left_right_map,
+                )
+
+            nodes.append(
+                DagNode(
+                    name=f"events_{idx}",
+                    func=_events,
+                    deps=["slide", "script", f"audio_{idx}"],
+                    weight=_EVENT_WEIGHT / num_slides,
+                    label="イベント作成中",
+                )
+            )
+
+        audio_names = [f"audio_{idx}" for idx in range(num_slides)]
+        event_names = [f"events_{idx}" for idx in range(num_slides)]
+
+        async def _merge(**deps) -> EventList:
+            events = merge_slide_events(
+                config,
+                [deps[name] for name in audio_names],
+                [deps[name] for name in event_names],
+                deps["quiz"],
+            )
+            return await save_events(artifacts, events)
+
+        nodes.append(
+            DagNode(
+                name="events",
+                func=_merge,
+                deps=["quiz", *audio_names, *event_names],
+                weight=0.0,
+                label="イベント作成中",
+            )
+        )
+        return nodes
+
+    async def _slide() -> HtmlSlide:
+        return await create_slide_phase(artifacts, checkpoint, config)
+
+    async def _script(slide: HtmlSlide) -> ScriptList:
+        return await create_script_phase(artifacts, checkpoint, config, slide)
+
+    async def _quiz(slide: HtmlSlide) -> QuizSectionList:
+        if not with_quiz:
+            return QuizSectionList(quiz_sections=[])
+        return await create_quiz_phase(artifacts, checkpoint, slide)
+
+    return [
+        DagNode(
+            name="slide",
+            func=_slide,
+            weight=_SLIDE_WEIGHT,
+            label="スライド生成中",
+        ),
+        DagNode(
+            name="script",
+            func=_script,
+            deps=["slide"],
+            weight=_SCRIPT_WEIGHT,
+            label="スクリプト作成中",
+            expand=_expand_slides,
+            expand_weight=_AUDIO_WEIGHT + _EVENT_WEIGHT,
+        ),
+        DagNode(
+            name="quiz",
+            func=_quiz,
+            deps=["slide"],
+            weight=_QUIZ_WEIGHT,
+            label="クイズ作成中",
+        ),
+    ]
+
+
+def collect_slide_audios(results: dict[str, Any]) -> list[SlideAudio]:
+    audios: list[SlideAudio] = []
+    while f"audio_{len(audios)}" in results:
+        audios.append(results[f"audio_{len(audios)}"])
+    return audios
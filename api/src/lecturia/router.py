@@ -1,4 +1,3 @@
-import base64
 import os
 import uuid
 from typing import Literal
@@ -22,14 +21,20 @@ from .lecture_repository import (
     to_task_status_response,
     upsert_lecture,
 )
-from .models import Manifest, MovieConfig
-from .storage import (
-    count_public_bucket,
-    delete_data_from_public_bucket,
-    download_data_from_public_bucket,
-    is_exists_in_public_bucket,
-    get_public_storage_url,
-)
+from .manifest import invalidate_manifest, load_manifest
+from .chains.slide_maker import HtmlSlide
+from .chains.slide_to_script import Script, ScriptLine, ScriptList
+from .models import LectureEdit, Manifest, MovieConfig
+from .storage import get_public_storage
+from .utils.async_tools import run_blocking
+
+
+class SlideEditRequest(BaseModel):
+    html: str
+
+
+class ScriptEditRequest(BaseModel):
+    script: list[ScriptLine]
 
 
 class LectureInfo(BaseModel):
@@ -58,7 +63,13 @@ async def list_lectures() -> list[LectureInfo]:
         created_at = lecture.created_at.strftime("%Y-%m-%d %H:%M:%S")
         progress = lecture.progress_percentage
         phase = lecture.current_phase
-        has_events = is_exists_in_public_bucket(f"lectures/{lecture_id}/events.json")
+        if lecture.status != "completed":
+            has_events = False
+        elif lecture.artifacts is not None:
+            has_events = "events.json" in lecture.artifacts
+        else:
+            # 成果物が未記録の古い講義のみバケットを確認する
+            has_events = await get_public_storage().aexists(f"lectures/{lecture_id}/events.json")
         if (lecture.status == "completed" and not has_events) \
             or lecture.status not in ("pending", "running", "completed", "failed"):
             logger.warning(f"Inconsistent lecture data: {lecture_id}")
@@ -76,32 +87,18 @@ async def list_lectures() -> list[LectureInfo]:
     return lecture_infos
 
 
-@router.get("/lectures/{lecture_id}/manifest")
-async def get_lecture_manifest(lecture_id: str) -> Manifest:
-    sprite_right_bytes = download_data_from_public_bucket(f"lectures/{lecture_id}/sprites/right.png")
-    sprite_left_bytes = download_data_from_public_bucket(f"lectures/{lecture_id}/sprites/left.png")
-    sprites: dict[str, str] = {}
-    if sprite_left_bytes:
-        sprites["left"] = f"data:image/png;base64,{base64.b64encode(sprite_left_bytes).decode('utf-8')}"
-    if sprite_right_bytes:
-        sprites["right"] = f"data:image/png;base64,{base64.b64encode(sprite_right_bytes).decode('utf-8')}"
-
-    audio_count = count_public_bucket(f"lectures/{lecture_id}/audio_")
-    return Manifest(
-        id=lecture_id,
-        title=str(lecture_id),  # 現状使用してないので、仮で入れておく
-        slide_url=f"/static/lectures/{lecture_id}/result_slide.html",
-        quiz_url=f"/static/lectures/{lecture_id}/result_quiz.json",
-        audio_urls=[
-            get_public_storage_url(f"lectures/{lecture_id}/audio_{i + 1}.mp3")  # リダイレクトでOriginがnullになるので、storage.googleapis.com を直接指定
-            for i in range(audio_count)
-        ],
-        quiz_sfx_url=get_public_storage_url(f"lectures/{lecture_id}/quiz.mp3"),
-        events_url=f"/static/lectures/{lecture_id}/events.json",
-        sprites=sprites,
-        slide_width=1280,
-        slide_height=720,
-    )
+@router.get("/lectures/{lecture_id}/manifest", response_model=Manifest)
+async def get_lecture_manifest(
+    lecture_id: str,
+    if_none_match: str | None = fastapi.Header(default=None, alias="If-None-Match"),
+) -> fastapi.Response:
+    manifest = await load_manifest(lecture_id)
+    if manifest is None:
+        raise fastapi.HTTPException(status_code=404, detail="Lecture not found")
+    headers = {"ETag": manifest.etag, "Cache-Control": "no-cache"}
+    if if_none_match and manifest.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return fastapi.Response(status_code=304, headers=headers)
+    return fastapi.Response(content=manifest.body, media_type="application/json", headers=headers)
 
 
 @router.get("/tasks/{task_id}/status")
@@ -113,7 +110,7 @@ async def get_task_status(task_id: str) -> TaskStatusResponse:
     return to_task_status_response(lecture)
 
 
-async def _create_lecture_task(lecture_id: str, config: MovieConfig) -> dict[str, str]:
+async def _enqueue_worker_task(path: str, lecture_id: str, body: BaseModel) -> dict[str, str]:
     if os.getenv("LECTURIA_WORKER_URL") and os.getenv("LECTURIA_WORKER_URL") not in ["http://localhost:8001", "http://worker:8001"]:
         client = tasks_v2.CloudTasksClient()
     else:
@@ -125,9 +122,9 @@ async def _create_lecture_task(lecture_id: str, config: MovieConfig) -> dict[str
     task = tasks_v2.Task(
         http_request=tasks_v2.HttpRequest(
             http_method=tasks_v2.HttpMethod.POST,
-            url=f"{os.environ['LECTURIA_WORKER_URL']}/tasks/create-lecture?lecture_id={lecture_id}",
+            url=f"{os.environ['LECTURIA_WORKER_URL']}{path}?lecture_id={lecture_id}",
             headers={"Content-Type": "application/json"},
-            body=config.model_dump_json().encode(),
+            body=body.model_dump_json().encode(),
         )
     )
     # dispatch_deadline を 15 分（900 秒）に設定
@@ -136,6 +133,10 @@ async def _create_lecture_task(lecture_id: str, config: MovieConfig) -> dict[str
     return {"task_id": lecture_id}
 
 
+async def _create_lecture_task(lecture_id: str, config: MovieConfig) -> dict[str, str]:
+    return await _enqueue_worker_task("/tasks/create-lecture", lecture_id, config)
+
+
 @router.post("/create-lecture")
 async def create_lecture(config: MovieConfig = Body(...)):
     logger.info(f"Creating lecture: {config}")
@@ -201,9 +202,92 @@ async def regenerate_lecture(lecture_id: str):
         raise
 
 
+def _count_pages(html: str) -> int:
+    return HtmlSlide(html=html).split_pages().num_pages
+
+
+async def _check_edit(lecture_id: str, edit: LectureEdit) -> None:
+    """
+    編集するページが保存済みの台本とスライドにあるか、差し替えるページが1ページ分かを確認する。
+    ワーカーで弾かれる編集はリトライしても成功しないので、キューに入れる前に返す。
+    """
+    if edit.slide_html is not None and await run_blocking(_count_pages, edit.slide_html) != 1:
+        raise fastapi.HTTPException(status_code=422, detail='html must contain exactly one element with class="slide"')
+
+    backend = get_public_storage()
+    data = await backend.adownload(f"lectures/{lecture_id}/result_script.json")
+    if data is None:
+        raise fastapi.HTTPException(status_code=409, detail="Lecture script is not generated yet")
+    result_script = ScriptList.model_validate_json(data.decode("utf-8"))
+    if not any(script.slide_no == edit.slide_no for script in result_script.scripts):
+        raise fastapi.HTTPException(status_code=404, detail="Slide not found")
+
+    if edit.slide_html is not None:
+        data = await backend.adownload(f"lectures/{lecture_id}/result_slide.html")
+        if data is None:
+            raise fastapi.HTTPException(status_code=409, detail="Lecture slide is not generated yet")
+        if not 1 <= edit.slide_no <= await run_blocking(_count_pages, data.decode("utf-8")):
+            raise fastapi.HTTPException(status_code=404, detail="Slide not found")
+
+
+async def _edit_lecture(lecture_id: str, edit: LectureEdit) -> dict[str, str]:
+    """
+    編集内容をワーカーに渡す。変更のあったページの台本・音声・イベントだけが作り直される。
+    """
+    with session_scope() as session:
+        lecture = get_lecture(session, lecture_id)
+        if lecture is None or lecture.deleted_at is not None:
+            raise fastapi.HTTPException(status_code=404, detail="Task not found")
+        if lecture.status in ("pending", "running"):
+            raise fastapi.HTTPException(status_code=409, detail="Lecture is already running")
+    await _check_edit(lecture_id, edit)
+    with session_scope() as session:
+        upsert_lecture(
+            session,
+            lecture_id,
+            "pending",
+            error=None,
+            progress_percentage=0,
+            current_phase="編集待ち",
+        )
+    invalidate_manifest(lecture_id)
+    try:
+        return await _enqueue_worker_task("/tasks/update-lecture", lecture_id, edit)
+    except Exception as exc:
+        with session_scope() as session:
+            upsert_lecture(
+                session,
+                lecture_id,
+                "failed",
+                error=str(exc),
+                current_phase="キュー投入エラー",
+            )
+        raise
+
+
+@router.patch("/lectures/{lecture_id}/slides/{slide_no}")
+async def edit_lecture_slide(lecture_id: str, slide_no: int, request: SlideEditRequest = Body(...)):
+    """
+    スライドの1ページを差し替える。台本はそのページの分だけ作り直す。
+    """
+    logger.info(f"Editing slide {slide_no} of lecture: {lecture_id}")
+    return await _edit_lecture(lecture_id, LectureEdit(slide_no=slide_no, slide_html=request.html))
+
+
+@router.patch("/lectures/{lecture_id}/scripts/{slide_no}")
+async def edit_lecture_script(lecture_id: str, slide_no: int, request: ScriptEditRequest = Body(...)):
+    """
+    1ページ分の台本を差し替える。音声とイベントはそのページの分だけ作り直す。
+    """
+    logger.info(f"Editing script {slide_no} of lecture: {lecture_id}")
+    script = Script(slide_no=slide_no, script=request.script)
+    return await _edit_lecture(lecture_id, LectureEdit(slide_no=slide_no, script=script))
+
+
 @router.delete("/lectures/{lecture_id}")
 async def delete_lecture(lecture_id: str):
-    delete_data_from_public_bucket(f"lectures/{lecture_id}")
+    await get_public_storage().adelete_prefix(f"lectures/{lecture_id}/")
+    invalidate_manifest(lecture_id)
     with session_scope() as session:
         mark_lecture_deleted(session, lecture_id)
     return {"message": "Lecture deleted"}
@@ -1,13 +1,16 @@
 import os
 import urllib.parse
 
-from fastapi import FastAPI, Path, status
+from fastapi import FastAPI, Header, HTTPException, Path, Query, status
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 
 from .database import init_db
+from .manifest import versioned_url
 from .router import router
+from .static_proxy import DEFAULT_CACHE_CONTROL, IMMUTABLE_CACHE_CONTROL, is_static_proxy_enabled, stream_object
+from .storage import get_public_storage
 
 app = FastAPI()
 
@@ -33,11 +36,6 @@ app.include_router(router, prefix="/api")
 def on_startup() -> None:
     init_db()
 
-if os.getenv("STORAGE_EMULATOR_HOST"):
-    BASE_URL = f"http://localhost:4443/storage/v1/b/{os.getenv('GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME')}/o"
-else:
-    BASE_URL = f"https://storage.googleapis.com/{os.getenv('GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME')}"
-
 
 @app.get("/")
 async def root():
@@ -50,11 +48,26 @@ async def health():
 
 
 @app.get("/static/{full_path:path}")
-async def static_redirect(full_path: str = Path(..., description="ex. css/app.css")):
+async def static_redirect(
+    full_path: str = Path(..., description="ex. css/app.css"),
+    range_header: str | None = Header(default=None, alias="Range"),
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+    version: str | None = Query(default=None, alias="v", description="マニフェストが付ける成果物のバージョン"),
+):
     # パス traversal 対策
     safe_path = urllib.parse.quote(full_path.lstrip("/"), safe=":/~!@$&()*+,;=")
-    url = f"{BASE_URL}/{safe_path}"
-    if os.getenv("STORAGE_EMULATOR_HOST"):
-        url += "?alt=media"
-    logger.info(f"Redirecting to {url}")
-    return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    backend = get_public_storage()
+    if not is_static_proxy_enabled(backend):
+        # ブラウザのキャッシュをバージョンごとに分けるため、リダイレクト先にも付ける
+        url = versioned_url(backend.url(safe_path), version)
+        logger.info(f"Redirecting to {url}")
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+    path = full_path.lstrip("/")
+    if ".." in path.split("/"):
+        raise HTTPException(status_code=404, detail="Not found")
+    # 内容ハッシュ名のスプライトと、バージョン付きの講義の成果物は変わらないので長期キャッシュさせる
+    # 講義の成果物はページ単位で作り直すことがあるので、バージョンなしの場合は短いキャッシュにする
+    immutable = path.startswith("sprites/") or (path.startswith("lectures/") and version is not None)
+    cache_control = IMMUTABLE_CACHE_CONTROL if immutable else DEFAULT_CACHE_CONTROL
+    return await stream_object(backend, path, range_header, if_none_match, cache_control)
@@ -0,0 +1,111 @@
+import os
+import re
+from collections.abc import AsyncIterator
+
+from fastapi import HTTPException, status
+from fastapi.responses import Response, StreamingResponse
+
+from .storage import GCSStorage, StorageBackend
+
+
+CHUNK_SIZE = 1024 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=60"
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Range ヘッダを [start, end) に変換する。
+    Range がない、または複数範囲など扱えない形式の場合は None (全体を返す)。
+    範囲が満たせない場合は 416 を送出する。
+    """
+    if not range_header:
+        return None
+    match = _RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-500 は末尾 500 バイト
+        start = max(size - int(last), 0)
+        end = size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def _iter_chunks(backend: StorageBackend, path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    # オブジェクトのサイズによらず、保持するのは常に1チャンク分だけ
+    offset = start
+    while offset < end:
+        chunk_end = min(offset + CHUNK_SIZE, end)
+        yield await backend.aread_range(path, offset, chunk_end)
+        offset = chunk_end
+
+
+async def stream_object(
+    backend: StorageBackend,
+    path: str,
+    range_header: str | None = None,
+    if_none_match: str | None = None,
+    cache_control: str = DEFAULT_CACHE_CONTROL,
+) -> Response:
+    """
+    ストレージのオブジェクトをチャンク単位でストリーミングして返す。
+    Range (単一範囲) と If-None-Match に対応する。
+    """
+    info = await backend.astat(path)
+    if info is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": info.etag,
+        "Cache-Control": cache_control,
+    }
+    if _etag_matches(if_none_match, info.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = parse_range(range_header, info.size)
+    if byte_range is None:
+        start, end = 0, info.size
+        status_code = status.HTTP_200_OK
+    else:
+        start, end = byte_range
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{info.size}"
+    headers["Content-Length"] = str(end - start)
+
+    return StreamingResponse(
+        _iter_chunks(backend, path, start, end),
+        status_code=status_code,
+        media_type=info.content_type,
+        headers=headers,
+    )
+
+
+def is_static_proxy_enabled(backend: StorageBackend) -> bool:
+    """
+    /static をストレージへのリダイレクトではなく API からの配信にするかどうか。
+    LECTURIA_STATIC_PROXY が有効な場合と、外部URLを持たないストレージの場合に配信する。
+    """
+    if os.getenv("LECTURIA_STATIC_PROXY", "").lower() in ("1", "true", "yes"):
+        return True
+    return not isinstance(backend, GCSStorage)
@@ -1,10 +1,32 @@
+import asyncio
+import hashlib
+import mimetypes
+import mmap
 import os
+import tempfile
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Protocol, TypeVar
 
+import google.auth
+import requests
+from google.api_core.exceptions import NotFound
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
 from loguru import logger
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
 
 
-_GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME = os.environ["GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME"]
+_DEFAULT_POOL_SIZE = 32
+
+_STORAGES: dict[str, "GCSStorage"] = {}
+_STORAGES_LOCK = threading.Lock()
+_PUBLIC_STORAGE: "StorageBackend | None" = None
+
+_T = TypeVar("_T")
 
 
 def get_storage_url(bucket_name: str, path: str) -> str:
@@ -15,7 +37,398 @@ def get_storage_url(bucket_name: str, path: str) -> str:
 
 
 def get_public_storage_url(path: str) -> str:
-    return get_storage_url(_GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME, path)
+    return get_public_storage().url(path)
+
+
+class ObjectInfo(BaseModel):
+    size: int
+    etag: str
+    content_type: str
+
+
+def _guess_content_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+class StorageBackend(Protocol):
+    """
+    成果物の保存先。パスは "lectures/<lecture_id>/events.json" のような "/" 区切りの相対パス。
+    a から始まるメソッドはイベントループをブロックしない。
+    """
+
+    def url(self, path: str) -> str: ...
+
+    def upload(self, data: bytes | str, path: str, mime_type: str = "application/octet-stream") -> str: ...
+
+    def exists(self, path: str) -> bool: ...
+
+    def download(self, path: str) -> bytes | None: ...
+
+    def list_paths(self, prefix: str = "") -> list[str]: ...
+
+    def count(self, prefix: str = "") -> int: ...
+
+    def delete_prefix(self, prefix: str) -> None: ...
+
+    def stat(self, path: str) -> ObjectInfo | None: ...
+
+    def read_range(self, path: str, start: int, end: int) -> bytes: ...
+
+    async def aupload(self, data: bytes | str, path: str, mime_type: str = "application/octet-stream") -> str: ...
+
+    async def aexists(self, path: str) -> bool: ...
+
+    async def adownload(self, path: str) -> bytes | None: ...
+
+    async def alist(self, prefix: str = "") -> list[str]: ...
+
+    async def adelete_prefix(self, prefix: str) -> None: ...
+
+    async def astat(self, path: str) -> ObjectInfo | None: ...
+
+    async def aread_range(self, path: str, start: int, end: int) -> bytes: ...
+
+
+class _ExecutorStorage:
+    """
+    同期APIをスレッドプールで実行して非同期APIを提供する基底クラス。
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    def count(self, prefix: str = "") -> int:
+        return len(self.list_paths(prefix))
+
+    async def _run(self, fn: Callable[..., _T], *args) -> _T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def aupload(self, data: bytes | str, path: str, mime_type: str = "application/octet-stream") -> str:
+        return await self._run(self.upload, data, path, mime_type)
+
+    async def aexists(self, path: str) -> bool:
+        return await self._run(self.exists, path)
+
+    async def adownload(self, path: str) -> bytes | None:
+        return await self._run(self.download, path)
+
+    async def alist(self, prefix: str = "") -> list[str]:
+        return await self._run(self.list_paths, prefix)
+
+    async def adelete_prefix(self, prefix: str) -> None:
+        await self._run(self.delete_prefix, prefix)
+
+    async def astat(self, path: str) -> ObjectInfo | None:
+        return await self._run(self.stat, path)
+
+    async def aread_range(self, path: str, start: int, end: int) -> bytes:
+        return await self._run(self.read_range, path, start, end)
+
+
+class GCSStorage(_ExecutorStorage):
+    """
+    バケット単位のストレージ。
+    storage.Client (認証情報・HTTPセッション) をプロセス内で1つだけ保持し、
+    コネクションプールを使い回すことで呼び出しごとの認証・TLSハンドシェイクを省く。
+    非同期APIはプールと同じサイズのスレッドプールで実行される。
+
+    Args:
+        bucket_name: バケット名
+        pool_size: HTTPコネクションプールのサイズ
+    """
+
+    def __init__(self, bucket_name: str, pool_size: int = _DEFAULT_POOL_SIZE):
+        super().__init__(pool_size, f"gcs-{bucket_name}")
+        self.bucket_name = bucket_name
+        self.pool_size = pool_size
+        self.client = storage.Client(_http=self._create_session(pool_size))
+        self.bucket = self.client.bucket(bucket_name)
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """コネクションプールのサイズを指定した HTTP セッション。エミュレータでは認証しない"""
+        if "STORAGE_EMULATOR_HOST" in os.environ:
+            session = requests.Session()
+        else:
+            credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+            session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def url(self, path: str) -> str:
+        return get_storage_url(self.bucket_name, path)
+
+    def upload(self, data: bytes | str, path: str, mime_type: str = "application/octet-stream") -> str:
+        blob = self.bucket.blob(path)
+        blob.upload_from_string(data, content_type=mime_type)
+        return self.url(path)
+
+    def exists(self, path: str) -> bool:
+        return self.bucket.blob(path).exists()
+
+    def download(self, path: str) -> bytes | None:
+        try:
+            return self.bucket.blob(path).download_as_bytes()
+        except NotFound:
+            return None
+        except Exception as e:
+            logger.error(f"Error downloading data from bucket {self.bucket_name}: {e}")
+            return None
+
+    def list_paths(self, prefix: str = "") -> list[str]:
+        return [blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix)]
+
+    def count(self, prefix: str = "") -> int:
+        return sum(1 for _ in self.client.list_blobs(self.bucket, prefix=prefix))
+
+    def delete_prefix(self, prefix: str) -> None:
+        blobs_iter = self.client.list_blobs(self.bucket, prefix=prefix)
+
+        batch = []
+        for blob in blobs_iter:
+            batch.append(blob)
+            if len(batch) == 100:
+                self.bucket.delete_blobs(batch)
+                batch.clear()
+
+        if batch:
+            self.bucket.delete_blobs(batch)
+
+    def stat(self, path: str) -> ObjectInfo | None:
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            return None
+        return ObjectInfo(
+            size=blob.size,
+            etag=f'"{blob.etag}"' if not blob.etag.startswith('"') else blob.etag,
+            content_type=blob.content_type or _guess_content_type(path),
+        )
+
+    def read_range(self, path: str, start: int, end: int) -> bytes:
+        # GCS の end は終端を含む
+        return self.bucket.blob(path).download_as_bytes(start=start, end=end - 1)
+
+
+class LocalStorage(_ExecutorStorage):
+    """
+    ローカルディスク上のディレクトリをストレージとして扱う。
+    書き込みは一時ファイルに書いてから rename するので、途中で落ちても壊れたファイルが残らない。
+    読み込みは mmap で行う。
+
+    Args:
+        root: ルートディレクトリ
+        base_url: url() で返すURLの接頭辞
+        max_workers: 非同期APIで使うスレッド数
+    """
+
+    def __init__(self, root: Path | str, base_url: str = "/static", max_workers: int = 8):
+        super().__init__(max_workers, "local-storage")
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url.rstrip("/")
+
+    def _file(self, path: str) -> Path:
+        file = (self.root / path).resolve()
+        if not file.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Invalid path: {path}")
+        return file
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path}"
+
+    def local_file(self, path: str) -> Path:
+        """path のローカルファイルのパス。コピーせずに直接読みたいときに使う"""
+        return self._file(path)
+
+    def upload(self, data: bytes | str, path: str, mime_type: str = "application/octet-stream") -> str:
+        file = self._file(path)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        fd, tmp_name = tempfile.mkstemp(dir=file.parent, prefix=f".{file.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, file)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        return self.url(path)
+
+    def exists(self, path: str) -> bool:
+        return self._file(path).is_file()
+
+    def download(self, path: str) -> bytes | None:
+        file = self._file(path)
+        try:
+            with open(file, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mm[:]
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.error(f"Error downloading data from {self.root}: {e}")
+            return None
+
+    def list_paths(self, prefix: str = "") -> list[str]:
+        # prefix の最後の "/" までのディレクトリだけを辿る
+        root = self.root.resolve()
+        directory = self._file(prefix.rpartition("/")[0]) if "/" in prefix else root
+        if not directory.is_dir():
+            return []
+        paths = []
+        for file in directory.rglob("*"):
+            if not file.is_file() or file.name.endswith(".tmp"):
+                continue
+            name = file.relative_to(root).as_posix()
+            if name.startswith(prefix):
+                paths.append(name)
+        return sorted(paths)
+
+    def delete_prefix(self, prefix: str) -> None:
+        for name in self.list_paths(prefix):
+            self._file(name).unlink(missing_ok=True)
+
+    def stat(self, path: str) -> ObjectInfo | None:
+        file = self._file(path)
+        if not file.is_file():
+            return None
+        st = file.stat()
+        return ObjectInfo(
+            size=st.st_size,
+            etag=f'"{st.st_mtime_ns:x}-{st.st_size:x}"',
+            content_type=_guess_content_type(path),
+        )
+
+    def read_range(self, path: str, start: int, end: int) -> bytes:
+        with open(self._file(path), "rb") as f:
+            if start >= end:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[start:end]
+
+
+class MemoryStorage(_ExecutorStorage):
+    """
+    プロセス内のメモリに保存するストレージ。ネットワークなしでベンチマークを行う場合などに使う。
+    """
+
+    def __init__(self, base_url: str = "/static"):
+        super().__init__(1, "memory-storage")
+        self.base_url = base_url.rstrip("/")
+        self.objects: dict[str, tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+
+    async def _run(self, fn: Callable[..., _T], *args) -> _T:
+        return fn(*args)
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path}"
+
+    def upload(self, data: bytes | str, path: str, mime_type: str = "application/octet-stream") -> str:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._lock:
+            self.objects[path] = (data, mime_type)
+        return self.url(path)
+
+    def exists(self, path: str) -> bool:
+        return path in self.objects
+
+    def download(self, path: str) -> bytes | None:
+        obj = self.objects.get(path)
+        return obj[0] if obj is not None else None
+
+    def list_paths(self, prefix: str = "") -> list[str]:
+        with self._lock:
+            return sorted(name for name in self.objects if name.startswith(prefix))
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for name in [name for name in self.objects if name.startswith(prefix)]:
+                del self.objects[name]
+
+    def stat(self, path: str) -> ObjectInfo | None:
+        obj = self.objects.get(path)
+        if obj is None:
+            return None
+        data, mime_type = obj
+        return ObjectInfo(size=len(data), etag=f'"{hashlib.md5(data).hexdigest()}"', content_type=mime_type)
+
+    def read_range(self, path: str, start: int, end: int) -> bytes:
+        return self.objects[path][0][start:end]
+
+
+def get_storage(bucket_name: str) -> GCSStorage:
+    """
+    バケットごとに1つの GCSStorage を返す。
+    プールサイズは GOOGLE_CLOUD_STORAGE_POOL_SIZE で変更できる。
+    """
+    gcs = _STORAGES.get(bucket_name)
+    if gcs is not None:
+        return gcs
+    with _STORAGES_LOCK:
+        if bucket_name not in _STORAGES:
+            pool_size = int(os.getenv("GOOGLE_CLOUD_STORAGE_POOL_SIZE") or _DEFAULT_POOL_SIZE)
+            _STORAGES[bucket_name] = GCSStorage(bucket_name, pool_size=pool_size)
+        return _STORAGES[bucket_name]
+
+
+def create_storage_backend(kind: str | None = None) -> StorageBackend:
+    """
+    設定に従ってストレージを作成する。
+
+    LECTURIA_STORAGE_BACKEND:
+        gcs: GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME のバケット (デフォルト)
+        local: LECTURIA_STORAGE_ROOT のディレクトリ
+        memory: プロセス内のメモリ
+    """
+    kind = kind or os.getenv("LECTURIA_STORAGE_BACKEND", "gcs")
+    if kind == "gcs":
+        return get_storage(os.environ["GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME"])
+    if kind == "local":
+        return LocalStorage(os.getenv("LECTURIA_STORAGE_ROOT", "lecturia-public-storage"))
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Invalid storage backend: {kind}")
+
+
+def create_cache_storage_backend(kind: str | None = None) -> StorageBackend:
+    """
+    キャッシュ (LLM のレスポンス・TTS の音声) の保存先を作成する。
+    公開バケットは誰でも読めて /static からも配信されるので、キャッシュは公開ストレージとは別の場所に置く。
+
+    LECTURIA_STORAGE_BACKEND:
+        gcs: GOOGLE_CLOUD_STORAGE_CACHE_BUCKET_NAME の非公開バケット
+        local: LECTURIA_CACHE_STORAGE_ROOT のディレクトリ (デフォルト .cache/storage)
+        memory: プロセス内のメモリ
+    """
+    kind = kind or os.getenv("LECTURIA_STORAGE_BACKEND", "gcs")
+    if kind == "gcs":
+        return get_storage(os.environ["GOOGLE_CLOUD_STORAGE_CACHE_BUCKET_NAME"])
+    if kind == "local":
+        return LocalStorage(os.getenv("LECTURIA_CACHE_STORAGE_ROOT", ".cache/storage"))
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Invalid storage backend: {kind}")
+
+
+def get_public_storage() -> StorageBackend:
+    global _PUBLIC_STORAGE
+    if _PUBLIC_STORAGE is None:
+        with _STORAGES_LOCK:
+            if _PUBLIC_STORAGE is None:
+                _PUBLIC_STORAGE = create_storage_backend()
+    return _PUBLIC_STORAGE
+
+
+def set_public_storage(backend: StorageBackend) -> None:
+    global _PUBLIC_STORAGE
+    _PUBLIC_STORAGE = backend
 
 
 def upload_data(
@@ -24,11 +437,7 @@ def upload_data(
     bucket_name: str,
     mime_type: str = "application/octet-stream",
 ) -> str:
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(path)
-    blob.upload_from_string(data, content_type=mime_type)
-    return get_storage_url(bucket_name, path)
+    return get_storage(bucket_name).upload(data, path, mime_type)
 
 
 def upload_data_to_public_bucket(
@@ -36,59 +445,81 @@ def upload_data_to_public_bucket(
     path: str,
     mime_type: str = "application/octet-stream",
 ) -> str:
-    return upload_data(data, path, _GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME, mime_type)
+    return get_public_storage().upload(data, path, mime_type)
 
 
 def is_exists_in_public_bucket(path: str) -> bool:
-    client = storage.Client()
-    bucket = client.bucket(_GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME)
-    blob = bucket.blob(path)
-    return blob.exists()
+    return get_public_storage().exists(path)
 
 
 def ls_public_bucket(prefix: str = "") -> list[str]:
-    client = storage.Client()
-    blobs = client.list_blobs(_GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME, prefix=prefix)
     directories = set()
-    for blob in blobs:
-        dirs = blob.name.split("/")
+    for name in get_public_storage().list_paths(prefix):
+        dirs = name.split("/")
         if dirs[0] == prefix and len(dirs[1:]) > 1:
             directories.add(dirs[1])
     return list(directories)
 
 
 def count_public_bucket(prefix: str = "") -> int:
-    client = storage.Client()
-    blobs = client.list_blobs(_GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME, prefix=prefix)
-    return sum(1 for _ in blobs)
+    return get_public_storage().count(prefix)
 
 
 def download_data_from_public_bucket(path: str) -> bytes | None:
-    try:
-        client = storage.Client()
-        bucket = client.bucket(_GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME)
-        blob = bucket.blob(path)
-        return blob.download_as_bytes()
-    except Exception as e:
-        logger.error(f"Error downloading data from public bucket: {e}")
-        return None
+    return get_public_storage().download(path)
 
 
 def delete_data_from_public_bucket(path: str):
-    client = storage.Client()
-    bucket = client.bucket(_GOOGLE_CLOUD_STORAGE_PUBLIC_BUCKET_NAME)
-
     if not path.endswith("/"):
         path += "/"
+    get_public_storage().delete_prefix(path)
+
+
+class ArtifactIndex:
+    """
+    講義ディレクトリ (prefix) 以下のオブジェクト一覧を1回のプレフィックス一覧取得で保持し、
+    成果物の存在確認を集合の参照だけで済ませる。
+    このインデックス経由でアップロードしたものは一覧にも反映される。
+
+    Args:
+        backend: 対象のストレージ
+        prefix: 講義ディレクトリのパス (ex. "lectures/<lecture_id>")。空文字ならストレージのルート
+    """
+
+    def __init__(self, backend: StorageBackend, prefix: str = ""):
+        self.backend = backend
+        self.prefix = prefix.rstrip("/") + "/" if prefix else ""
+        self.names: set[str] = {name[len(self.prefix):] for name in backend.list_paths(self.prefix)}
+
+    def path(self, name: str) -> str:
+        return self.prefix + name
+
+    def url(self, name: str) -> str:
+        return self.backend.url(self.path(name))
+
+    def exists(self, name: str) -> bool:
+        return name in self.names
+
+    def download(self, name: str) -> bytes | None:
+        if name not in self.names:
+            return None
+        return self.backend.download(self.path(name))
+
+    def upload(self, data: bytes | str, name: str, mime_type: str = "application/octet-stream") -> str:
+        url = self.backend.upload(data, self.path(name), mime_type)
+        self.names.add(name)
+        return url
+
+    async def adownload(self, name: str) -> bytes | None:
+        if name not in self.names:
+            return None
+        return await self.backend.adownload(self.path(name))
 
-    blobs_iter = client.list_blobs(bucket, prefix=path)
+    async def aupload(self, data: bytes | str, name: str, mime_type: str = "application/octet-stream") -> str:
+        url = await self.backend.aupload(data, self.path(name), mime_type)
+        self.names.add(name)
+        return url
 
-    batch = []
-    for blob in blobs_iter:
-        batch.append(blob)
-        if len(batch) == 100:
-            bucket.delete_blobs(batch)
-            batch.clear()
 
-    if batch:
-        bucket.delete_blobs(batch)
+def get_lecture_artifact_index(lecture_id: str) -> ArtifactIndex:
+    return ArtifactIndex(get_public_storage(), f"lectures/{lecture_id}")
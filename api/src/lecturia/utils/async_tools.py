@@ -1,10 +1,44 @@
 import asyncio
-from collections.abc import Awaitable, Iterable
+import contextvars
+import functools
+import os
+import threading
+from collections.abc import Awaitable, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from typing import TypeVar
 
 
 _T = TypeVar("_T")
 
+_BLOCKING_EXECUTOR: ThreadPoolExecutor | None = None
+_BLOCKING_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    """
+    ブロッキングする処理 (同期 SDK の呼び出し・DB・html の解析など) を実行する、プロセス共有のスレッドプール。
+    スレッド数は LECTURIA_BLOCKING_WORKERS (デフォルト 32)。
+    """
+    global _BLOCKING_EXECUTOR
+    if _BLOCKING_EXECUTOR is None:
+        with _BLOCKING_EXECUTOR_LOCK:
+            if _BLOCKING_EXECUTOR is None:
+                _BLOCKING_EXECUTOR = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("LECTURIA_BLOCKING_WORKERS") or 32),
+                    thread_name_prefix="lecturia-blocking",
+                )
+    return _BLOCKING_EXECUTOR
+
+
+async def run_blocking(func: Callable[..., _T], *args, **kwargs) -> _T:
+    """
+    func をイベントループの外 (get_blocking_executor のスレッド) で実行する。
+    asyncio.to_thread と同じくコンテキスト変数を引き継ぐ。
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(get_blocking_executor(), functools.partial(ctx.run, func, *args, **kwargs))
+
 
 async def gather_limited(
     coroutines: Iterable[Awaitable[_T]],
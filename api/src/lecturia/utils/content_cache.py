@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Protocol
+
+from loguru import logger
+
+from ..storage import StorageBackend, create_cache_storage_backend
+
+
+class CacheStore(Protocol):
+    def get(self, key: str) -> bytes | None: ...
+
+    def put(self, key: str, value: bytes) -> None: ...
+
+    def delete(self, key: str) -> None: ...
+
+    def clear(self) -> None: ...
+
+
+class SQLiteCacheStore:
+    """
+    SQLite ファイルに保存するキャッシュ。開発用。
+    TTL を過ぎたものは読み込み時に削除し、合計サイズが max_bytes を超えたら最終アクセスが古いものから削除する。
+
+    Args:
+        path: SQLite ファイルのパス
+        ttl_sec: 有効期限 (秒)。None なら無期限
+        max_bytes: 保存する値の合計サイズの上限。None なら無制限
+    """
+
+    def __init__(self, path: Path | str, ttl_sec: float | None = None, max_bytes: int | None = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def get(self, key: str) -> bytes | None:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_sec is not None and now - created_at > self.ttl_sec:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.ttl_sec is not None:
+            self._conn.execute("DELETE FROM cache WHERE created_at < ?", (time.time() - self.ttl_sec,))
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+
+
+_HEADER = struct.Struct(">d")
+
+
+class StorageCacheStore:
+    """
+    StorageBackend (本番ではバケット) に保存するキャッシュ。
+    値の先頭に保存時刻を付けて保存し、TTL を過ぎたものは読み込み時に削除する。
+    max_bytes を指定した場合は prune_interval 回の書き込みごとに合計サイズを確認し、古いものから削除する。
+    容量の確認はエントリごとにストレージへアクセスするので、書き込みを待たせないように別スレッドで行う。
+
+    Args:
+        backend: 保存先のストレージ
+        prefix: 保存先のディレクトリ (ex. "cache/llm")
+        ttl_sec: 有効期限 (秒)。None なら無期限
+        max_bytes: 保存する値の合計サイズの上限。None なら無制限
+        prune_interval: 容量確認を行う書き込み回数の間隔
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        prefix: str,
+        ttl_sec: float | None = None,
+        max_bytes: int | None = None,
+        prune_interval: int = 100,
+    ):
+        self.backend = backend
+        self.prefix = prefix.rstrip("/") + "/"
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self.prune_interval = prune_interval
+        self._num_puts = 0
+        self._prune_lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def get(self, key: str) -> bytes | None:
+        # 存在確認はせず1回のダウンロードで済ませる。無ければ None が返る
+        data = self.backend.download(self._path(key))
+        if data is None or len(data) < _HEADER.size:
+            return None
+        (created_at,) = _HEADER.unpack_from(data)
+        if self.ttl_sec is not None and time.time() - created_at > self.ttl_sec:
+            self.delete(key)
+            return None
+        return data[_HEADER.size:]
+
+    def put(self, key: str, value: bytes) -> None:
+        self.backend.upload(_HEADER.pack(time.time()) + value, self._path(key))
+        self._num_puts += 1
+        if self.max_bytes is not None and self._num_puts % self.prune_interval == 0:
+            self._schedule_prune()
+
+    def _schedule_prune(self) -> None:
+        # 前回の容量確認が終わっていなければ重ねて実行しない
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._prune_in_background, name="lecturia-cache-prune", daemon=True).start()
+
+    def _prune_in_background(self) -> None:
+        try:
+            self.prune()
+        except Exception as e:
+            logger.warning(f"cache prune failed ({self.prefix}): {e}")
+        finally:
+            self._prune_lock.release()
+
+    def prune(self) -> None:
+        """期限切れのものを削除し、合計サイズが max_bytes 以下になるまで古いものから削除する"""
+        entries: list[tuple[float, int, str]] = []
+        for path in self.backend.list_paths(self.prefix):
+            head = self.backend.read_range(path, 0, _HEADER.size)
+            info = self.backend.stat(path)
+            if info is None or len(head) < _HEADER.size:
+                continue
+            entries.append((_HEADER.unpack(head)[0], info.size, path))
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for created_at, size, path in sorted(entries):
+            expired = self.ttl_sec is not None and now - created_at > self.ttl_sec
+            over = self.max_bytes is not None and total > self.max_bytes
+            if not expired and not over:
+                break
+            self.backend.delete_prefix(path)
+            total -= size
+
+    def delete(self, key: str) -> None:
+        self.backend.delete_prefix(self._path(key))
+
+    def clear(self) -> None:
+        self.backend.delete_prefix(self.prefix)
+
+
+def content_key(**parts: Any) -> str:
+    """
+    キャッシュキーを内容のハッシュとして作る。値は JSON にできるものを渡す。
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def digest_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ContentCache:
+    """
+    内容のハッシュをキーにしたキャッシュ。ヒット・ミスの回数を記録する。
+
+    Args:
+        store: 保存先
+        name: メトリクスやログに出す名前
+    """
+
+    def __init__(self, store: CacheStore, name: str):
+        self.store = store
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            value = self.store.get(key)
+        except Exception as e:
+            # キャッシュが壊れていても本処理は止めない
+            logger.warning(f"[{self.name}] cache read failed: {e}")
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            logger.debug(f"[{self.name}] cache hit: {key}")
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        try:
+            self.store.put(key, value)
+            self.writes += 1
+        except Exception as e:
+            logger.warning(f"[{self.name}] cache write failed: {e}")
+            self.errors += 1
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_content_cache_from_env(name: str, env_prefix: str, default_ttl_sec: float, default_max_bytes: int) -> ContentCache | None:
+    """
+    環境変数からキャッシュを作る。
+
+    {env_prefix}:
+        sqlite: {env_prefix}_PATH の SQLite ファイル (開発用)
+        storage: 非公開のキャッシュ用ストレージ (create_cache_storage_backend) の cache/{name} 以下 (本番用)
+        未設定: キャッシュしない (None を返す)
+    {env_prefix}_TTL_SEC, {env_prefix}_MAX_BYTES: 有効期限と容量の上限
+    """
+    kind = os.getenv(env_prefix)
+    if not kind:
+        return None
+    ttl_sec = float(os.getenv(f"{env_prefix}_TTL_SEC") or default_ttl_sec)
+    max_bytes = int(os.getenv(f"{env_prefix}_MAX_BYTES") or default_max_bytes)
+    if kind == "sqlite":
+        store = SQLiteCacheStore(
+            os.getenv(f"{env_prefix}_PATH", f".cache/{name}_cache.sqlite3"),
+            ttl_sec=ttl_sec,
+            max_bytes=max_bytes,
+        )
+    elif kind == "storage":
+        store = StorageCacheStore(create_cache_storage_backend(), f"cache/{name}", ttl_sec=ttl_sec, max_bytes=max_bytes)
+    else:
+        raise ValueError(f"Invalid {name} cache: {kind}")
+    return ContentCache(store, name)
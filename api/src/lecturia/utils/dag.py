@@ -0,0 +1,127 @@
+import asyncio
+import inspect
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from loguru import logger
+from pydantic import BaseModel, ConfigDict
+
+from .async_tools import run_blocking
+
+
+class DagNode(BaseModel):
+    """
+    DAG のノード
+
+    Args:
+        name: ノード名。他のノードの deps から参照する
+        func: 処理。依存ノードの結果をノード名のキーワード引数で受け取る。同期関数は run_blocking のスレッドで実行する
+        deps: 依存するノード名
+        weight: 進捗の計算に使う重み
+        label: 実行中に表示する名前
+        expand: 完了後に結果から追加するノードを返す関数 (スライドごとのノードなど)
+        expand_weight: expand で追加されるノードの重みの合計。展開前の進捗の計算に使う
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    name: str
+    func: Callable[..., Any]
+    deps: list[str] = []
+    weight: float = 1.0
+    label: str | None = None
+    expand: Callable[[Any], list["DagNode"]] | None = None
+    expand_weight: float = 0.0
+
+
+ProgressCallback = Callable[[float, list[str]], None | Awaitable[None]]
+
+
+class DagExecutor:
+    """
+    依存関係が揃ったノードから順に、並行に実行する。
+    進捗は完了したノードの重みの割合 (0.0-1.0) として on_progress に通知する。
+
+    Args:
+        nodes: 初期ノード
+        on_progress: (進捗, 実行中ノードのラベル) を受け取るコールバック。async 関数なら完了を待つ
+    """
+
+    def __init__(self, nodes: list[DagNode], on_progress: ProgressCallback | None = None):
+        self._nodes: dict[str, DagNode] = {}
+        self._results: dict[str, Any] = {}
+        self._on_progress = on_progress
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: DagNode) -> None:
+        if node.name in self._nodes:
+            raise ValueError(f"Duplicate node: {node.name}")
+        self._nodes[node.name] = node
+
+    @property
+    def progress(self) -> float:
+        total = 0.0
+        done = 0.0
+        for name, node in self._nodes.items():
+            total += node.weight
+            if name in self._results:
+                done += node.weight
+            elif node.expand is not None:
+                total += node.expand_weight
+        return done / total if total > 0 else 1.0
+
+    async def _run_node(self, node: DagNode) -> Any:
+        kwargs = {dep: self._results[dep] for dep in node.deps}
+        if inspect.iscoroutinefunction(node.func):
+            return await node.func(**kwargs)
+        return await run_blocking(node.func, **kwargs)
+
+    async def _notify(self, running: dict[asyncio.Task, str]) -> None:
+        if self._on_progress is None:
+            return
+        labels: list[str] = []
+        for name in running.values():
+            label = self._nodes[name].label
+            if label and label not in labels:
+                labels.append(label)
+        result = self._on_progress(self.progress, labels)
+        if inspect.isawaitable(result):
+            await result
+
+    async def run(self) -> dict[str, Any]:
+        """
+        全てのノードを実行し、ノード名から結果への dict を返す。
+        いずれかのノードが失敗したら、実行中のノードをキャンセルして例外を送出する。
+        """
+        running: dict[asyncio.Task, str] = {}
+        started: set[str] = set()
+        try:
+            while True:
+                for name, node in list(self._nodes.items()):
+                    if name in started or not all(dep in self._results for dep in node.deps):
+                        continue
+                    started.add(name)
+                    running[asyncio.create_task(self._run_node(node), name=name)] = name
+                if not running:
+                    break
+                await self._notify(running)
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    node = self._nodes[name]
+                    self._results[name] = task.result()
+                    logger.debug(f"DAG node finished: {name}")
+                    if node.expand is not None:
+                        for child in node.expand(self._results[name]):
+                            self.add(child)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        unresolved = [name for name in self._nodes if name not in self._results]
+        if unresolved:
+            raise ValueError(f"Unresolved dependencies: {unresolved}")
+        await self._notify(running)
+        return self._results
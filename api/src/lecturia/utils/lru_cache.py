@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+
+_K = TypeVar("_K")
+_V = TypeVar("_V")
+
+
+class LRUCache(Generic[_K, _V]):
+    """
+    スレッドセーフな最大件数つきの LRU キャッシュ。
+    ttl_sec を指定すると、保存してから ttl_sec を過ぎたものは無効になる。
+    """
+
+    def __init__(self, maxsize: int = 128, ttl_sec: float | None = None):
+        self.maxsize = maxsize
+        self.ttl_sec = ttl_sec
+        self._data: OrderedDict[_K, tuple[_V, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: _K) -> _V | None:
+        with self._lock:
+            if key not in self._data:
+                return None
+            value, stored_at = self._data[key]
+            if self.ttl_sec is not None and time.monotonic() - stored_at > self.ttl_sec:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: _K, value: _V) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: _K) -> _V | None:
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item is not None else None
+
+    def __len__(self) -> int:
+        return len(self._data)
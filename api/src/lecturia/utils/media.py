@@ -1,5 +1,97 @@
+import io
+import re
+import wave
+
+import numpy as np
+from pydantic import BaseModel
 from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
+from pydub.silence import detect_nonsilent as pydub_detect_nonsilent
+from pydub.utils import db_to_float
+
+
+_SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def detect_silence(
+    audio: AudioSegment,
+    min_silence_len: int = 1000,
+    silence_thresh: float = -16,
+    seek_step: int = 1,
+) -> list[list[int]]:
+    """
+    pydub.silence.detect_silence の NumPy 版。結果も同じ [[開始ms, 終了ms], ...]。
+    二乗和の累積和から全ての窓の RMS を一度に計算する。
+    """
+    seg_len = len(audio)
+    if seg_len < min_silence_len:
+        return []
+
+    num_channels = audio.channels
+    samples = np.frombuffer(audio.raw_data, dtype=_SAMPLE_DTYPES[audio.sample_width])
+    num_frames = len(samples) // num_channels
+    # int16 までは int64 で二乗和が桁あふれしない
+    acc_dtype = np.int64 if audio.sample_width <= 2 else np.float64
+    squares = np.square(samples[:num_frames * num_channels], dtype=acc_dtype)
+    frame_squares = squares if num_channels == 1 else squares.reshape(num_frames, num_channels).sum(axis=1)
+    cumsum = np.empty(num_frames + 1, dtype=acc_dtype)
+    cumsum[0] = 0
+    np.cumsum(frame_squares, out=cumsum[1:])
+
+    last_slice_start = seg_len - min_silence_len
+    slice_starts = np.arange(0, last_slice_start + 1, seek_step)
+    if last_slice_start % seek_step:
+        slice_starts = np.append(slice_starts, last_slice_start)
+
+    # AudioSegment のスライスと同じく ms をフレーム位置に切り捨てで変換する
+    start_frames = (slice_starts * audio.frame_rate / 1000.0).astype(np.int64)
+    end_frames = ((slice_starts + min_silence_len) * audio.frame_rate / 1000.0).astype(np.int64)
+    # 末尾で足りないフレームはスライス時に無音で埋められるので、和には足さずに個数だけ数える
+    sums = cumsum[np.minimum(end_frames, num_frames)] - cumsum[np.minimum(start_frames, num_frames)]
+    counts = (end_frames - start_frames) * num_channels
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rms = np.where(counts > 0, np.floor(np.sqrt(sums / np.maximum(counts, 1))), 0)
+
+    threshold = db_to_float(silence_thresh) * audio.max_possible_amplitude
+    silence_starts = slice_starts[rms <= threshold]
+    if len(silence_starts) == 0:
+        return []
+
+    # 連続していない、かつ窓が重ならないところで区間を切る
+    diffs = np.diff(silence_starts)
+    breaks = np.nonzero((diffs != seek_step) & (diffs > min_silence_len))[0]
+    range_starts = np.concatenate([silence_starts[:1], silence_starts[breaks + 1]])
+    range_ends = np.concatenate([silence_starts[breaks], silence_starts[-1:]]) + min_silence_len
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+
+def detect_nonsilent(
+    audio: AudioSegment,
+    min_silence_len: int = 1000,
+    silence_thresh: float = -16,
+    seek_step: int = 1,
+) -> list[list[int]]:
+    """
+    pydub.silence.detect_nonsilent の NumPy 版。
+    """
+    if audio.sample_width not in _SAMPLE_DTYPES:
+        return pydub_detect_nonsilent(audio, min_silence_len, silence_thresh, seek_step)
+    silent_ranges = detect_silence(audio, min_silence_len, silence_thresh, seek_step)
+    len_seg = len(audio)
+    if not silent_ranges:
+        return [[0, len_seg]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == len_seg:
+        return []
+
+    prev_end = 0
+    nonsilent_ranges = []
+    for start, end in silent_ranges:
+        nonsilent_ranges.append([prev_end, start])
+        prev_end = end
+    if silent_ranges[-1][1] != len_seg:
+        nonsilent_ranges.append([prev_end, len_seg])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
 
 
 def remove_long_silence(
@@ -37,3 +129,85 @@ def detect_nonsilent_ranges(
     )
     # 結果は [ [開始ms, 終了ms], … ] なので秒単位へ整形
     return [(start/1000, end/1000) for start, end in ranges]
+
+
+class AudioAnalysis(BaseModel):
+    """
+    Args:
+        duration_sec: 音声の長さ (秒)
+        nonsilent_ranges: 非無音区間 [(開始秒, 終了秒), ...]
+    """
+    duration_sec: float
+    nonsilent_ranges: list[tuple[float, float]]
+
+
+class ProcessedAudio(BaseModel):
+    mp3: bytes
+    analysis: AudioAnalysis
+
+
+# Gemini TTS はヘッダなしの 16bit PCM (audio/L16;codec=pcm;rate=24000, モノラル) を返す
+_DEFAULT_PCM_RATE = 24000
+_RAW_PCM_MIME_TYPES = ("audio/l16", "audio/pcm")
+
+
+def is_wav(data: bytes) -> bool:
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def ensure_wav(data: bytes, mime_type: str | None = None) -> bytes:
+    """
+    TTS の応答を、後段が PCM のまま扱えるように WAV にそろえる。
+    WAV はそのまま返す。mime_type がヘッダなしの PCM (audio/L16, audio/pcm) なら、
+    mime_type の rate (なければ 24kHz)・モノラル・16bit リトルエンディアンとして WAV ヘッダを付ける。
+    それ以外 (MP3 などのコンテナ) はそのまま返し、audio_segment_from_tts で ffmpeg にデコードさせる。
+    """
+    if is_wav(data) or mime_type is None:
+        return data
+    media_type, _, params = mime_type.partition(";")
+    if media_type.strip().lower() not in _RAW_PCM_MIME_TYPES:
+        return data
+    rate = re.search(r"rate=(\d+)", params)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(int(rate.group(1)) if rate else _DEFAULT_PCM_RATE)
+        wf.writeframes(data)
+    return buf.getvalue()
+
+
+def audio_segment_from_tts(data: bytes) -> AudioSegment:
+    """
+    TTS の音声を AudioSegment にする。
+    WAV は PCM をそのまま使って ffmpeg でのデコードを省き、それ以外は AudioSegment.from_file でデコードする。
+    """
+    if not is_wav(data):
+        return AudioSegment.from_file(io.BytesIO(data))
+    with wave.open(io.BytesIO(data), "rb") as wf:
+        return AudioSegment(
+            data=wf.readframes(wf.getnframes()),
+            sample_width=wf.getsampwidth(),
+            frame_rate=wf.getframerate(),
+            channels=wf.getnchannels(),
+        )
+
+
+def analyze_audio(audio: AudioSegment) -> AudioAnalysis:
+    return AudioAnalysis(
+        duration_sec=len(audio) / 1000,
+        nonsilent_ranges=detect_nonsilent_ranges(audio),
+    )
+
+
+def process_tts_audio(data: bytes, remove_silence: bool = True, bitrate: str = "192k") -> ProcessedAudio:
+    """
+    TTS の音声を PCM のまま処理する (WAV 以外は最初に1回だけデコードする)。
+    長い無音の除去、非無音区間と長さの計算をしてから、最後に1回だけ MP3 にエンコードする。
+    """
+    audio = audio_segment_from_tts(data)
+    if remove_silence:
+        audio = remove_long_silence(audio)
+    buf = io.BytesIO()
+    audio.export(buf, format="mp3", bitrate=bitrate)
+    return ProcessedAudio(mp3=buf.getvalue(), analysis=analyze_audio(audio))
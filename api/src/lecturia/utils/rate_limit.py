@@ -0,0 +1,335 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from typing import Literal, TypeVar
+
+from loguru import logger
+from pydantic import BaseModel
+
+
+_T = TypeVar("_T")
+
+Provider = Literal["anthropic", "gemini", "vertex", "tts"]
+
+# 再試行するステータス。429/503/529 (Anthropic の overloaded) は混雑とみなして同時実行数も下げる
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504, 529}
+_THROTTLE_STATUS = {429, 503, 529}
+# ステータスを持たない一時的なエラー (タイムアウト・接続エラー)。SDK を import しないようにクラス名で判定する
+_TRANSIENT_ERRORS = {
+    "TimeoutError",
+    "ConnectionError",
+    "APITimeoutError",
+    "APIConnectionError",
+    "TransportError",
+    "ServerDisconnectedError",
+}
+
+# 同時実行数の空きを待つときのポーリング間隔
+_POLL_SEC = 0.05
+
+
+class ProviderLimits(BaseModel):
+    """
+    Args:
+        rpm: 1分あたりのリクエスト数の上限。None なら無制限
+        tpm: 1分あたりのトークン数の上限。None なら無制限
+        initial_concurrency: 同時実行数の初期値
+        min_concurrency: 同時実行数の下限
+        max_concurrency: 同時実行数の上限
+        max_retries: 再試行できるエラーのときに再試行する回数
+        backoff_base_sec: 再試行の待ち時間の基準 (attempt ごとに倍にし、その範囲でランダムに待つ)
+        backoff_max_sec: 再試行の待ち時間の上限
+    """
+    rpm: float | None = None
+    tpm: float | None = None
+    initial_concurrency: float = 3
+    min_concurrency: float = 1
+    max_concurrency: float = 16
+    max_retries: int = 5
+    backoff_base_sec: float = 1.0
+    backoff_max_sec: float = 60.0
+
+
+_DEFAULT_LIMITS: dict[str, ProviderLimits] = {
+    "anthropic": ProviderLimits(rpm=50, max_concurrency=8),
+    "gemini": ProviderLimits(rpm=150),
+    "vertex": ProviderLimits(rpm=300),
+    "tts": ProviderLimits(rpm=60, initial_concurrency=8, max_concurrency=32),
+}
+
+
+def limits_from_env(provider: str) -> ProviderLimits:
+    """
+    LECTURIA_RATE_LIMIT_{PROVIDER}_RPM / _TPM / _MAX_CONCURRENCY でデフォルトの上限を上書きする
+    """
+    limits = _DEFAULT_LIMITS.get(provider, ProviderLimits())
+    prefix = f"LECTURIA_RATE_LIMIT_{provider.upper()}"
+    update: dict[str, float] = {}
+    for key in ("rpm", "tpm", "max_concurrency"):
+        value = os.getenv(f"{prefix}_{key.upper()}")
+        if value:
+            update[key] = float(value)
+    return limits.model_copy(update=update)
+
+
+def google_provider() -> Provider:
+    """Gemini を Vertex AI 経由で呼ぶ環境かどうか"""
+    if "GOOGLE_APPLICATION_CREDENTIALS" in os.environ or "K_SERVICE" in os.environ:
+        return "vertex"
+    return "gemini"
+
+
+def estimate_tokens(text: str) -> int:
+    """TPM の計算に使うトークン数の概算。ASCII は約4文字、それ以外は約1文字で1トークン"""
+    num_ascii = sum(1 for c in text if c.isascii())
+    return num_ascii // 4 + (len(text) - num_ascii)
+
+
+def error_status(exc: BaseException) -> int | None:
+    """
+    各 SDK の例外から HTTP ステータスを取り出す。
+    anthropic は status_code、google-genai と google-api-core は code、httpx は response.status_code。
+    """
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return int(value)
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_transient(exc: BaseException) -> bool:
+    """再試行すれば成功する見込みのあるエラーか"""
+    if error_status(exc) in _RETRYABLE_STATUS:
+        return True
+    return any(cls.__name__ in _TRANSIENT_ERRORS for cls in type(exc).__mro__)
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    1分あたり rate_per_min だけ補充されるトークンバケット。排他はしないので呼び出し側でロックする。
+    """
+
+    def __init__(self, rate_per_min: float):
+        self.capacity = rate_per_min
+        self.tokens = rate_per_min
+        self._refill_per_sec = rate_per_min / 60
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self._refill_per_sec)
+        self._updated_at = now
+
+    def wait_sec(self, amount: float, now: float) -> float:
+        """amount だけ取り出せるようになるまでの秒数。容量を超える量は容量まで待つ"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self._refill_per_sec
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    プロバイダごとの流量制御。プロセス内の全ての講義で共有する。
+
+    - RPM / TPM をトークンバケットで制限する
+    - 同時実行数を AIMD で調整する (成功ごとに 1/limit ずつ増やし、429/503 で半分にする)
+    - 再試行できるエラーはジッター付きの指数バックオフで再試行する。Retry-After があればその間は新規の呼び出しを止める
+
+    スレッドからの同期呼び出し (run) と非同期呼び出し (arun) の両方で使える。
+    """
+
+    def __init__(self, name: str, limits: ProviderLimits):
+        self.name = name
+        self.limits = limits
+        # 環境変数で max_concurrency だけ下げた場合も、初期値から上限を守る
+        self.limit = min(max(limits.initial_concurrency, limits.min_concurrency), limits.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.successes = 0
+        self.throttled = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._request_bucket = TokenBucket(limits.rpm) if limits.rpm else None
+        self._token_bucket = TokenBucket(limits.tpm) if limits.tpm else None
+        self._paused_until = 0.0
+        self._last_decrease_at = 0.0
+
+    def _try_acquire(self, tokens: int) -> float:
+        """取得できたら 0 を、できなければ次に試すまでの秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.in_flight >= max(1, int(self.limit)):
+                return _POLL_SEC
+            wait = 0.0
+            if self._request_bucket is not None:
+                wait = max(wait, self._request_bucket.wait_sec(1, now))
+            if self._token_bucket is not None and tokens > 0:
+                wait = max(wait, self._token_bucket.wait_sec(tokens, now))
+            if wait > 0:
+                return wait
+            if self._request_bucket is not None:
+                self._request_bucket.take(1)
+            if self._token_bucket is not None and tokens > 0:
+                self._token_bucket.take(tokens)
+            self.in_flight += 1
+            self.requests += 1
+            return 0.0
+
+    def _release(self, outcome: Literal["success", "throttled", "error"], retry_after: float | None = None) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome == "success":
+                self.successes += 1
+                self.limit = min(self.limits.max_concurrency, self.limit + 1 / self.limit)
+            elif outcome == "throttled":
+                self.throttled += 1
+                # 同時に返ってきた 429 で何度も半減しないように、減らすのは基準の待ち時間に1回まで
+                if now - self._last_decrease_at >= self.limits.backoff_base_sec:
+                    self.limit = max(self.limits.min_concurrency, self.limit / 2)
+                    self._last_decrease_at = now
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+
+    def _should_retry(self, exc: Exception, attempt: int, max_retries: int | None) -> float | None:
+        """スロットを解放し、再試行するならその前に待つ秒数を返す"""
+        status = error_status(exc)
+        retry_after = _retry_after(exc)
+        self._release("throttled" if status in _THROTTLE_STATUS else "error", retry_after)
+        if max_retries is None:
+            max_retries = self.limits.max_retries
+        if not is_transient(exc) or attempt >= max_retries:
+            with self._lock:
+                self.failures += 1
+            return None
+        with self._lock:
+            self.retries += 1
+        delay = random.uniform(0, min(self.limits.backoff_max_sec, self.limits.backoff_base_sec * 2 ** attempt))
+        delay = max(delay, retry_after or 0.0)
+        reason = f"{status} {type(exc).__name__}" if status else type(exc).__name__
+        logger.warning(f"[{self.name}] {reason}, retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    async def arun(
+        self, func: Callable[[], Awaitable[_T]], tokens: int = 0, max_retries: int | None = None
+    ) -> _T:
+        """
+        流量制御の下で func() を実行する。再試行のたびに func を呼び直すので、コルーチンを返す関数を渡す。
+        max_retries を指定すると、この呼び出しだけ limits.max_retries の代わりに使う。
+        """
+        attempt = 0
+        while True:
+            with self._lock:
+                self.waiting += 1
+            try:
+                while (wait := self._try_acquire(tokens)) > 0:
+                    await asyncio.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._should_retry(e, attempt, max_retries)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # キャンセル
+                self._release("error")
+                raise
+            self._release("success")
+            return result
+
+    def run(self, func: Callable[[], _T], tokens: int = 0, max_retries: int | None = None) -> _T:
+        """arun の同期版。スレッドから呼ぶ"""
+        attempt = 0
+        while True:
+            with self._lock:
+                self.waiting += 1
+            try:
+                while (wait := self._try_acquire(tokens)) > 0:
+                    time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._should_retry(e, attempt, max_retries)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self._release("error")
+                raise
+            self._release("success")
+            return result
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            now = time.monotonic()
+            stats: dict[str, float] = {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "requests": self.requests,
+                "successes": self.successes,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "failures": self.failures,
+                "paused_sec": max(0.0, self._paused_until - now),
+            }
+            if self._request_bucket is not None:
+                self._request_bucket.wait_sec(0, now)
+                stats["rpm_available"] = round(self._request_bucket.tokens, 1)
+            if self._token_bucket is not None:
+                self._token_bucket.wait_sec(0, now)
+                stats["tpm_available"] = round(self._token_bucket.tokens, 1)
+            return stats
+
+
+_RATE_LIMITERS: dict[str, RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(provider: Provider) -> RateLimiter:
+    """プロセスで共有するプロバイダの RateLimiter を返す"""
+    limiter = _RATE_LIMITERS.get(provider)
+    if limiter is None:
+        with _RATE_LIMITERS_LOCK:
+            limiter = _RATE_LIMITERS.get(provider)
+            if limiter is None:
+                limiter = RateLimiter(provider, limits_from_env(provider))
+                _RATE_LIMITERS[provider] = limiter
+    return limiter
+
+
+def rate_limiter_stats() -> dict[str, dict[str, float]]:
+    return {name: limiter.stats() for name, limiter in _RATE_LIMITERS.items()}
@@ -0,0 +1,263 @@
+import asyncio
+import bisect
+import contextvars
+import math
+import os
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TypeVar
+
+from loguru import logger
+from pydantic import BaseModel
+
+from .rate_limit import RateLimiter
+
+
+_T = TypeVar("_T")
+
+# 10ms から約 30 分まで、1.25 倍ずつの区間
+_BUCKET_BOUNDS = [0.01 * 1.25 ** i for i in range(int(math.log(180000, 1.25)) + 1)]
+
+# 同期 SDK の呼び出し専用のスレッドプール。スレッドの処理は止められないので、タイムアウトした呼び出しは
+# 終わるまでスレッドに残ったまま結果を捨てる。見捨てた呼び出しが DB やストレージの処理 (run_blocking) の
+# スレッドを塞がないようにプールを分け、その分を見込んだ数にしておく (LECTURIA_CALL_WORKERS)
+_CALL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LECTURIA_CALL_WORKERS") or 32),
+    thread_name_prefix="lecturia-call",
+)
+
+
+class CallPolicy(BaseModel):
+    """
+    Args:
+        timeout_sec: 1回の呼び出しのタイムアウト。超えたら一時的なエラーとして再試行する。None なら無制限
+        max_retries: 再試行する回数の上限。None なら limiter の ProviderLimits.max_retries に従う
+        hedge: 一定時間応答がなければ同じリクエストをもう1つ投げ、先に成功した方を使う
+        hedge_quantile: ヘッジするまでの待ち時間に使うレイテンシの分位点
+        min_hedge_delay_sec: ヘッジするまでの待ち時間の下限
+        min_samples: ヘッジに必要なレイテンシの記録数。少ないうちはヘッジしない
+    """
+    timeout_sec: float | None = None
+    max_retries: int | None = None
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    min_hedge_delay_sec: float = 1.0
+    min_samples: int = 20
+
+
+class LatencyHistogram:
+    """
+    呼び出しごとのレイテンシのヒストグラム (対数区間)。分位点はその区間の上限で近似する。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total_sec = 0.0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency_sec: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(_BUCKET_BOUNDS, latency_sec)] += 1
+            self.count += 1
+            self.total_sec += latency_sec
+
+    def quantile(self, q: float) -> float | None:
+        with self._lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            cumulative = 0
+            for i, count in enumerate(self.counts):
+                cumulative += count
+                if cumulative >= rank:
+                    return _BUCKET_BOUNDS[min(i, len(_BUCKET_BOUNDS) - 1)]
+            return _BUCKET_BOUNDS[-1]
+
+    def stats(self) -> dict[str, float | None]:
+        return {
+            "count": self.count,
+            "mean_sec": self.total_sec / self.count if self.count else None,
+            "p50_sec": self.quantile(0.5),
+            "p95_sec": self.quantile(0.95),
+            "p99_sec": self.quantile(0.99),
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+_HISTOGRAMS: dict[str, LatencyHistogram] = {}
+_HISTOGRAMS_LOCK = threading.Lock()
+
+
+def get_latency_histogram(operation: str) -> LatencyHistogram:
+    """プロセスで共有する操作ごとのヒストグラムを返す"""
+    histogram = _HISTOGRAMS.get(operation)
+    if histogram is None:
+        with _HISTOGRAMS_LOCK:
+            histogram = _HISTOGRAMS.setdefault(operation, LatencyHistogram(operation))
+    return histogram
+
+
+def latency_stats() -> dict[str, dict[str, float | None]]:
+    return {name: histogram.stats() for name, histogram in _HISTOGRAMS.items()}
+
+
+def _hedge_delay(histogram: LatencyHistogram, policy: CallPolicy) -> float | None:
+    if not policy.hedge or histogram.count < policy.min_samples:
+        return None
+    delay = histogram.quantile(policy.hedge_quantile)
+    if delay is None:
+        return None
+    delay = max(policy.min_hedge_delay_sec, delay)
+    # タイムアウトより後にヘッジしても意味がない
+    if policy.timeout_sec is not None and delay >= policy.timeout_sec:
+        return None
+    return delay
+
+
+async def resilient_acall(
+    operation: str,
+    limiter: RateLimiter,
+    func: Callable[[], Awaitable[_T]],
+    policy: CallPolicy | None = None,
+    tokens: int = 0,
+) -> _T:
+    """
+    func() を limiter の流量制御と再試行の下で、タイムアウトとヘッジを付けて実行する。
+    成功した呼び出しのレイテンシを operation のヒストグラムに記録し、ヘッジまでの待ち時間に使う。
+    再試行のたびに func を呼び直すので、コルーチンを返す関数を渡す。
+    """
+    policy = policy or CallPolicy()
+    histogram = get_latency_histogram(operation)
+
+    async def _timed() -> _T:
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(func(), policy.timeout_sec)
+        except TimeoutError:
+            histogram.timeouts += 1
+            raise TimeoutError(f"{operation} timed out after {policy.timeout_sec}s") from None
+        histogram.record(time.monotonic() - start)
+        return result
+
+    def _attempt() -> Awaitable[_T]:
+        return limiter.arun(_timed, tokens=tokens, max_retries=policy.max_retries)
+
+    delay = _hedge_delay(histogram, policy)
+    if delay is None:
+        return await _attempt()
+
+    primary = asyncio.ensure_future(_attempt())
+    pending = {primary}
+    error: BaseException | None = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+        logger.info(f"[{operation}] no response in {delay:.2f}s, sending a hedged request")
+        histogram.hedges += 1
+        hedged = asyncio.ensure_future(_attempt())
+        pending.add(hedged)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedged:
+                        histogram.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # 負けた方 (または呼び出し元のキャンセル時は両方) を止める
+        for task in pending:
+            task.cancel()
+
+
+def _submit_call(func: Callable[[], _T], on_start: Callable[[], None]) -> "Future[_T]":
+    """func を _CALL_EXECUTOR で実行する。スレッドで実行が始まったら on_start を呼ぶ"""
+    def _run() -> _T:
+        on_start()
+        return func()
+
+    return _CALL_EXECUTOR.submit(contextvars.copy_context().run, _run)
+
+
+async def resilient_acall_in_thread(
+    operation: str,
+    limiter: RateLimiter,
+    func: Callable[[], _T],
+    policy: CallPolicy | None = None,
+    tokens: int = 0,
+) -> _T:
+    """
+    同期 SDK の呼び出し func() を、limiter の枠を取ってから _CALL_EXECUTOR のスレッドで実行する。
+    タイムアウトはスレッドで実行が始まってから数えるので、見捨てた呼び出しでプールが埋まっていても
+    順番待ちの呼び出しがそのままタイムアウトすることはない。
+    スレッドの処理は止められず、負けたリクエストも最後まで走るので policy.hedge は使わない。
+    """
+    policy = policy or CallPolicy()
+    histogram = get_latency_histogram(operation)
+
+    async def _timed() -> _T:
+        loop = asyncio.get_running_loop()
+        started = asyncio.Event()
+        future = asyncio.wrap_future(_submit_call(func, lambda: loop.call_soon_threadsafe(started.set)))
+        try:
+            await started.wait()
+        except asyncio.CancelledError:
+            # まだ始まっていなければキューから外れる
+            future.cancel()
+            raise
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(future, policy.timeout_sec)
+        except TimeoutError:
+            histogram.timeouts += 1
+            raise TimeoutError(f"{operation} timed out after {policy.timeout_sec}s") from None
+        histogram.record(time.monotonic() - start)
+        return result
+
+    return await limiter.arun(_timed, tokens=tokens, max_retries=policy.max_retries)
+
+
+def resilient_call(
+    operation: str,
+    limiter: RateLimiter,
+    func: Callable[[], _T],
+    policy: CallPolicy | None = None,
+    tokens: int = 0,
+) -> _T:
+    """
+    resilient_acall の同期版。スレッドから呼ぶ。
+    タイムアウトは _CALL_EXECUTOR のスレッドで実行して、実行が始まってから待つ時間を区切る
+    (止められないので結果を捨てる)。ヘッジはしない。
+    """
+    policy = policy or CallPolicy()
+    histogram = get_latency_histogram(operation)
+
+    def _timed() -> _T:
+        start = time.monotonic()
+        if policy.timeout_sec is None:
+            result = func()
+        else:
+            started = threading.Event()
+            future = _submit_call(func, started.set)
+            started.wait()
+            start = time.monotonic()
+            try:
+                result = future.result(timeout=policy.timeout_sec)
+            except TimeoutError:
+                histogram.timeouts += 1
+                raise TimeoutError(f"{operation} timed out after {policy.timeout_sec}s") from None
+        histogram.record(time.monotonic() - start)
+        return result
+
+    return limiter.run(_timed, tokens=tokens, max_retries=policy.max_retries)
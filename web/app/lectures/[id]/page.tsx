@@ -48,7 +48,14 @@ export default async function LecturePage({
   const { events } = await eventsResp.json();
   manifest.events = events;
   manifest.slideUrl = `${process.env.NEXT_PUBLIC_LECTURIA_API_ORIGIN}${manifest.slideUrl}`;
-  manifest.audioUrls = manifest.audioUrls.map((url: string) => url);
+  // API から配信するモードではメディアのURLが /static/... の相対パスで返る
+  const resolveUrl = (url: string) =>
+    url.startsWith('/') ? `${process.env.NEXT_PUBLIC_LECTURIA_API_ORIGIN}${url}` : url;
+  manifest.audioUrls = manifest.audioUrls.map(resolveUrl);
+  manifest.quizSfxUrl = resolveUrl(manifest.quizSfxUrl);
+  manifest.sprites = Object.fromEntries(
+    Object.entries(manifest.sprites as Record<string, string>).map(([side, url]) => [side, resolveUrl(url)]),
+  );
 
   return (
     <div className="relative">